@@ -0,0 +1,84 @@
+"""
+Controle de admissão: recusa requisições rapidamente quando o worker está
+saturado, em vez de deixá-las enfileiradas até o cliente desistir.
+
+Uma requisição é recusada com 503 + Retry-After quando:
+  - já há ADMISSION_MAX_IN_FLIGHT requisições em andamento no processo; ou
+  - ADMISSION_MAX_POOL_WAITERS requisições já aguardam conexão do pool; ou
+  - a espera por conexão (a mais antiga em curso ou a média recente)
+    passa de ADMISSION_MAX_POOL_WAIT_MS.
+
+Um limite igual a 0 desliga a verificação correspondente. As rotas de
+saúde e os probes (ROTAS_ISENTAS) nunca são recusados.
+"""
+import os
+import threading
+
+from flask import g, jsonify, make_response, request
+
+from banco import estatisticas_pool
+
+ROTAS_ISENTAS = {'/db-status', '/healthz', '/readyz'}
+
+_lock = threading.Lock()
+_em_andamento = 0
+
+
+def _limite(nome, padrao):
+    return float(os.getenv(nome, padrao))
+
+
+def requisicoes_em_andamento():
+    return _em_andamento
+
+
+def motivo_para_recusar():
+    """Retorna o motivo da recusa ou None se a requisição pode entrar."""
+    max_em_andamento = _limite('ADMISSION_MAX_IN_FLIGHT', '64')
+    if max_em_andamento and _em_andamento >= max_em_andamento:
+        return 'requisições em andamento'
+
+    pool = estatisticas_pool()
+    max_esperando = _limite('ADMISSION_MAX_POOL_WAITERS', '0')
+    if max_esperando and pool['esperando'] >= max_esperando:
+        return 'fila do pool de conexões'
+
+    max_espera_ms = _limite('ADMISSION_MAX_POOL_WAIT_MS', '1000')
+    espera_ms = max(pool['espera_mais_antiga_ms'], pool['espera_media_ms'])
+    if max_espera_ms and espera_ms >= max_espera_ms:
+        return 'espera por conexão do banco'
+
+    return None
+
+
+def _antes_da_requisicao():
+    global _em_andamento
+    if request.path in ROTAS_ISENTAS:
+        return None
+
+    with _lock:
+        motivo = motivo_para_recusar()
+        if motivo is None:
+            _em_andamento += 1
+            g.admitida = True
+            return None
+
+    resposta = make_response(jsonify({
+        "error": "Servidor sobrecarregado. Tente novamente em instantes.",
+        "motivo": motivo
+    }), 503)
+    resposta.headers['Retry-After'] = os.getenv('ADMISSION_RETRY_AFTER', '1')
+    return resposta
+
+
+def _fim_da_requisicao(_exc):
+    global _em_andamento
+    if g.pop('admitida', False):
+        with _lock:
+            _em_andamento -= 1
+
+
+def registrar(app):
+    """Instala o controle de admissão no app, antes de qualquer blueprint."""
+    app.before_request(_antes_da_requisicao)
+    app.teardown_request(_fim_da_requisicao)
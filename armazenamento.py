@@ -0,0 +1,216 @@
+"""
+Armazenamento das fotos, compartilhado por todos os Blueprints.
+
+O backend é escolhido por STORAGE_BACKEND:
+    replit  Object Storage do Replit (padrão). O Client (e o
+            google-cloud-storage que ele importa) só é carregado no
+            primeiro uso.
+    local   diretório STORAGE_DIR (padrão dados/storage). Gravação atômica
+            (arquivo temporário + os.replace) e envio pelo sendfile do
+            servidor; serve para desenvolvimento, testes e benchmarks sem
+            rede.
+
+Os dois oferecem enviar, abrir (leitura em streaming), deletar, existe
+(head) e listar. As rotas usam as funções deste módulo, que registram a
+fase 'storage' do Server-Timing; servir() monta a resposta HTTP da foto.
+"""
+import contextlib
+import heapq
+import os
+import tempfile
+import threading
+import uuid
+from io import BytesIO
+
+from flask import send_file
+
+from tempos import medir
+
+
+class BackendReplit:
+    """Object Storage do Replit."""
+
+    def __init__(self):
+        # Import pesado: adiado até a primeira foto enviada ou baixada
+        from replit.object_storage import Client
+
+        self.client = Client()
+
+    def enviar(self, nome, dados):
+        self.client.upload_from_bytes(nome, dados)
+
+    def abrir(self, nome):
+        # O Client não expõe download em streaming: o objeto vem inteiro
+        return BytesIO(self.client.download_as_bytes(nome))
+
+    def caminho(self, _nome):
+        return None
+
+    def deletar(self, nome):
+        self.client.delete(nome, ignore_not_found=True)
+
+    def existe(self, nome):
+        return self.client.exists(nome)
+
+    def listar(self, prefixo, apos, maximo):
+        objetos = self.client.list(prefix=prefixo or None, start_offset=apos,
+                                   max_results=maximo + 1 if apos else maximo)
+        nomes = [objeto.name for objeto in objetos]
+        if apos and nomes and nomes[0] == apos:
+            nomes = nomes[1:]
+        return nomes[:maximo]
+
+
+class BackendLocal:
+    """Um arquivo por objeto num diretório local."""
+
+    PREFIXO_TEMPORARIO = '.tmp-'
+
+    def __init__(self, pasta):
+        self.pasta = os.path.realpath(pasta)
+        os.makedirs(self.pasta, exist_ok=True)
+
+    def caminho(self, nome):
+        caminho = os.path.realpath(os.path.join(self.pasta, nome))
+        if os.path.dirname(caminho) != self.pasta:
+            raise ValueError(f"Nome de objeto inválido: {nome!r}")
+        return caminho
+
+    def enviar(self, nome, dados):
+        destino = self.caminho(nome)
+        # Temporário no mesmo diretório: os.replace é atômico no mesmo sistema
+        # de arquivos, e quem lê nunca vê um arquivo pela metade
+        descritor, temporario = tempfile.mkstemp(dir=self.pasta,
+                                                 prefix=self.PREFIXO_TEMPORARIO)
+        try:
+            with os.fdopen(descritor, 'wb') as arquivo:
+                arquivo.write(dados)
+                arquivo.flush()
+                os.fsync(arquivo.fileno())
+            os.replace(temporario, destino)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(temporario)
+            raise
+
+    def abrir(self, nome):
+        return open(self.caminho(nome), 'rb')
+
+    def deletar(self, nome):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.caminho(nome))
+
+    def existe(self, nome):
+        return os.path.isfile(self.caminho(nome))
+
+    def listar(self, prefixo, apos, maximo):
+        # nsmallest mantém só 'maximo' nomes em memória por página
+        with os.scandir(self.pasta) as entradas:
+            nomes = (
+                entrada.name for entrada in entradas
+                if entrada.name.startswith(prefixo or '')
+                and not entrada.name.startswith(self.PREFIXO_TEMPORARIO)
+                and (apos is None or entrada.name > apos)
+                and entrada.is_file()
+            )
+            return heapq.nsmallest(maximo, nomes)
+
+
+_backend = None
+_lock = threading.Lock()
+
+
+def _criar_backend():
+    tipo = os.getenv('STORAGE_BACKEND', 'replit')
+    if tipo == 'replit':
+        return BackendReplit()
+    if tipo == 'local':
+        return BackendLocal(os.getenv('STORAGE_DIR', 'dados/storage'))
+    raise ValueError(f"STORAGE_BACKEND desconhecido: {tipo!r}")
+
+
+def obter_backend():
+    """Retorna o backend configurado, criando-o na primeira chamada."""
+    global _backend
+    if _backend is None:
+        with _lock:
+            if _backend is None:
+                _backend = _criar_backend()
+    return _backend
+
+
+def reiniciar():
+    """Descarta o backend herdado do processo pai (gunicorn post_fork)."""
+    global _backend
+    with _lock:
+        _backend = None
+
+
+def enviar(nome, dados):
+    """Grava 'dados' (bytes) no objeto 'nome', substituindo se existir."""
+    with medir('storage'):
+        obter_backend().enviar(nome, dados)
+
+
+def abrir(nome):
+    """Retorna um arquivo binário (somente leitura) com o conteúdo de 'nome'."""
+    with medir('storage'):
+        return obter_backend().abrir(nome)
+
+
+def baixar(nome):
+    """Retorna o conteúdo do objeto 'nome' como bytes."""
+    with medir('storage'):
+        with obter_backend().abrir(nome) as arquivo:
+            return arquivo.read()
+
+
+def servir(nome, mimetype):
+    """
+    Resposta HTTP com o objeto 'nome'. No backend local o arquivo vai pelo
+    caminho: o gunicorn o envia com sendfile e o Flask responde aos
+    cabeçalhos condicionais (If-Modified-Since / If-None-Match).
+    """
+    caminho = obter_backend().caminho(nome)
+    if caminho is not None:
+        return send_file(caminho, mimetype=mimetype, as_attachment=False)
+    return send_file(abrir(nome), mimetype=mimetype, as_attachment=False)
+
+
+def deletar(nome):
+    """Remove o objeto 'nome'; não falha se ele já não existir."""
+    with medir('storage'):
+        obter_backend().deletar(nome)
+
+
+def listar(prefixo='', apos=None, maximo=1000):
+    """
+    Uma página de nomes de objetos com 'prefixo', em ordem lexicográfica,
+    começando depois de 'apos' (exclusivo). Página vazia = fim da listagem.
+    """
+    with medir('storage'):
+        return obter_backend().listar(prefixo, apos, maximo)
+
+
+def existe(nome):
+    with medir('storage'):
+        return obter_backend().existe(nome)
+
+
+def nova_chave_foto(prefixo, nome_original):
+    """
+    Chave nova a cada upload ('gestor_7_perfil_3f9c...jpg'): a foto antiga
+    continua válida até o UPDATE ser confirmado e só então é apagada.
+    """
+    extensao = os.path.splitext(nome_original)[1] if nome_original else '.jpg'
+    return f"{prefixo}_{uuid.uuid4().hex[:16]}{extensao or '.jpg'}"
+
+
+def descartar(nome):
+    """Apaga o objeto 'nome' sem propagar erros (limpeza e compensação)."""
+    if not nome:
+        return
+    try:
+        deletar(nome)
+    except Exception as e:
+        print(f"Aviso: não foi possível apagar '{nome}' do storage: {e}")
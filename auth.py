@@ -1,20 +1,29 @@
+import hmac
+import os
 from functools import wraps
 
 import jwt
-from flask import Blueprint, current_app, jsonify, request
+from flask import Blueprint, current_app, g, jsonify, request
 from jwt import ExpiredSignatureError, InvalidSignatureError
 
+import revogacao
+from banco import get_db_connection, registrar_escrita, release_db_connection
+from tempos import medir
+
 # 1. Definição do Blueprint para rotas de autenticação
 auth_bp = Blueprint('auth', __name__)
 
 # O decorador agora aceita o argumento role_necessaria
-def token_obrigatorio(role_necessaria):
+def token_obrigatorio(role_necessaria, permitir_revogado=False):
     """
     Decorador que verifica o token JWT.
 
     Aceita um argumento role_necessaria (ex: 'gestor' ou 'cliente') 
     e verifica se o 'role' no payload do token corresponde ao necessário.
 
+    Tokens revogados (revogacao.py) são recusados com 401, exceto com
+    permitir_revogado=True (ex.: acompanhar a tarefa de exclusão da conta).
+
     Passa o payload (dados_usuario) para a função decorada.
     """
 
@@ -43,11 +52,12 @@ def token_obrigatorio(role_necessaria):
                     # Falha se a chave secreta não estiver configurada
                     raise Exception("SESSION_SECRET não configurado.")
 
-                dados_usuario = jwt.decode(
-                    token, 
-                    session_secret, 
-                    algorithms=["HS256"]
-                )
+                with medir('jwt'):
+                    dados_usuario = jwt.decode(
+                        token, 
+                        session_secret, 
+                        algorithms=["HS256"]
+                    )
 
                 # 3. VERIFICAÇÃO DE PERFIL (ROLE)
                 token_role = dados_usuario.get('role')
@@ -55,6 +65,10 @@ def token_obrigatorio(role_necessaria):
                      # Se o perfil no token não for o esperado para a rota
                      return jsonify({'error': f'Acesso negado. Necessário perfil: {role_necessaria}.'}), 403
 
+                # 4. REVOGAÇÃO: só consulta o banco se o filtro de Bloom acusar
+                if not permitir_revogado and revogacao.esta_revogado(dados_usuario):
+                    return jsonify({'error': 'Token revogado.'}), 401
+
             except ExpiredSignatureError:
                 return jsonify({'error': 'Token expirado.'}), 401
             except InvalidSignatureError:
@@ -63,7 +77,10 @@ def token_obrigatorio(role_necessaria):
                 print(f"Erro ao processar token: {e}")
                 return jsonify({'error': 'Erro interno do servidor ou token malformado.'}), 500
 
-            # 4. Passa os dados do token (payload) para a função decorada
+            # 5. Passa os dados do token (payload) para a função decorada.
+            # Também ficam em g para identificar o usuário fora da rota
+            # (ex.: leitura após escrita no banco.py).
+            g.dados_usuario = dados_usuario
             return f(dados_usuario, *args, **kwargs)
 
         return decorated
@@ -71,6 +88,27 @@ def token_obrigatorio(role_necessaria):
     return decorator
 
 
+def admin_obrigatorio(f):
+    """
+    Decorador das rotas administrativas (diagnóstico): exige o cabeçalho
+    'X-Admin-Token' igual a ADMIN_TOKEN. Sem ADMIN_TOKEN configurado as
+    rotas respondem 404, como se não existissem.
+    """
+
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        esperado = os.getenv('ADMIN_TOKEN')
+        if not esperado:
+            return jsonify({'error': 'Não encontrado.'}), 404
+
+        enviado = request.headers.get('X-Admin-Token', '')
+        if not hmac.compare_digest(esperado.encode('utf-8'), enviado.encode('utf-8')):
+            return jsonify({'error': 'Acesso negado.'}), 403
+        return f(*args, **kwargs)
+
+    return decorated
+
+
 # Rota: Verificar Validade do Token (Gestor/Cliente)
 @auth_bp.route('/token/verificar', methods=['POST'])
 def verificar_token():
@@ -99,6 +137,14 @@ def verificar_token():
         # A função jwt.decode, por padrão, verifica a expiração (exp)
         decoded = jwt.decode(token, current_app.config['SESSION_SECRET'], algorithms=['HS256'])
 
+        if revogacao.esta_revogado(decoded):
+            return jsonify({
+                "valid": False,
+                "expired": False,
+                "revoked": True,
+                "message": "Token JWT revogado."
+            }), 200
+
         # Token VÁLIDO
         return jsonify({
             "valid": True,
@@ -132,3 +178,48 @@ def verificar_token():
             "expired": False,
             "message": "Erro interno do servidor ao processar o token."
         }), 500
+
+
+# Rota: Revogar o Token Atual (Logout)
+@auth_bp.route('/token/revogar', methods=['POST'])
+def revogar_token():
+    """
+    POST /token/revogar
+    Revoga o token enviado no cabeçalho Authorization (logout), antes da expiração.
+    Requer: Token JWT válido (gestor ou cliente).
+    Retorna: Mensagem de sucesso ou erro (400, 401, 500).
+    """
+    token = request.headers.get('Authorization', '')
+    if not token.startswith('Bearer '):
+        return jsonify({'error': 'Token de autenticação ausente.'}), 401
+
+    try:
+        dados_usuario = jwt.decode(token.split(' ')[1],
+                                   current_app.config['SESSION_SECRET'],
+                                   algorithms=['HS256'])
+    except jwt.InvalidTokenError:
+        return jsonify({'error': 'Token inválido ou expirado.'}), 401
+
+    if not dados_usuario.get('jti'):
+        # Tokens emitidos antes do 'jti' só expiram sozinhos
+        return jsonify({'error': 'Token sem identificador; não pode ser revogado.'}), 400
+
+    conn = get_db_connection()
+    if conn is None:
+        return jsonify({"error": "Falha na conexão com o banco de dados"}), 500
+
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                revogacao.revogar_token(cur, dados_usuario)
+                conn.commit()
+        registrar_escrita()
+        return jsonify({"message": "Token revogado com sucesso."}), 200
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Erro ao revogar token: {e}")
+        return jsonify({"error": "Erro interno ao revogar token."}), 500
+
+    finally:
+        release_db_connection(conn)
@@ -1,42 +1,365 @@
+import itertools
 import os
+import threading
+import time
 
 import psycopg2
-from flask import Blueprint, jsonify
+import psycopg2.extensions
+from flask import Blueprint, g, has_request_context, jsonify, request
+from psycopg2 import pool
+
+from consultas_lentas import CursorMonitorado
+from tempos import medir
 
 banco_bp = Blueprint('banco', __name__)
 
 
-def get_db_connection():
-  db_host = os.getenv("DB_HOST")
-  db_port = os.getenv("DB_PORT")
-  db_name = os.getenv("DB_NAME")
-  db_user = os.getenv("DB_USER")
+class ConexaoPreparada(psycopg2.extensions.connection):
+  """
+  Conexão do pool que lembra quais statements já foram preparados nela.
+  Seus cursores são monitorados (tempo de SQL e log de consultas lentas).
+  """
+
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.preparados = set()
+    self.pool_origem = None
+    self.cursor_factory = CursorMonitorado
+
+
+class _MetricasPool:
+  """Espera por vagas e conexões emprestadas, usadas pelo controle de admissão."""
+
+  # Meia-vida (s) da média de espera: sem novas amostras ela decai para zero
+  MEIA_VIDA = 5.0
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.esperas = {}  # marcador -> início da espera (monotonic)
+    self.em_uso = 0
+    self.espera_media_ms = 0.0
+    self.amostrado_em = 0.0
+
+  def iniciar_espera(self):
+    marcador = object()
+    with self.lock:
+      self.esperas[marcador] = time.monotonic()
+    return marcador
+
+  def terminar_espera(self, marcador):
+    agora = time.monotonic()
+    with self.lock:
+      espera_ms = (agora - self.esperas.pop(marcador)) * 1000
+      self.espera_media_ms = 0.8 * self._media_decaida(agora) + 0.2 * espera_ms
+      self.amostrado_em = agora
+
+  def _media_decaida(self, agora):
+    decorrido = agora - self.amostrado_em
+    return self.espera_media_ms * 0.5**(decorrido / self.MEIA_VIDA)
+
+  def resumo(self):
+    agora = time.monotonic()
+    with self.lock:
+      mais_antiga = min(self.esperas.values(), default=agora)
+      return {
+          "em_uso": self.em_uso,
+          "esperando": len(self.esperas),
+          "espera_mais_antiga_ms": round((agora - mais_antiga) * 1000, 1),
+          "espera_media_ms": round(self._media_decaida(agora), 1),
+      }
+
+
+class PoolConexoes:
+  """
+  Pool de conexões de um servidor (primário ou réplica), criado sob demanda.
+
+  O semáforo limita quantas conexões podem estar emprestadas ao mesmo tempo:
+  quando o pool esgota, a requisição espera por uma vaga em vez de falhar.
+  """
+
+  def __init__(self, nome, *args, **kwargs):
+    self.nome = nome
+    self._args = args  # repassados ao psycopg2.connect (DSN ou parâmetros)
+    self._kwargs = kwargs
+    self._pool = None
+    self._vagas = None
+    self._lock = threading.Lock()
+    self.metricas = _MetricasPool()
+    # Usados apenas pelas réplicas
+    self.indisponivel_ate = 0.0
+    self.atraso_s = 0.0
+    self.atraso_verificado_em = 0.0
+
+  def _obter(self):
+    if self._pool is None:
+      with self._lock:
+        if self._pool is None:
+          minconn = int(os.getenv("DB_POOL_MIN", "1"))
+          maxconn = int(os.getenv("DB_POOL_MAX", "10"))
+          self._vagas = threading.BoundedSemaphore(maxconn)
+          self._pool = pool.ThreadedConnectionPool(
+              minconn,
+              maxconn,
+              *self._args,
+              connection_factory=ConexaoPreparada,
+              **self._kwargs,
+          )
+          # O psycopg2 fecha as conexões devolvidas além de minconn ociosas, e
+          # com elas os statements preparados: minconn vale só para as
+          # conexões abertas na criação, depois o pool guarda até maxconn.
+          self._pool.minconn = maxconn
+          print(f"Pool de conexões '{self.nome}' criado (min={minconn}, max={maxconn}).")
+    return self._pool, self._vagas
+
+  def emprestar(self, espera):
+    """Espera uma vaga (até 'espera' segundos) e pega uma conexão do pool."""
+    pool_atual, vagas = self._obter()
+    marcador = self.metricas.iniciar_espera()
+    try:
+      conseguiu_vaga = vagas.acquire(timeout=espera)
+    finally:
+      self.metricas.terminar_espera(marcador)
+    if not conseguiu_vaga:
+      return None
+    try:
+      conn = pool_atual.getconn()
+    except Exception:
+      vagas.release()
+      raise
+    conn.pool_origem = self
+    with self.metricas.lock:
+      self.metricas.em_uso += 1
+    return conn
+
+  def devolver(self, conn):
+    try:
+      # O pool faz rollback de transações pendentes e descarta conexões quebradas.
+      self._pool.putconn(conn, close=bool(conn.closed))
+    except Exception as e:
+      print(f"Aviso: falha ao devolver conexão ao pool '{self.nome}': {e}")
+      conn.close()
+    finally:
+      self._vagas.release()
+      with self.metricas.lock:
+        self.metricas.em_uso -= 1
+
+  def estatisticas(self):
+    estatisticas = self.metricas.resumo()
+    pool_atual = self._pool
+    # Lê a lista interna do psycopg2 sem lock: é só um instantâneo para métricas
+    estatisticas["ociosas"] = len(pool_atual._pool) if pool_atual else 0
+    estatisticas["maximo"] = pool_atual.maxconn if pool_atual else int(
+        os.getenv("DB_POOL_MAX", "10"))
+    return estatisticas
+
+
+# Pools do processo: o primário (DB_HOST...) e as réplicas opcionais de
+# DB_REPLICA_DSNS (URIs separadas por vírgula). Criados na primeira requisição.
+_primario = None
+_replicas = []
+_pools_lock = threading.Lock()
+_rodizio = itertools.count()
+
+# Leituras do mesmo cliente logo após uma escrita vão ao primário
+_escritas_recentes = {}  # chave do cliente -> monotonic da última escrita
+COOKIE_ULTIMA_ESCRITA = 'ultima_escrita'
+
+
+def parametros_conexao():
+  return {
+      "user": os.getenv("DB_USER"),
+      "password": os.getenv("DB_PASS"),
+      "host": os.getenv("DB_HOST"),
+      "port": os.getenv("DB_PORT"),
+      "dbname": os.getenv("DB_NAME"),
+  }
+
+
+def _pools():
+  global _primario, _replicas
+  if _primario is None:
+    with _pools_lock:
+      if _primario is None:
+        dsns = [d.strip() for d in os.getenv("DB_REPLICA_DSNS", "").split(",") if d.strip()]
+        _replicas = [
+            PoolConexoes(f"replica-{i + 1}", dsn) for i, dsn in enumerate(dsns)
+        ]
+        _primario = PoolConexoes("primario", **parametros_conexao())
+  return _primario, _replicas
+
+
+def estatisticas_pool():
+  """
+  Estatísticas do pool do primário (em uso, ociosas, esperando vaga e tempos
+  de espera) e, se houver, de cada réplica.
+  """
+  primario, replicas = _pools()
+  estatisticas = primario.estatisticas()
+  if replicas:
+    agora = time.monotonic()
+    estatisticas["replicas"] = [{
+        "nome": replica.nome,
+        "disponivel": replica.indisponivel_ate <= agora,
+        "atraso_s": round(replica.atraso_s, 3),
+        **replica.estatisticas()
+    } for replica in replicas]
+  return estatisticas
+
+
+def reiniciar_pool():
+  """
+  Descarta os pools herdados do processo pai (gunicorn post_fork).
+
+  As conexões não são fechadas: fechar aqui encerraria a sessão que o
+  processo pai ainda usa. O próximo get_db_connection() cria pools novos.
+  """
+  global _primario, _replicas
+  with _pools_lock:
+    _primario = None
+    _replicas = []
+    _escritas_recentes.clear()
+
+
+def ip_do_cliente():
+  """
+  IP de origem da requisição. Atrás de proxies, PROXIES_CONFIAVEIS (padrão 0)
+  diz quantos deles acrescentam o endereço que viram ao X-Forwarded-For: o IP
+  do cliente é o que o mais externo deles acrescentou, contado da direita.
+  As entradas à esquerda vêm do próprio cliente e não são usadas.
+  """
+  proxies = int(os.getenv("PROXIES_CONFIAVEIS", "0"))
+  if proxies > 0:
+    enderecos = [e.strip() for e in request.headers.get('X-Forwarded-For', '').split(',')]
+    if len(enderecos) >= proxies and enderecos[-proxies]:
+      return enderecos[-proxies]
+  return request.remote_addr or 'desconhecido'
+
+
+def _chave_cliente():
+  dados_usuario = g.get('dados_usuario')
+  if dados_usuario:
+    role = dados_usuario.get('role')
+    return f"{role}:{dados_usuario.get(f'{role}_id')}"
+  return ip_do_cliente()
+
+
+def _janela_leitura_apos_escrita():
+  return float(os.getenv("DB_READ_YOUR_WRITES_S", "5"))
+
+
+def registrar_escrita():
+  """
+  Marca que o cliente da requisição atual acabou de alterar dados: suas
+  leituras vão ao primário por DB_READ_YOUR_WRITES_S. Chame depois do
+  commit que alterou linhas; fora de uma requisição não faz nada.
+  """
+  if not has_request_context():
+    return
+  agora = time.monotonic()
+  if len(_escritas_recentes) > 10000:
+    janela = _janela_leitura_apos_escrita()
+    for chave in [c for c, t in _escritas_recentes.items() if agora - t > janela]:
+      _escritas_recentes.pop(chave, None)
+  _escritas_recentes[_chave_cliente()] = agora
+  g.escrita_no_primario = True
+
+
+def _leitura_deve_ir_ao_primario():
+  """True se o cliente escreveu há menos de DB_READ_YOUR_WRITES_S segundos."""
+  if not has_request_context():
+    return False
+  janela = _janela_leitura_apos_escrita()
+  if janela <= 0:
+    return False
+
+  ultima = _escritas_recentes.get(_chave_cliente())
+  if ultima is not None and time.monotonic() - ultima < janela:
+    return True
+
+  # O cookie cobre as escritas feitas por outros workers/instâncias
+  try:
+    return time.time() - float(request.cookies.get(COOKIE_ULTIMA_ESCRITA, 0)) < janela
+  except ValueError:
+    return False
+
+
+def _replica_atrasada(replica, conn):
+  """Mede o atraso de replicação (no máximo a cada DB_REPLICA_LAG_CHECK_S)."""
+  agora = time.monotonic()
+  if agora - replica.atraso_verificado_em >= float(os.getenv("DB_REPLICA_LAG_CHECK_S", "5")):
+    with conn.cursor() as cur:
+      # Sem WAL pendente a réplica está em dia, mesmo que o primário esteja ocioso
+      cur.execute("""
+          SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                      ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                 END;
+      """)
+      replica.atraso_s = float(cur.fetchone()[0])
+    conn.rollback()
+    replica.atraso_verificado_em = agora
+  return replica.atraso_s > float(os.getenv("DB_REPLICA_MAX_LAG_S", "2"))
+
+
+def _conexao_replica(replicas, espera):
+  """Conexão de uma réplica saudável (em rodízio) ou None para usar o primário."""
+  agora = time.monotonic()
+  disponiveis = [r for r in replicas if r.indisponivel_ate <= agora]
+  inicio = next(_rodizio)
+
+  for i in range(len(disponiveis)):
+    replica = disponiveis[(inicio + i) % len(disponiveis)]
+    conn = None
+    try:
+      conn = replica.emprestar(espera)
+      if conn is None:
+        continue
+      if _replica_atrasada(replica, conn):
+        replica.devolver(conn)
+        continue
+      return conn
+    except Exception as e:
+      print(f"Aviso: réplica '{replica.nome}' indisponível, usando outra ou o primário: {e}")
+      replica.indisponivel_ate = agora + float(os.getenv("DB_REPLICA_RETRY_S", "30"))
+      if conn is not None:
+        conn.close()
+        replica.devolver(conn)
+  return None
+
+
+def get_db_connection(somente_leitura=False):
+  """
+  Empresta uma conexão do pool. Devolva com release_db_connection().
+
+  Com somente_leitura=True a conexão pode vir de uma réplica (DB_REPLICA_DSNS),
+  exceto quando o cliente escreveu recentemente ou nenhuma réplica está em
+  dia; nesses casos vem do primário.
+  """
   db_pass = os.getenv("DB_PASS")
+  espera = float(os.getenv("DB_POOL_TIMEOUT", "10"))
 
   try:
-    conn = psycopg2.connect(
-        user=db_user,
-        password=db_pass,
-        host=db_host,
-        port=db_port,
-        dbname=db_name,
-    )
-    print("VARIÁVEIS Lidas do AMBIENTE (Secrets/OS) - Conexão OK.")
-    print(f"DB_HOST: {db_host}")
-    print(f"DB_PORT: {db_port}")
-    print(f"DB_NAME: {db_name}")
-    print(f"DB_USER: {db_user}")
+    primario, replicas = _pools()
+    with medir("db-conexao"):
+      conn = None
+      if somente_leitura and replicas and not _leitura_deve_ir_ao_primario():
+        conn = _conexao_replica(replicas, min(espera, 1.0))
+      if conn is None:
+        conn = primario.emprestar(espera)
+    if conn is None:
+      print(f"Pool de conexões esgotado após {espera}s de espera.")
+      return None
     return conn
   except Exception as e:
+    params = parametros_conexao()
     print("=" * 80)
     print("!!!! FALHA CRÍTICA NA CONEXÃO COM O BANCO DE DADOS !!!!")
     print(f"Mensagem de erro do psycopg2: {e}")
     print("-" * 80)
     print("VARIÁVEIS Lidas do AMBIENTE (Secrets/OS):")
-    print(f"DB_HOST: {db_host}")
-    print(f"DB_PORT: {db_port}")
-    print(f"DB_NAME: {db_name}")
-    print(f"DB_USER: {db_user}")
+    print(f"DB_HOST: {params['host']}")
+    print(f"DB_PORT: {params['port']}")
+    print(f"DB_NAME: {params['dbname']}")
+    print(f"DB_USER: {params['user']}")
     print(
         f"DB_PASS: {'*** LIDO COM SUCESSO ***' if db_pass else '!!! AUSENTE/VAZIO !!!'}"
     )
@@ -47,6 +370,23 @@ def get_db_connection():
     return None
 
 
+def release_db_connection(conn):
+  """Devolve ao pool uma conexão obtida com get_db_connection()."""
+  if conn is None:
+    return
+  conn.pool_origem.devolver(conn)
+
+
+@banco_bp.after_app_request
+def _cookie_leitura_apos_escrita(resposta):
+  """Leva a marca de escrita recente para as próximas requisições do cliente."""
+  if g.get('escrita_no_primario') and _janela_leitura_apos_escrita() > 0:
+    resposta.set_cookie(COOKIE_ULTIMA_ESCRITA, str(time.time()),
+                        max_age=int(_janela_leitura_apos_escrita()) + 1,
+                        httponly=True, secure=True, samesite='None')
+  return resposta
+
+
 @banco_bp.route('/db-status', methods=['GET'])
 def db_status():
   """Verifica a conectividade básica com o banco de dados."""
@@ -76,5 +416,4 @@ def db_status():
         "message": f"Conexão OK, mas erro na consulta. Erro: {e}"
     }), 500
   finally:
-    if conn:
-      conn.close()
+    release_db_connection(conn)
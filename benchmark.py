@@ -0,0 +1,86 @@
+"""
+Gerador de carga simples para comparar perfis de servidor (sync, gthread,
+gevent) e medir regressões de latência.
+
+Uso:
+    python benchmark.py URL [-c CONCORRENCIA] [-n REQUISICOES] [-H 'Header: valor']
+
+Exemplo:
+    WEB_WORKER_CLASS=gthread gunicorn main:app &
+    python benchmark.py http://localhost:5000/lojas -c 32 -n 2000
+"""
+import argparse
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _uma_requisicao(url, cabecalhos):
+    inicio = time.perf_counter()
+    try:
+        req = urllib.request.Request(url, headers=cabecalhos)
+        with urllib.request.urlopen(req, timeout=30) as resposta:
+            resposta.read()
+            status = resposta.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except Exception:
+        status = None
+    return status, time.perf_counter() - inicio
+
+
+def _percentil(valores, p):
+    indice = min(len(valores) - 1, int(round(p / 100 * (len(valores) - 1))))
+    return valores[indice]
+
+
+def executar(url, concorrencia, total, cabecalhos):
+    latencias = []
+    status = {}
+    lock = threading.Lock()
+
+    def tarefa(_):
+        codigo, duracao = _uma_requisicao(url, cabecalhos)
+        with lock:
+            latencias.append(duracao)
+            status[codigo] = status.get(codigo, 0) + 1
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+        list(executor.map(tarefa, range(total)))
+    duracao_total = time.perf_counter() - inicio
+
+    latencias.sort()
+    return {
+        "requisicoes": total,
+        "concorrencia": concorrencia,
+        "req_por_segundo": round(total / duracao_total, 1),
+        "media_ms": round(statistics.mean(latencias) * 1000, 1),
+        "p50_ms": round(_percentil(latencias, 50) * 1000, 1),
+        "p95_ms": round(_percentil(latencias, 95) * 1000, 1),
+        "p99_ms": round(_percentil(latencias, 99) * 1000, 1),
+        "status": {str(k): v for k, v in sorted(status.items(), key=str)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('url')
+    parser.add_argument('-c', '--concorrencia', type=int, default=16)
+    parser.add_argument('-n', '--requisicoes', type=int, default=1000)
+    parser.add_argument('-H', '--header', action='append', default=[])
+    args = parser.parse_args()
+
+    cabecalhos = dict(h.split(':', 1) for h in args.header)
+    cabecalhos = {k.strip(): v.strip() for k, v in cabecalhos.items()}
+
+    resultado = executar(args.url, args.concorrencia, args.requisicoes, cabecalhos)
+    for chave, valor in resultado.items():
+        print(f"{chave:>16}: {valor}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,332 @@
+"""
+Snapshot colunar do catálogo de lojas, compartilhado pelos workers via mmap.
+
+GET /lojas sem filtros (paginado ou não) é servido a partir de um arquivo
+imutável (CATALOGO_ARQUIVO, padrão dados/catalogo_lojas.bin) com todas as
+lojas na ordem da listagem, (nome_loja, loja_id); com cidade, estado ou CEP
+a rota usa o SQL indexado. Cada worker mapeia o arquivo somente leitura: as
+páginas ficam no cache do sistema operacional, uma vez só para a máquina,
+e as linhas viram dicts apenas para a página que está sendo respondida.
+Ao subir, o worker mapeia o arquivo que já estiver no disco e atende a
+primeira requisição sem ir ao banco.
+
+Formato (ordem de bytes nativa, cada seção alinhada em 8 bytes):
+    cabeçalho        mágico, versão, linhas, textos, gerado_em (epoch)
+    loja_id          int64[linhas]
+    latitude         float64[linhas]   (NaN = NULL)
+    longitude        float64[linhas]
+    colunas de texto uint32[linhas] cada: índice na tabela de textos
+                     (0xFFFFFFFF = NULL); textos repetidos, como cidade e
+                     estado, são gravados uma única vez
+    índice por id    int64[linhas] ids ordenados + uint32[linhas] posições
+    tabela de textos uint32[textos + 1] offsets + bytes UTF-8
+
+Uma thread por processo confere o arquivo a cada CATALOGO_VERIFICACAO_S
+(padrão 2) e mapeia a versão nova quando outro worker o substitui. O
+snapshot é reconstruído a cada CATALOGO_INTERVALO_S (padrão 60) ou logo
+depois de uma escrita em lojas (evento de invalidacao.py), por um worker
+de cada vez (flock no arquivo .lock). Um snapshot mais velho que a última
+escrita vista pelo processo, ou que CATALOGO_IDADE_MAX_S (padrão 180), não
+é usado: a rota volta a consultar o banco. CATALOGO_HABILITADO=0 desliga.
+"""
+import bisect
+import contextlib
+import fcntl
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from array import array
+
+import invalidacao
+import repositorio
+from banco import get_db_connection, release_db_connection
+from segundo_plano import ThreadPorProcesso
+
+HABILITADO = os.getenv('CATALOGO_HABILITADO', '1') == '1'
+ARQUIVO = os.getenv('CATALOGO_ARQUIVO', 'dados/catalogo_lojas.bin')
+INTERVALO_S = float(os.getenv('CATALOGO_INTERVALO_S', '60'))
+IDADE_MAX_S = float(os.getenv('CATALOGO_IDADE_MAX_S', '180'))
+VERIFICACAO_S = float(os.getenv('CATALOGO_VERIFICACAO_S', '2'))
+
+# Espaço mínimo entre duas reconstruções do mesmo processo (rajadas de escrita)
+INTERVALO_MIN_S = 2.0
+
+MAGICO = b'LOJASCOL'
+VERSAO = 1
+CABECALHO = struct.Struct('=8sIIId')  # mágico, versão, linhas, textos, gerado_em
+TAMANHO_CABECALHO = 64
+NULO = 0xFFFFFFFF
+
+COLUNAS_NUMERO = ('latitude', 'longitude')
+COLUNAS_TEXTO = ('nome_loja', 'descricao', 'endereco_rua', 'endereco_cidade',
+                 'endereco_estado', 'endereco_cep', 'data_criacao', 'foto_perfil')
+
+
+def _secoes(linhas, textos):
+    """Posição, tipo e quantidade de cada seção; e onde começam os bytes dos textos."""
+    secoes = [('loja_id', 'q', linhas)]
+    secoes += [(coluna, 'd', linhas) for coluna in COLUNAS_NUMERO]
+    secoes += [(coluna, 'I', linhas) for coluna in COLUNAS_TEXTO]
+    secoes += [('indice_ids', 'q', linhas), ('indice_posicoes', 'I', linhas),
+               ('offsets_textos', 'I', textos + 1)]
+
+    layout = {}
+    posicao = TAMANHO_CABECALHO
+    for nome, tipo, quantidade in secoes:
+        layout[nome] = (posicao, tipo, quantidade)
+        posicao += array(tipo).itemsize * quantidade
+        posicao = (posicao + 7) & ~7
+    return layout, posicao
+
+
+def gravar(caminho, linhas, gerado_em):
+    """
+    Grava o snapshot de 'linhas' (tuplas em COLUNAS_LISTAGEM_LOJAS, já na
+    ordem da listagem) em 'caminho'. A troca é atômica: quem já mapeou o
+    arquivo antigo continua lendo-o até remapear.
+    """
+    indices = {coluna: i for i, coluna in enumerate(repositorio.COLUNAS_LISTAGEM_LOJAS)}
+    colunas = {'loja_id': array('q')}
+    colunas.update((coluna, array('d')) for coluna in COLUNAS_NUMERO)
+    colunas.update((coluna, array('I')) for coluna in COLUNAS_TEXTO)
+
+    internados = {}
+    textos = bytearray()
+    offsets = array('I', [0])
+
+    for linha in linhas:
+        colunas['loja_id'].append(linha[indices['loja_id']])
+        for coluna in COLUNAS_NUMERO:
+            valor = linha[indices[coluna]]
+            colunas[coluna].append(math.nan if valor is None else float(valor))
+        for coluna in COLUNAS_TEXTO:
+            valor = linha[indices[coluna]]
+            if valor is None:
+                colunas[coluna].append(NULO)
+                continue
+            if hasattr(valor, 'isoformat'):
+                valor = valor.isoformat()
+            indice = internados.get(valor)
+            if indice is None:
+                indice = internados[valor] = len(offsets) - 1
+                textos += valor.encode('utf-8')
+                offsets.append(len(textos))
+            colunas[coluna].append(indice)
+
+    ids = colunas['loja_id']
+    ordem = sorted(range(len(ids)), key=ids.__getitem__)
+    colunas['indice_ids'] = array('q', (ids[posicao] for posicao in ordem))
+    colunas['indice_posicoes'] = array('I', ordem)
+    colunas['offsets_textos'] = offsets
+
+    layout, inicio_textos = _secoes(len(ids), len(offsets) - 1)
+
+    pasta = os.path.dirname(os.path.abspath(caminho))
+    os.makedirs(pasta, exist_ok=True)
+    descritor, temporario = tempfile.mkstemp(dir=pasta, prefix='.tmp-catalogo-')
+    try:
+        with os.fdopen(descritor, 'wb') as arquivo:
+            cabecalho = CABECALHO.pack(MAGICO, VERSAO, len(ids), len(offsets) - 1, gerado_em)
+            arquivo.write(cabecalho.ljust(TAMANHO_CABECALHO, b'\0'))
+            for nome, (posicao, _tipo, _quantidade) in layout.items():
+                arquivo.seek(posicao)
+                arquivo.write(colunas[nome].tobytes())
+            arquivo.seek(inicio_textos)
+            arquivo.write(textos)
+            arquivo.flush()
+            os.fsync(arquivo.fileno())
+        os.replace(temporario, caminho)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temporario)
+        raise
+
+
+class Snapshot:
+    """Leitura de um arquivo do catálogo mapeado em memória."""
+
+    def __init__(self, caminho):
+        with open(caminho, 'rb') as arquivo:
+            self.inode = os.fstat(arquivo.fileno()).st_ino
+            self._mmap = mmap.mmap(arquivo.fileno(), 0, access=mmap.ACCESS_READ)
+
+        dados = memoryview(self._mmap)
+        if len(dados) < TAMANHO_CABECALHO:
+            raise ValueError("Arquivo do catálogo truncado.")
+        magico, versao, self.linhas, textos, self.gerado_em = CABECALHO.unpack_from(dados)
+        if magico != MAGICO or versao != VERSAO:
+            raise ValueError(f"Arquivo do catálogo com formato desconhecido ({versao}).")
+
+        layout, self._inicio_textos = _secoes(self.linhas, textos)
+        self._colunas = {
+            nome: dados[posicao:posicao + array(tipo).itemsize * quantidade].cast(tipo)
+            for nome, (posicao, tipo, quantidade) in layout.items()
+        }
+        offsets = self._colunas['offsets_textos']
+        if len(dados) < self._inicio_textos + offsets[-1]:
+            raise ValueError("Arquivo do catálogo truncado.")
+        self._dados = dados
+
+    def _texto(self, indice):
+        if indice == NULO:
+            return None
+        offsets = self._colunas['offsets_textos']
+        inicio = self._inicio_textos + offsets[indice]
+        fim = self._inicio_textos + offsets[indice + 1]
+        return str(self._dados[inicio:fim], 'utf-8')
+
+    def valor(self, coluna, posicao):
+        valor = self._colunas[coluna][posicao]
+        if coluna in COLUNAS_TEXTO:
+            return self._texto(valor)
+        if coluna in COLUNAS_NUMERO and math.isnan(valor):
+            return None
+        return valor
+
+    def linha(self, posicao, colunas=repositorio.COLUNAS_LISTAGEM_LOJAS):
+        return {coluna: self.valor(coluna, posicao) for coluna in colunas}
+
+    def posicao(self, loja_id):
+        """Posição da loja na ordem da listagem, ou None."""
+        ids = self._colunas['indice_ids']
+        i = bisect.bisect_left(ids, loja_id)
+        if i < len(ids) and ids[i] == loja_id:
+            return self._colunas['indice_posicoes'][i]
+        return None
+
+    def buscar(self, loja_id, colunas=repositorio.COLUNAS_LISTAGEM_LOJAS):
+        posicao = self.posicao(loja_id)
+        return None if posicao is None else self.linha(posicao, colunas)
+
+    def listar(self, colunas=repositorio.COLUNAS_LISTAGEM_LOJAS, apos=None, limite=None):
+        """
+        Listagem sem filtros, a partir do cursor 'apos' (posição pelo índice
+        de ids). Retorna (linhas, ultima), onde 'ultima' é o (nome_loja,
+        loja_id) da última linha; ou None se o cursor não existir neste
+        snapshot. Os filtros por cidade, estado e CEP ficam com o SQL, que
+        tem índice para eles.
+        """
+        inicio = 0
+        if apos:
+            posicao = self.posicao(apos[1])
+            if posicao is None or self.valor('nome_loja', posicao) != apos[0]:
+                return None
+            inicio = posicao + 1
+
+        fim = self.linhas if not limite else min(self.linhas, inicio + limite)
+        linhas = [self.linha(posicao, colunas) for posicao in range(inicio, fim)]
+        if not linhas:
+            return linhas, None
+        return linhas, (self.valor('nome_loja', fim - 1), self.valor('loja_id', fim - 1))
+
+
+class Catalogo:
+    """Mantém o snapshot mapeado neste processo e o reconstrói quando preciso."""
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._snapshot = None
+        self._sujo_desde = 0.0  # epoch da última escrita em lojas vista
+        self._tentativa_em = 0.0
+        # Partida a quente: o arquivo que já está no disco serve de imediato
+        self._thread = ThreadPorProcesso('catalogo-lojas', self._executar,
+                                         preparar=self._recarregar)
+        self._acordar = threading.Event()
+        invalidacao.registrar(self)
+
+    def garantir_execucao(self):
+        self._thread.garantir()
+        invalidacao.ouvinte.garantir_execucao()
+
+    def atual(self):
+        """Snapshot que pode ser usado agora, ou None (a rota vai ao banco)."""
+        if not HABILITADO:
+            return None
+        self.garantir_execucao()
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.gerado_em <= self._sujo_desde:
+            return None
+        if time.time() - snapshot.gerado_em > IDADE_MAX_S:
+            return None
+        return snapshot
+
+    # Interface de invalidacao.registrar()
+    def aplicar(self, entidade, _entidade_id):
+        if entidade == 'loja':
+            self._sujo_desde = time.time()
+            self._acordar.set()
+
+    def limpar(self):
+        # A escuta reconectou e pode ter perdido eventos: o snapshot atual
+        # deixa de ser usado até a próxima reconstrução
+        self._sujo_desde = time.time()
+        self._acordar.set()
+
+    def _desatualizado(self):
+        snapshot = self._snapshot
+        return (snapshot is None or snapshot.gerado_em <= self._sujo_desde
+                or time.time() - snapshot.gerado_em >= INTERVALO_S)
+
+    def _executar(self):
+        while True:
+            self._acordar.wait(VERIFICACAO_S)
+            self._acordar.clear()
+            try:
+                self._recarregar()
+                if self._desatualizado() and \
+                        time.monotonic() - self._tentativa_em >= INTERVALO_MIN_S:
+                    self._reconstruir()
+            except Exception as e:
+                print(f"Aviso: falha ao atualizar o catálogo de lojas: {e}")
+
+    def _recarregar(self):
+        """Mapeia o arquivo do disco se ele foi substituído desde o último mapeamento."""
+        try:
+            inode = os.stat(self.caminho).st_ino
+        except FileNotFoundError:
+            return
+        if self._snapshot is not None and self._snapshot.inode == inode:
+            return
+        try:
+            # O snapshot antigo é desmapeado quando a última requisição que o usa termina
+            self._snapshot = Snapshot(self.caminho)
+        except (OSError, ValueError) as e:
+            print(f"Aviso: catálogo de lojas ilegível em '{self.caminho}': {e}")
+
+    def _reconstruir(self):
+        self._tentativa_em = time.monotonic()
+        os.makedirs(os.path.dirname(os.path.abspath(self.caminho)), exist_ok=True)
+        with open(self.caminho + '.lock', 'a') as trava:
+            try:
+                fcntl.flock(trava, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return  # Outro worker está reconstruindo
+
+            # Outro worker pode ter acabado de gravar uma versão nova
+            self._recarregar()
+            if not self._desatualizado():
+                return
+
+            # Marcado antes da consulta: o snapshot do banco só começa depois
+            gerado_em = time.time()
+            conn = get_db_connection()
+            if conn is None:
+                return
+            try:
+                with conn.cursor(name='catalogo_lojas') as cur:
+                    cur.itersize = 2000
+                    query, params = repositorio.montar_listagem_lojas()
+                    cur.execute(query, params)
+                    gravar(self.caminho, cur, gerado_em)
+                conn.rollback()
+            finally:
+                release_db_connection(conn)
+
+        self._recarregar()
+
+
+catalogo = Catalogo(ARQUIVO)
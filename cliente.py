@@ -1,30 +1,34 @@
 import os  # Necessário para manipulação de arquivos/extensões
+import uuid
 from datetime import datetime, timedelta, timezone
-from io import BytesIO  # Necessário para send_file
 
 import jwt
 import psycopg2
-from flask import (  # Importado send_file
-    Blueprint,
-    current_app,
-    jsonify,
-    request,
-    send_file,
-)
+from flask import Blueprint, current_app, jsonify, request
 
+import armazenamento
+import invalidacao
+import repositorio
+import revogacao
 from auth import token_obrigatorio  # Importação necessária do decorador
-from banco import get_db_connection
-from gestor import (  # Importando bcrypt e a instância do client do gestor.py
+from banco import get_db_connection, registrar_escrita, release_db_connection
+from gestor import (  # Importando bcrypt e o leitor de ids do gestor.py
     bcrypt,
-    client,
+    ler_ids_lote,
 )
+from limite import limitar_taxa
+from tempos import medir
 
 # Definição do Blueprint
 cliente_bp = Blueprint('cliente', __name__)
 
+# Cache do nome da foto por cliente (invalidado pelas escritas via NOTIFY)
+FOTOS_CLIENTE = invalidacao.CacheLocal('fotos_cliente', 'cliente')
+
 
 # 8. Rota: Criar um novo Cliente (Cadastro) - AGORA GERA TOKEN
 @cliente_bp.route('/cliente', methods=['POST'])
+@limitar_taxa('cadastro_cliente')
 def criar_cliente():
     """
     POST /cliente
@@ -40,8 +44,9 @@ def criar_cliente():
         return jsonify({"error": "Nome, email e senha são obrigatórios."}), 400
 
     # Cria o hash seguro da senha, usando a instância global do Bcrypt
-    senha_hash_seguro = bcrypt.generate_password_hash(senha_plana).decode(
-        'utf-8')
+    with medir('bcrypt'):
+        senha_hash_seguro = bcrypt.generate_password_hash(senha_plana).decode(
+            'utf-8')
 
     conn = get_db_connection()
     if conn is None:
@@ -49,21 +54,13 @@ def criar_cliente():
 
     try:
         cur = conn.cursor()
-        query = """
-            INSERT INTO clientes (nome, email, senha_hash) 
-            VALUES (%s, %s, %s) 
-            RETURNING cliente_id;
-        """
-        cur.execute(query, (nome, email, senha_hash_seguro))
+        cliente_id = repositorio.inserir_cliente(cur, nome, email,
+                                                 senha_hash_seguro)
 
-        resultado = cur.fetchone()
-
-        if resultado is None:
+        if cliente_id is None:
             raise Exception(
                 "Falha na inserção, ID do cliente não retornado pelo DB.")
 
-        cliente_id = resultado[0]
-
         # 1. GERAÇÃO DO JWT após cadastro bem-sucedido (Alinhado com Gestor)
         expiracao = datetime.now(timezone.utc) + timedelta(hours=24)
         session_secret = current_app.config.get('SESSION_SECRET')
@@ -73,6 +70,7 @@ def criar_cliente():
             'nome': nome,
             'exp': expiracao,  # Expiração
             'iat': datetime.now(timezone.utc),  # Emitido em
+            'jti': uuid.uuid4().hex,  # Identificador para revogação
             'role': 'cliente'
         }
 
@@ -80,6 +78,7 @@ def criar_cliente():
         # FIM GERAÇÃO JWT
 
         conn.commit()
+        registrar_escrita()
         cur.close()
 
         return jsonify({
@@ -98,12 +97,12 @@ def criar_cliente():
             {"error": f"Erro interno ao criar cliente. Detalhe: {e}"}), 500
 
     finally:
-        if conn:
-            conn.close()
+        release_db_connection(conn)
 
 
 # 9. Rota: Login do Cliente (Verificação de Senha e Geração de JWT)
 @cliente_bp.route('/login/cliente', methods=['POST'])
+@limitar_taxa('login_cliente')
 def login_cliente():
     """Verifica credenciais e gera um token JWT para o cliente."""
     data = request.get_json()
@@ -113,16 +112,13 @@ def login_cliente():
     if not all([email, senha_plana]):
         return jsonify({"error": "Email e senha são obrigatórios."}), 400
 
-    conn = get_db_connection()
+    conn = get_db_connection(somente_leitura=True)
     if conn is None:
         return jsonify({"error": "Falha na conexão com o banco de dados"}), 500
 
     try:
         cur = conn.cursor()
-        cur.execute(
-            "SELECT cliente_id, nome, senha_hash FROM clientes WHERE email = %s;",
-            (email, ))
-        cliente_data = cur.fetchone()
+        cliente_data = repositorio.buscar_cliente_por_email(cur, email)
         cur.close()
 
         if cliente_data is None:
@@ -131,7 +127,10 @@ def login_cliente():
         cliente_id, nome_cliente, senha_hash_do_db = cliente_data
 
         # 1. Verifica a senha com o hash
-        if bcrypt.check_password_hash(senha_hash_do_db, senha_plana):
+        with medir('bcrypt'):
+            senha_correta = bcrypt.check_password_hash(senha_hash_do_db, senha_plana)
+
+        if senha_correta:
 
             # 2. GERAÇÃO DO JWT
             expiracao = datetime.now(timezone.utc) + timedelta(hours=24)
@@ -148,6 +147,7 @@ def login_cliente():
                 'nome': nome_cliente,
                 'exp': expiracao,  # Expiração
                 'iat': datetime.now(timezone.utc),  # Emitido em
+                'jti': uuid.uuid4().hex,  # Identificador para revogação
                 'role': 'cliente'  # Define a função do usuário como 'cliente'
             }
 
@@ -167,8 +167,7 @@ def login_cliente():
         return jsonify({"error": "Erro interno do servidor."}), 500
 
     finally:
-        if conn:
-            conn.close()
+        release_db_connection(conn)
 
 
 # 10. Rota: Meu Perfil (Dados do Cliente Logado) - AGORA COM TOKEN REFRESH
@@ -179,10 +178,20 @@ def meu_perfil(dados_usuario):
     """
     GET /cliente/meu-perfil
     Retorna os dados básicos do perfil do cliente logado e um token JWT atualizado.
+    'fields' (opcional, ex.: "nome,foto_perfil") restringe os campos do perfil; 'cliente_id' e 'token' vêm sempre.
     """
     cliente_id_do_token = dados_usuario.get('cliente_id')
 
-    conn = get_db_connection()
+    campos = request.args.get('fields')
+    try:
+        visiveis = repositorio.escolher_colunas(campos, repositorio.COLUNAS_PERFIL_CLIENTE)
+        # 'nome' vai no token renovado, então é sempre lido
+        colunas = repositorio.escolher_colunas(campos, repositorio.COLUNAS_PERFIL_CLIENTE,
+                                               obrigatorias=('nome', ))
+    except ValueError as e:
+        return jsonify({"error": f"Parâmetro 'fields' inválido. {e}"}), 400
+
+    conn = get_db_connection(somente_leitura=True)
     if conn is None:
         return jsonify({"error": "Falha na conexão com o banco de dados"}), 500
 
@@ -190,16 +199,18 @@ def meu_perfil(dados_usuario):
         cur = conn.cursor()
 
         # Seleciona dados básicos e a foto_perfil (nova coluna)
-        cur.execute(
-            "SELECT nome, email, data_cadastro, foto_perfil FROM clientes WHERE cliente_id = %s;",
-            (cliente_id_do_token, ))
-        cliente_perfil = cur.fetchone()
+        if campos:
+            cliente_perfil = repositorio.buscar_campos_perfil_cliente(
+                cur, cliente_id_do_token, colunas)
+        else:
+            cliente_perfil = repositorio.buscar_perfil_cliente(cur, cliente_id_do_token)
         cur.close()
 
         if cliente_perfil is None:
             return jsonify({"error": "Cliente não encontrado."}), 404
 
-        nome, email, data_cadastro, foto_perfil = cliente_perfil
+        dados = repositorio.linha_como_dict(colunas, cliente_perfil)
+        nome = dados['nome']
 
         # 1. REFRESH/GERAÇÃO DE NOVO TOKEN (Alinhado com Gestor)
         expiracao = datetime.now(timezone.utc) + timedelta(hours=24)
@@ -210,6 +221,7 @@ def meu_perfil(dados_usuario):
             'nome': nome,
             'exp': expiracao,
             'iat': datetime.now(timezone.utc),
+            'jti': uuid.uuid4().hex,  # Identificador para revogação
             'role': 'cliente'
         }
 
@@ -217,12 +229,10 @@ def meu_perfil(dados_usuario):
         # FIM REFRESH
 
         # Mapeia o resultado para um dicionário
+        # 'foto_perfil' é o nome do arquivo da foto
         perfil = {
             "cliente_id": cliente_id_do_token,
-            "nome": nome,
-            "email": email,
-            "data_cadastro": data_cadastro.isoformat() if data_cadastro else None,
-            "foto_perfil": foto_perfil, # Retorna o nome do arquivo da foto
+            **{campo: dados[campo] for campo in visiveis},
             "token": token # Adiciona o token atualizado
         }
 
@@ -233,8 +243,7 @@ def meu_perfil(dados_usuario):
         return jsonify({"error": "Erro interno ao buscar perfil."}), 500
 
     finally:
-        if conn:
-            conn.close()
+        release_db_connection(conn)
 
 # 11. Rota Protegida: Atualizar Meu Perfil de Cliente - AGORA USA MULTIPART/FORM-DATA E FOTO
 @cliente_bp.route('/cliente/meu-perfil', methods=['PUT'])
@@ -253,98 +262,66 @@ def atualizar_cliente(dados_usuario):
     senha_plana = request.form.get('senha')
     foto = request.files.get('foto_perfil') # Agora lida com foto
 
-    updates = []
-    valores = []
+    campos = {}
 
     if nome:
-        updates.append("nome = %s")
-        valores.append(nome)
+        campos['nome'] = nome
 
     if email:
-        updates.append("email = %s")
-        valores.append(email)
+        campos['email'] = email
 
     if senha_plana:
         # Gera o hash seguro da nova senha
-        senha_hash_seguro = bcrypt.generate_password_hash(
-            senha_plana).decode('utf-8')
-        updates.append("senha_hash = %s")
-        valores.append(senha_hash_seguro)
+        with medir('bcrypt'):
+            campos['senha_hash'] = bcrypt.generate_password_hash(
+                senha_plana).decode('utf-8')
+
+    # --- Verificação de Updates ---
+    if not campos and not foto:
+        return jsonify({
+            "error":
+            "Nenhum dado (nome, email, senha ou foto) fornecido para atualização."
+        }), 400
+
+    # --- Upload da Foto (fora de qualquer transação, alinhado com Gestor) ---
+    nova_foto = None
+    if foto:
+        nova_foto = armazenamento.nova_chave_foto(f"cliente_{cliente_id}_perfil",
+                                                  foto.filename)
+        try:
+            armazenamento.enviar(nova_foto, foto.read())
+        except Exception as e:
+            print(f"Erro ao enviar foto do cliente {cliente_id}: {e}")
+            return jsonify({"error": "Erro ao salvar a foto de perfil."}), 500
+        campos['foto_perfil'] = nova_foto
 
     conn = get_db_connection()
     if conn is None:
+        armazenamento.descartar(nova_foto)
         return jsonify(
             {"error": "Falha na conexão com o banco de dados"}), 500
 
     try:
+        # Transação curta: só o UPDATE, que devolve a foto anterior
         with conn:
             with conn.cursor() as cur:
-                # --- Lógica de Upload de Foto (Alinhado com Gestor) ---
-                if foto:
-                    # 1. Buscar foto antiga do cliente para deletar
-                    cur.execute(
-                        "SELECT foto_perfil FROM clientes WHERE cliente_id = %s;",
-                        (cliente_id,)
-                    )
-                    resultado = cur.fetchone()
-                    foto_antiga = resultado[0] if resultado and resultado[0] else None
-
-                    # 2. Deletar foto antiga do storage se existir
-                    if foto_antiga:
-                        try:
-                            client.delete(foto_antiga, ignore_not_found=True)
-                        except Exception as e:
-                            print(f"Aviso: Erro ao deletar foto antiga do cliente: {e}")
-
-                    # 3. Fazer upload da nova foto
-                    extensao = os.path.splitext(foto.filename)[1] if foto.filename else '.jpg'
-                    nome_arquivo = f"cliente_{cliente_id}_perfil{extensao}"
-
-                    # Upload do arquivo para o storage
-                    client.upload_from_bytes(nome_arquivo, foto.read())
-
-                    # 4. Adicionar o caminho da nova foto aos updates do DB
-                    updates.append("foto_perfil = %s")
-                    valores.append(nome_arquivo)
-
-                # --- Verificação de Updates ---
-                if not updates:
-                    return jsonify({
-                        "error":
-                        "Nenhum dado (nome, email, senha ou foto) fornecido para atualização."
-                    }), 400
-
-                # --- Execução do SQL UPDATE ---
-                query = f"""
-                    UPDATE clientes 
-                    SET {', '.join(updates)}
-                    WHERE cliente_id = %s
-                    RETURNING cliente_id;
-                """
-                # Adiciona o ID do cliente para o filtro WHERE
-                valores.append(cliente_id)
-
-                cur.execute(query, tuple(valores))
-
-                if cur.rowcount == 0:
-                    conn.rollback()
-                    return jsonify({
-                        "error":
-                        "Cliente não encontrado para atualização."
-                    }), 404
-
+                resultado = repositorio.atualizar_cliente(cur, cliente_id, campos)
+                if resultado is not None:
+                    invalidacao.notificar(cur, 'cliente', cliente_id)
+                if resultado is not None and 'senha_hash' in campos:
+                    # Senha nova: tokens emitidos até agora deixam de valer
+                    revogacao.revogar_usuario(cur, 'cliente', cliente_id)
                 conn.commit()
-
-        return jsonify({
-            "message":
-            "Perfil de cliente atualizado com sucesso."
-        }), 200
+        if resultado is not None:
+            registrar_escrita()
 
     except psycopg2.errors.UniqueViolation:
         conn.rollback()
+        armazenamento.descartar(nova_foto)
         return jsonify({"error": "O novo email já está cadastrado."}), 409
     except Exception as e:
         conn.rollback()
+        armazenamento.descartar(nova_foto)
         print(f"Erro ao atualizar cliente: {e}")
         return jsonify({
             "error":
@@ -352,8 +329,24 @@ def atualizar_cliente(dados_usuario):
         }), 500
 
     finally:
-        if conn:
-            conn.close()
+        release_db_connection(conn)
+
+    if resultado is None:
+        armazenamento.descartar(nova_foto)
+        return jsonify({
+            "error":
+            "Cliente não encontrado para atualização."
+        }), 404
+
+    # Conexão já devolvida: a foto antiga é apagada sem segurar o banco
+    foto_antiga = resultado[0]
+    if nova_foto and foto_antiga and foto_antiga != nova_foto:
+        armazenamento.descartar(foto_antiga)
+
+    return jsonify({
+        "message":
+        "Perfil de cliente atualizado com sucesso."
+    }), 200
 
 # 12. Rota Protegida: Deletar Meu Perfil de Cliente
 @cliente_bp.route('/cliente/meu-perfil', methods=['DELETE'])
@@ -372,37 +365,23 @@ def deletar_cliente(dados_usuario):
         cur = conn.cursor()
 
         # Antes de deletar a conta, busca a foto para deletar do storage (Alinhado com Gestor)
-        cur.execute(
-            "SELECT foto_perfil FROM clientes WHERE cliente_id = %s;",
-            (cliente_id,)
-        )
-        resultado = cur.fetchone()
-        foto_antiga = resultado[0] if resultado and resultado[0] else None
+        foto_antiga = repositorio.buscar_foto_cliente(cur, cliente_id)
 
         # Deletar o cliente do DB
-        query = "DELETE FROM clientes WHERE cliente_id = %s;"
-        cur.execute(query, (cliente_id, ))
-
-        if cur.rowcount == 0:
+        if repositorio.deletar_cliente(cur, cliente_id) == 0:
             conn.rollback()
             return jsonify(
                 {"error":
                  "Cliente não encontrado para deleção."}), 404
 
-        # Se a exclusão no DB foi bem-sucedida, tenta deletar a foto do storage
-        if foto_antiga:
-            try:
-                client.delete(foto_antiga, ignore_not_found=True)
-            except Exception as e:
-                print(f"Aviso: Erro ao deletar foto antiga do cliente do storage: {e}")
+        # A conta deixa de existir: nenhum token dela deve continuar valendo
+        revogacao.revogar_usuario(cur, 'cliente', cliente_id)
+        invalidacao.notificar(cur, 'cliente', cliente_id)
 
         conn.commit()
+        registrar_escrita()
         cur.close()
 
-        return jsonify(
-            {"message":
-             "Conta de cliente deletada com sucesso."}), 200
-
     except Exception as e:
         conn.rollback()
         print(f"Erro ao deletar cliente: {e}")
@@ -419,8 +398,14 @@ def deletar_cliente(dados_usuario):
         }), 500
 
     finally:
-        if conn:
-            conn.close()
+        release_db_connection(conn)
+
+    # Conexão já devolvida e exclusão confirmada: a foto é apagada sem segurar o banco
+    armazenamento.descartar(foto_antiga)
+
+    return jsonify(
+        {"message":
+         "Conta de cliente deletada com sucesso."}), 200
 
 # 13. Rota: Servir Foto de Perfil do Cliente - NOVA ROTA
 @cliente_bp.route("/cliente/foto/<int:cliente_id>", methods=["GET"])
@@ -429,27 +414,14 @@ def obter_foto_cliente(cliente_id):
     GET /cliente/foto/<cliente_id>
     Retorna a foto de perfil do cliente a partir do Object Storage. (Alinhado com Gestor)
     """
-    conn = get_db_connection()
-    if conn is None:
-        return jsonify({"error": "Falha na conexão com o banco de dados"}), 500
-
     try:
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT foto_perfil FROM clientes WHERE cliente_id = %s;",
-            (cliente_id,)
-        )
-        resultado = cur.fetchone()
-        cur.close()
+        # O nome vem do cache do processo; o banco só é consultado na falta
+        foto_nome = FOTOS_CLIENTE.obter(cliente_id, lambda: invalidacao.ler_no_banco(
+            lambda cur: repositorio.buscar_foto_cliente(cur, cliente_id)))
 
-        if not resultado or not resultado[0]:
+        if not foto_nome:
             return jsonify({"error": "Foto não encontrada"}), 404
 
-        foto_nome = resultado[0]
-
-        # Baixar foto do storage
-        foto_bytes = client.download_as_bytes(foto_nome)
-
         # Determinar o tipo MIME baseado na extensão
         extensao = os.path.splitext(foto_nome)[1].lower()
         mime_types = {
@@ -461,16 +433,50 @@ def obter_foto_cliente(cliente_id):
         }
         mime_type = mime_types.get(extensao, "image/jpeg")
 
-        return send_file(
-            BytesIO(foto_bytes),
-            mimetype=mime_type,
-            as_attachment=False
-        )
+        # Servir a foto a partir do storage (sendfile no backend local)
+        return armazenamento.servir(foto_nome, mimetype=mime_type)
 
     except Exception as e:
         print(f"Erro ao obter foto do cliente: {e}")
         return jsonify({"error": "Erro ao carregar foto"}), 500
 
+# 14. Rota Pública: Perfis Públicos de Clientes em Lote
+@cliente_bp.route('/clientes/perfis', methods=['GET'])
+def obter_perfis_clientes():
+    """
+    GET /clientes/perfis?ids=1,2,3
+    Retorna os dados públicos (nome e foto_perfil) de vários clientes numa única consulta.
+    Requer: Parâmetro 'ids' com até PERFIS_LOTE_MAX ids (padrão 100) separados por vírgula.
+    """
+    try:
+        cliente_ids = ler_ids_lote(request.args.get('ids'),
+                                   int(os.getenv('PERFIS_LOTE_MAX', '100')))
+    except ValueError as e:
+        return jsonify({"error": f"Parâmetro 'ids' inválido. {e}"}), 400
+
+    conn = get_db_connection(somente_leitura=True)
+    if conn is None:
+        return jsonify({"error": "Falha na conexão com o banco de dados"}), 500
+
+    try:
+        cur = conn.cursor()
+        perfis_data = repositorio.buscar_perfis_publicos_clientes(cur, cliente_ids)
+        cur.close()
+
+        # Mantém a ordem dos ids pedidos
+        perfis = {row[0]: {
+            "cliente_id": row[0],
+            "nome": row[1],
+            "foto_perfil": row[2]
+        } for row in perfis_data}
+
+        return jsonify({
+            "clientes": [perfis[i] for i in cliente_ids if i in perfis]
+        }), 200
+
+    except Exception as e:
+        print(f"Erro ao obter perfis de clientes: {e}")
+        return jsonify({"error": "Erro interno ao buscar perfis."}), 500
+
     finally:
-        if conn:
-            conn.close()
+        release_db_connection(conn)
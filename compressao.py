@@ -0,0 +1,126 @@
+"""
+Compressão das respostas negociada pelo Accept-Encoding.
+
+Respostas de texto (JSON, HTML, CSV...) a partir de COMPRESSION_MIN_BYTES
+(padrão 1024) saem com brotli, se o pacote 'brotli' estiver instalado
+(poetry install -E brotli) e o cliente aceitar 'br', ou com gzip. O nível
+é configurável por COMPRESSION_GZIP_LEVEL (padrão 6) e
+COMPRESSION_BROTLI_QUALITY (padrão 5).
+
+Imagens das rotas de foto (JPEG/PNG) já são comprimidas e passam direto.
+Respostas em streaming são comprimidas pedaço a pedaço, com flush a cada
+pedaço, para que o cliente continue recebendo os dados à medida que saem.
+COMPRESSION_ENABLED=0 desliga tudo.
+"""
+import os
+import zlib
+
+from flask import request
+
+from tempos import medir
+
+try:
+    import brotli
+except ImportError:  # Opcional: sem o pacote, só gzip
+    brotli = None
+
+HABILITADO = os.getenv('COMPRESSION_ENABLED', '1') == '1'
+TAMANHO_MINIMO = int(os.getenv('COMPRESSION_MIN_BYTES', '1024'))
+NIVEL_GZIP = int(os.getenv('COMPRESSION_GZIP_LEVEL', '6'))
+QUALIDADE_BROTLI = int(os.getenv('COMPRESSION_BROTLI_QUALITY', '5'))
+
+# Tipos que valem a pena comprimir; o resto (imagens, binários) passa direto
+TIPOS_COMPRIMIVEIS = ('text/', 'application/json', 'application/javascript',
+                      'application/xml', 'image/svg+xml')
+
+_CODIFICACOES = ('br', 'gzip') if brotli is not None else ('gzip', )
+
+
+class _CompressorGzip:
+
+    def __init__(self):
+        # wbits=31: formato gzip (cabeçalho + CRC), não zlib puro
+        self._compressor = zlib.compressobj(NIVEL_GZIP, zlib.DEFLATED, 31)
+
+    def comprimir(self, dados):
+        return self._compressor.compress(dados)
+
+    def descarregar(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finalizar(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class _CompressorBrotli:
+
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=QUALIDADE_BROTLI)
+
+    def comprimir(self, dados):
+        return self._compressor.process(dados)
+
+    def descarregar(self):
+        return self._compressor.flush()
+
+    def finalizar(self):
+        return self._compressor.finish()
+
+
+def _novo_compressor(codificacao):
+    return _CompressorBrotli() if codificacao == 'br' else _CompressorGzip()
+
+
+def _comprimivel(resposta):
+    if resposta.status_code < 200 or resposta.status_code in (204, 206, 304):
+        return False
+    if 'Content-Encoding' in resposta.headers:
+        return False
+    return (resposta.mimetype or '').startswith(TIPOS_COMPRIMIVEIS)
+
+
+def _comprimir_stream(pedacos, codificacao):
+    compressor = _novo_compressor(codificacao)
+    for pedaco in pedacos:
+        if isinstance(pedaco, str):
+            pedaco = pedaco.encode('utf-8')
+        if not pedaco:
+            continue
+        yield compressor.comprimir(pedaco) + compressor.descarregar()
+    yield compressor.finalizar()
+
+
+def _depois_da_requisicao(resposta):
+    if not _comprimivel(resposta):
+        return resposta
+
+    # O corpo muda conforme o Accept-Encoding: caches intermediários precisam saber
+    resposta.vary.add('Accept-Encoding')
+
+    codificacao = request.accept_encodings.best_match(_CODIFICACOES)
+    if codificacao is None:
+        return resposta
+
+    if resposta.is_streamed:
+        resposta.response = _comprimir_stream(resposta.response, codificacao)
+        resposta.headers.pop('Content-Length', None)
+    else:
+        dados = resposta.get_data()
+        if len(dados) < TAMANHO_MINIMO:
+            return resposta
+        with medir('compressao'):
+            compressor = _novo_compressor(codificacao)
+            resposta.set_data(compressor.comprimir(dados) + compressor.finalizar())
+
+    resposta.headers['Content-Encoding'] = codificacao
+    # O ETag (se houver) descreve o corpo sem compressão
+    if 'ETag' in resposta.headers:
+        etag, _fraca = resposta.get_etag()
+        resposta.set_etag(etag, weak=True)
+    return resposta
+
+
+def registrar(app):
+    """Registrado depois de tempos.registrar para entrar no Server-Timing."""
+    if HABILITADO:
+        app.after_request(_depois_da_requisicao)
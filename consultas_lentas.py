@@ -0,0 +1,158 @@
+"""
+Cursor monitorado e log de consultas lentas.
+
+Toda conexão do pool usa CursorMonitorado como cursor padrão: cada execute()
+é cronometrado (fase 'sql' do Server-Timing) e, acima de SLOW_QUERY_MS
+(padrão 200), registrado em JSON Lines no arquivo rotativo SLOW_QUERY_LOG
+(padrão logs/consultas_lentas.log) com o SQL, o formato dos parâmetros
+(tipos e tamanhos, nunca os valores) e o endpoint que a executou.
+
+Com SLOW_QUERY_EXPLAIN_SAMPLE entre 0 e 1, essa fração das consultas lentas
+somente leitura é reexecutada com EXPLAIN (ANALYZE, BUFFERS) dentro de um
+SAVEPOINT, e o plano vai junto no registro.
+"""
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+import psycopg2.extensions
+from flask import has_request_context, request
+
+from repositorio import STATEMENTS
+from tempos import registrar_fase
+
+LIMITE_MS = float(os.getenv('SLOW_QUERY_MS', '200'))
+AMOSTRA_EXPLAIN = float(os.getenv('SLOW_QUERY_EXPLAIN_SAMPLE', '0'))
+
+# Funções com efeito colateral: nunca reexecutar com EXPLAIN ANALYZE
+_EFEITO_COLATERAL = re.compile(
+    r'\b(pg_notify|nextval|setval|pg_advisory\w*|pg_terminate_backend)\b', re.I)
+
+_logger = None
+_logger_lock = threading.Lock()
+
+
+def _obter_logger():
+    global _logger
+    if _logger is None:
+        with _logger_lock:
+            if _logger is None:
+                arquivo = os.getenv('SLOW_QUERY_LOG', 'logs/consultas_lentas.log')
+                os.makedirs(os.path.dirname(arquivo) or '.', exist_ok=True)
+                handler = RotatingFileHandler(
+                    arquivo,
+                    maxBytes=int(os.getenv('SLOW_QUERY_LOG_MAX_BYTES', str(10 * 1024 * 1024))),
+                    backupCount=int(os.getenv('SLOW_QUERY_LOG_BACKUPS', '5')),
+                    encoding='utf-8')
+                handler.setFormatter(logging.Formatter('%(message)s'))
+
+                logger = logging.getLogger('consultas_lentas')
+                logger.setLevel(logging.INFO)
+                logger.propagate = False
+                logger.addHandler(handler)
+                _logger = logger
+    return _logger
+
+
+def _texto_sql(query, conn):
+    if isinstance(query, bytes):
+        return query.decode('utf-8', 'replace')
+    if isinstance(query, str):
+        return query
+    return query.as_string(conn)  # psycopg2.sql.Composed
+
+
+def _formato(valor):
+    if isinstance(valor, (list, tuple)):
+        return f"{type(valor).__name__}[{len(valor)}]"
+    if isinstance(valor, (str, bytes)):
+        return f"{type(valor).__name__}({len(valor)})"
+    return type(valor).__name__
+
+
+def formato_parametros(params):
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {chave: _formato(valor) for chave, valor in params.items()}
+    return [_formato(valor) for valor in params]
+
+
+def _statement_preparado(sql):
+    encontrado = re.match(r'\s*EXECUTE\s+(\w+)', sql, re.I)
+    return encontrado.group(1) if encontrado else None
+
+
+def _somente_leitura(sql):
+    nome = _statement_preparado(sql)
+    if nome:
+        sql = STATEMENTS.get(nome, '')
+    return (re.match(r'\s*SELECT\b', sql, re.I) is not None
+            and not _EFEITO_COLATERAL.search(sql))
+
+
+class CursorMonitorado(psycopg2.extensions.cursor):
+    """Cursor que cronometra cada execute() e registra as consultas lentas."""
+
+    def execute(self, query, vars=None):
+        inicio = time.perf_counter()
+        try:
+            resultado = super().execute(query, vars)
+        except Exception:
+            self._registrar(query, vars, time.perf_counter() - inicio,
+                            explicar=False)
+            raise
+        self._registrar(query, vars, time.perf_counter() - inicio, explicar=True)
+        return resultado
+
+    def _registrar(self, query, vars, duracao, explicar):
+        registrar_fase('sql', duracao)
+        if duracao * 1000 < LIMITE_MS:
+            return
+
+        try:
+            sql = _texto_sql(query, self.connection)
+            registro = {
+                "em": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                "duracao_ms": round(duracao * 1000, 1),
+                "sql": ' '.join(sql.split()),
+                "parametros": formato_parametros(vars),
+                "endpoint": request.endpoint if has_request_context() else None,
+                "erro": not explicar,
+            }
+            nome = _statement_preparado(sql)
+            if nome in STATEMENTS:
+                registro["statement"] = ' '.join(STATEMENTS[nome].split())
+
+            if (explicar and AMOSTRA_EXPLAIN > 0 and _somente_leitura(sql)
+                    and random.random() < AMOSTRA_EXPLAIN):
+                registro["plano"] = self._explicar(query, vars)
+
+            _obter_logger().info(json.dumps(registro, ensure_ascii=False,
+                                            default=str))
+        except Exception as e:
+            print(f"Aviso: falha ao registrar consulta lenta: {e}")
+
+    def _explicar(self, query, vars):
+        """Reexecuta a consulta com EXPLAIN ANALYZE sem afetar a transação da rota."""
+        conn = self.connection
+        if conn.autocommit:
+            return None
+
+        with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+            cur.execute("SAVEPOINT explain_consulta_lenta;")
+            try:
+                cur.execute(
+                    b"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " +
+                    cur.mogrify(query, vars))
+                plano = cur.fetchone()[0]
+                cur.execute("RELEASE SAVEPOINT explain_consulta_lenta;")
+                return plano
+            except Exception as e:
+                cur.execute("ROLLBACK TO SAVEPOINT explain_consulta_lenta;")
+                return {"erro": str(e)}
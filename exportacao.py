@@ -0,0 +1,171 @@
+"""
+Exportação em CSV direto do banco para a resposta HTTP.
+
+TransmissaoCsv roda COPY (consulta) TO STDOUT numa thread: o psycopg2
+entrega o CSV já formatado pelo PostgreSQL, em pedaços de
+EXPORTACAO_PEDACO_BYTES (padrão 64 KiB), por uma fila limitada até o
+gerador da resposta. Nenhuma linha vira objeto Python e a memória usada
+não depende do tamanho da exportação.
+
+A conexão fica com a transmissão até o fim do download. Se o cliente
+desistir, ou não ler nada por EXPORTACAO_ESPERA_S segundos (padrão 30), o
+COPY é cancelado e a conexão, que fica no meio do protocolo, é fechada em
+vez de voltar ao pool. O mesmo vale para o cursor nomeado do modo gevent.
+
+Com o wait callback do gevent o psycopg2 recusa COPY: a consulta é lida
+por um cursor do lado do servidor e formatada com o módulo csv, no próprio
+greenlet.
+"""
+import contextlib
+import csv
+import io
+import os
+import queue
+import threading
+import time
+
+import psycopg2.extensions
+
+from banco import release_db_connection
+
+PEDACO_BYTES = int(os.getenv('EXPORTACAO_PEDACO_BYTES', str(64 * 1024)))
+ESPERA_S = float(os.getenv('EXPORTACAO_ESPERA_S', '30'))
+
+# Pedaços prontos esperando o cliente (limita a memória por download)
+FILA_MAX = 8
+
+# Linhas por busca do cursor no modo gevent
+LINHAS_POR_BUSCA = 2000
+
+_FIM = object()
+
+
+class _Cancelado(Exception):
+    pass
+
+
+class _Escritor:
+    """Arquivo preenchido pelo copy_expert; junta as linhas em pedaços para a fila."""
+
+    def __init__(self, fila, cancelado):
+        self._fila = fila
+        self._cancelado = cancelado
+        self._buffer = bytearray()
+
+    def write(self, dados):
+        self._buffer += dados
+        if len(self._buffer) >= PEDACO_BYTES:
+            self.descarregar()
+
+    def descarregar(self):
+        if self._buffer:
+            _colocar(self._fila, bytes(self._buffer), self._cancelado)
+            self._buffer.clear()
+
+
+def _colocar(fila, item, cancelado):
+    """Põe 'item' na fila, desistindo se a transmissão for cancelada ou o cliente parar de ler."""
+    limite = time.monotonic() + ESPERA_S
+    while not cancelado.is_set():
+        try:
+            fila.put(item, timeout=1)
+            return
+        except queue.Full:
+            if time.monotonic() > limite:
+                raise _Cancelado("O cliente parou de ler a exportação.") from None
+    raise _Cancelado("Exportação cancelada.")
+
+
+class TransmissaoCsv:
+    """
+    Corpo de resposta com o CSV de 'consulta' (SELECT já com parâmetros),
+    com cabeçalho. Registre close() com resposta.call_on_close(): é ele
+    que devolve 'conn' ao pool.
+    """
+
+    def __init__(self, conn, consulta):
+        self.conn = conn
+        self.consulta = consulta
+        self._fila = queue.Queue(maxsize=FILA_MAX)
+        self._cancelado = threading.Event()
+        self._thread = None
+        self._iniciada = False
+        self._concluida = False
+        self._fechada = False
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        self._iniciada = True
+        if psycopg2.extensions.get_wait_callback() is not None:
+            yield from self._por_cursor()
+            return
+
+        self._thread = threading.Thread(target=self._copiar,
+                                        name='exportacao-csv', daemon=True)
+        self._thread.start()
+        while True:
+            item = self._fila.get()
+            if item is _FIM:
+                self._concluida = True
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def _copiar(self):
+        try:
+            escritor = _Escritor(self._fila, self._cancelado)
+            with self.conn.cursor() as cur:
+                cur.copy_expert(
+                    f"COPY ({self.consulta}) TO STDOUT WITH (FORMAT csv, HEADER)",
+                    escritor)
+            escritor.descarregar()
+            _colocar(self._fila, _FIM, self._cancelado)
+        except _Cancelado as e:
+            print(f"Aviso: {e}")
+        except Exception as e:
+            print(f"Erro na exportação CSV: {e}")
+            with contextlib.suppress(_Cancelado):
+                _colocar(self._fila, e, self._cancelado)
+
+    def _por_cursor(self):
+        saida = io.StringIO()
+        escritor = csv.writer(saida)
+        cabecalho = False
+        with self.conn.cursor(name='exportacao_csv') as cur:
+            cur.execute(self.consulta)
+            while True:
+                linhas = cur.fetchmany(LINHAS_POR_BUSCA)
+                # Num cursor nomeado, 'description' só existe depois da primeira busca
+                if not cabecalho:
+                    escritor.writerow(coluna.name for coluna in cur.description)
+                    cabecalho = True
+                if not linhas:
+                    break
+                escritor.writerows(linhas)
+                if saida.tell() >= PEDACO_BYTES:
+                    yield saida.getvalue().encode('utf-8')
+                    saida.seek(0)
+                    saida.truncate()
+        yield saida.getvalue().encode('utf-8')
+        self._concluida = True
+
+    def close(self):
+        with self._lock:
+            if self._fechada:
+                return
+            self._fechada = True
+
+        if not self._concluida:
+            self._cancelado.set()
+            # Interrompe a consulta no servidor se ela ainda estiver rodando
+            with contextlib.suppress(Exception):
+                self.conn.cancel()
+        if self._thread is not None:
+            self._thread.join()
+
+        if self._iniciada and not self._concluida:
+            # COPY interrompido deixa a conexão no meio do protocolo; no modo
+            # gevent o cursor nomeado continua aberto na transação
+            self.conn.close()
+        release_db_connection(self.conn)
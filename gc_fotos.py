@@ -0,0 +1,243 @@
+"""
+Coleta de fotos órfãs no Object Storage.
+
+Uso:
+    python gc_fotos.py                # simulação: só lista as órfãs
+    python gc_fotos.py --executar     # apaga as órfãs
+
+Objetos com os prefixos de foto (gestor_, cliente_, loja_) que nenhuma linha
+de gestores, clientes ou lojas referencia em foto_perfil são órfãos: sobram
+de deleções de conta e de falhas ao apagar a foto antiga.
+
+As chaves do storage são lidas em páginas e as referências do banco por um
+cursor do lado do servidor, as duas em ordem de bytes, e comparadas num merge
+ordenado: a memória usada não depende do tamanho do bucket.
+
+Antes de apagar, cada lote de órfãs espera --carencia segundos e é conferido
+de novo no banco, para não apagar uma foto recém-enviada cujo UPDATE ainda
+não tinha sido confirmado. As deleções rodam em paralelo (--concorrencia)
+limitadas a --taxa objetos por segundo.
+"""
+import argparse
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+import armazenamento
+from banco import parametros_conexao
+from limite import TokenBucket
+
+PREFIXOS = ('cliente_', 'gestor_', 'loja_')
+
+# Todas as referências, na ordem de bytes do storage (índices da migração 0005)
+SQL_REFERENCIAS = """
+    SELECT foto FROM (
+        SELECT foto_perfil COLLATE "C" AS foto FROM gestores WHERE foto_perfil IS NOT NULL
+        UNION ALL
+        SELECT foto_perfil COLLATE "C" FROM clientes WHERE foto_perfil IS NOT NULL
+        UNION ALL
+        SELECT foto_perfil COLLATE "C" FROM lojas WHERE foto_perfil IS NOT NULL
+    ) AS referencias
+    ORDER BY foto
+"""
+
+SQL_AINDA_REFERENCIADAS = """
+    SELECT foto_perfil FROM gestores WHERE foto_perfil COLLATE "C" = ANY(%(chaves)s)
+    UNION
+    SELECT foto_perfil FROM clientes WHERE foto_perfil COLLATE "C" = ANY(%(chaves)s)
+    UNION
+    SELECT foto_perfil FROM lojas WHERE foto_perfil COLLATE "C" = ANY(%(chaves)s)
+"""
+
+
+def conectar():
+    return psycopg2.connect(**parametros_conexao())
+
+
+def chaves_do_storage(tamanho_pagina):
+    """Gera as chaves com prefixo de foto, em ordem, uma página por vez."""
+    # Os prefixos são disjuntos e estão em ordem: concatenar mantém a ordem
+    for prefixo in sorted(PREFIXOS):
+        apos = None
+        while True:
+            pagina = armazenamento.listar(prefixo, apos, tamanho_pagina)
+            if not pagina:
+                break
+            yield from pagina
+            apos = pagina[-1]
+
+
+def referencias_do_banco(conn, tamanho_pagina):
+    """Gera os valores distintos de foto_perfil, em ordem, via cursor no servidor."""
+    with conn.cursor(name='gc_fotos_referencias') as cur:
+        cur.itersize = tamanho_pagina
+        cur.execute(SQL_REFERENCIAS)
+        anterior = None
+        for (foto, ) in cur:
+            if foto != anterior:
+                yield foto
+                anterior = foto
+
+
+def orfas(chaves, referencias, contagem):
+    """Merge ordenado: gera as chaves que não aparecem em 'referencias'."""
+    referencia = next(referencias, None)
+    for chave in chaves:
+        contagem['objetos'] += 1
+        while referencia is not None and referencia < chave:
+            # Referência sem objeto correspondente no storage
+            contagem['referencias_sem_objeto'] += 1
+            referencia = next(referencias, None)
+        if referencia == chave:
+            referencia = next(referencias, None)
+            continue
+        contagem['orfas'] += 1
+        yield chave
+
+
+def em_lotes(itens, tamanho):
+    lote = []
+    for item in itens:
+        lote.append(item)
+        if len(lote) >= tamanho:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+class Removedor:
+    """
+    Apaga lotes de órfãs depois da carência, reconferindo no banco,
+    em paralelo e com limite de taxa. A fila limitada segura a listagem
+    quando as deleções não acompanham.
+    """
+
+    def __init__(self, carencia, concorrencia, taxa, contagem):
+        self.carencia = carencia
+        self.contagem = contagem
+        self._fila = queue.Queue(maxsize=4)
+        self._executor = ThreadPoolExecutor(max_workers=concorrencia,
+                                            thread_name_prefix='gc-fotos')
+        self._balde = TokenBucket(max(1, concorrencia), taxa)
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._consumir, daemon=True)
+        self._thread.start()
+
+    def agendar(self, lote):
+        self._fila.put((time.monotonic() + self.carencia, lote))
+
+    def encerrar(self):
+        self._fila.put(None)
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+
+    def _consumir(self):
+        conn = None
+        try:
+            while True:
+                item = self._fila.get()
+                if item is None:
+                    return
+                pronto_em, lote = item
+                time.sleep(max(0.0, pronto_em - time.monotonic()))
+
+                try:
+                    if conn is None or conn.closed:
+                        conn = conectar()
+                        conn.autocommit = True
+                    self._apagar_lote(conn, lote)
+                except Exception as e:
+                    # Um lote com erro é pulado; a próxima execução o encontra de novo
+                    print(f"Falha ao processar lote de {len(lote)} órfãs: {e}")
+                    with self._lock:
+                        self.contagem['falhas'] += len(lote)
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def _apagar_lote(self, conn, lote):
+        with conn.cursor() as cur:
+            cur.execute(SQL_AINDA_REFERENCIADAS, {'chaves': lote})
+            referenciadas = {linha[0] for linha in cur.fetchall()}
+        with self._lock:
+            self.contagem['reaproveitadas'] += len(referenciadas)
+
+        futuros = [
+            self._executor.submit(self._apagar, chave)
+            for chave in lote if chave not in referenciadas
+        ]
+        for futuro in futuros:
+            futuro.result()
+
+    def _aguardar_token(self):
+        while True:
+            with self._lock:
+                permitido, espera = self._balde.consumir(time.monotonic())
+            if permitido:
+                return
+            time.sleep(espera)
+
+    def _apagar(self, chave):
+        self._aguardar_token()
+        try:
+            armazenamento.deletar(chave)
+            chave_contagem = 'apagadas'
+        except Exception as e:
+            print(f"Falha ao apagar '{chave}': {e}")
+            chave_contagem = 'falhas'
+        with self._lock:
+            self.contagem[chave_contagem] += 1
+
+
+def coletar(executar, tamanho_pagina, carencia, concorrencia, taxa):
+    contagem = dict.fromkeys(('objetos', 'orfas', 'referencias_sem_objeto',
+                              'reaproveitadas', 'apagadas', 'falhas'), 0)
+    removedor = Removedor(carencia, concorrencia, taxa, contagem) if executar else None
+
+    conn = conectar()
+    conn.set_session(readonly=True)
+    try:
+        encontradas = orfas(chaves_do_storage(tamanho_pagina),
+                            referencias_do_banco(conn, tamanho_pagina), contagem)
+        for lote in em_lotes(encontradas, tamanho_pagina):
+            if removedor:
+                removedor.agendar(lote)
+            else:
+                for chave in lote:
+                    print(f"órfã  {chave}")
+    finally:
+        if removedor:
+            removedor.encerrar()
+        conn.rollback()
+        conn.close()
+
+    return contagem
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--executar', action='store_true',
+                        help='apaga as órfãs (sem isso, só lista)')
+    parser.add_argument('--pagina', type=int, default=1000,
+                        help='chaves por página do storage e linhas por busca no banco')
+    parser.add_argument('--carencia', type=float, default=60.0,
+                        help='segundos entre achar uma órfã e apagá-la')
+    parser.add_argument('--concorrencia', type=int, default=8)
+    parser.add_argument('--taxa', type=float, default=50.0,
+                        help='deleções por segundo')
+    args = parser.parse_args()
+
+    contagem = coletar(args.executar, args.pagina, args.carencia,
+                       args.concorrencia, args.taxa)
+    if not args.executar:
+        print("Simulação: nada foi apagado (use --executar).")
+    for chave, valor in contagem.items():
+        print(f"{chave:>24}: {valor}")
+
+
+if __name__ == '__main__':
+    main()
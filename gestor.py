@@ -1,26 +1,35 @@
 import os
+import uuid
 from datetime import datetime, timedelta, timezone
-from io import BytesIO
 
 import jwt
 import psycopg2
-from flask import Blueprint, current_app, jsonify, request, send_file
+from flask import Blueprint, current_app, jsonify, request
 from flask_bcrypt import Bcrypt
-from replit.object_storage import Client
 
+import armazenamento
+import invalidacao
+import repositorio
+import revogacao
+import tarefas
 from auth import token_obrigatorio  # Importando o decorador de autenticação
-from banco import get_db_connection
+from banco import get_db_connection, registrar_escrita, release_db_connection
+from limite import limitar_taxa
+from tempos import medir
 
-# 1. Instância do Bcrypt e Client
+# 1. Instância do Bcrypt (o storage das fotos vem de armazenamento.py)
 bcrypt = Bcrypt()
-client = Client() # Instância do client, agora exportada
 
 # 2. Definição do Blueprint
 gestor_bp = Blueprint('gestor', __name__)
 
+# 3. Cache do nome da foto por gestor (invalidado pelas escritas via NOTIFY)
+FOTOS_GESTOR = invalidacao.CacheLocal('fotos_gestor', 'gestor')
+
 
 # 5. Rota: Criar um novo Gestor (Cadastro)
 @gestor_bp.route('/gestor', methods=['POST'])
+@limitar_taxa('cadastro_gestor')
 def criar_gestor():
     """
     POST /gestor
@@ -37,8 +46,9 @@ def criar_gestor():
         return jsonify({"error": "Nome, email e senha são obrigatórios."}), 400
 
     # Cria o hash seguro da senha
-    senha_hash_seguro = bcrypt.generate_password_hash(senha_plana).decode(
-        'utf-8')
+    with medir('bcrypt'):
+        senha_hash_seguro = bcrypt.generate_password_hash(senha_plana).decode(
+            'utf-8')
 
     conn = get_db_connection()
     if conn is None:
@@ -46,20 +56,12 @@ def criar_gestor():
 
     try:
         cur = conn.cursor()
-        query = """
-            INSERT INTO gestores (nome, email, senha_hash) 
-            VALUES (%s, %s, %s) 
-            RETURNING gestor_id;
-        """
-        cur.execute(query, (nome, email, senha_hash_seguro))
-
-        resultado = cur.fetchone()
+        gestor_id = repositorio.inserir_gestor(cur, nome, email,
+                                               senha_hash_seguro)
 
-        if resultado is None:
+        if gestor_id is None:
             raise Exception("Falha na inserção, ID não retornado pelo DB.")
 
-        gestor_id = resultado[0]
-
         # 1. GERAÇÃO DO JWT após cadastro bem-sucedido
         expiracao = datetime.now(timezone.utc) + timedelta(hours=24)
 
@@ -68,6 +70,7 @@ def criar_gestor():
             'nome': nome,
             'exp': expiracao,  # Expiração
             'iat': datetime.now(timezone.utc),  # Emitido em
+            'jti': uuid.uuid4().hex,  # Identificador para revogação
             'role': 'gestor'  # Define a função do usuário
         }
 
@@ -77,6 +80,7 @@ def criar_gestor():
         # FIM GERAÇÃO JWT
 
         conn.commit()
+        registrar_escrita()
         cur.close()
 
         return jsonify({
@@ -95,12 +99,12 @@ def criar_gestor():
             {"error": f"Erro interno ao criar gestor. Detalhe: {e}"}), 500
 
     finally:
-        if conn:
-            conn.close()
+        release_db_connection(conn)
 
 
 # 6. Rota: Login do Gestor (Verificação de Senha e Geração de JWT)
 @gestor_bp.route('/login/gestor', methods=['POST'])
+@limitar_taxa('login_gestor')
 def login_gestor():
     """
     POST /login/gestor
@@ -115,16 +119,13 @@ def login_gestor():
     if not all([email, senha_plana]):
         return jsonify({"error": "Email e senha são obrigatórios."}), 400
 
-    conn = get_db_connection()
+    conn = get_db_connection(somente_leitura=True)
     if conn is None:
         return jsonify({"error": "Falha na conexão com o banco de dados"}), 500
 
     try:
         cur = conn.cursor()
-        cur.execute(
-            "SELECT gestor_id, nome, senha_hash FROM gestores WHERE email = %s;",
-            (email, ))
-        gestor_data = cur.fetchone()
+        gestor_data = repositorio.buscar_gestor_por_email(cur, email)
         cur.close()
 
         if gestor_data is None:
@@ -133,7 +134,10 @@ def login_gestor():
         gestor_id, nome_gestor, senha_hash_do_db = gestor_data
 
         # 1. Verifica a senha com o hash
-        if bcrypt.check_password_hash(senha_hash_do_db, senha_plana):
+        with medir('bcrypt'):
+            senha_correta = bcrypt.check_password_hash(senha_hash_do_db, senha_plana)
+
+        if senha_correta:
 
             # 2. GERAÇÃO DO JWT
             expiracao = datetime.now(timezone.utc) + timedelta(hours=24)
@@ -143,6 +147,7 @@ def login_gestor():
                 'nome': nome_gestor,
                 'exp': expiracao,  # Expiração
                 'iat': datetime.now(timezone.utc),  # Emitido em
+                'jti': uuid.uuid4().hex,  # Identificador para revogação
                 'role': 'gestor'  # Define a função do usuário
             }
 
@@ -164,8 +169,7 @@ def login_gestor():
         return jsonify({"error": "Erro interno do servidor."}), 500
 
     finally:
-        if conn:
-            conn.close()
+        release_db_connection(conn)
 
 
 # 7. Rota: Meu Perfil do Gestor (Protegida)
@@ -177,27 +181,37 @@ def obter_perfil_gestor(dados_usuario):
     Rota protegida. Retorna os dados do perfil do gestor logado e um token JWT atualizado.
     Requer: Token JWT válido no cabeçalho Authorization.
     Retorna: JSON com 'gestor_id', 'nome', 'email', 'foto_perfil' e 'token' (novo/refresh) ou erro (404, 500).
+    'fields' (opcional, ex.: "nome,foto_perfil") restringe os campos do perfil; 'gestor_id' e 'token' vêm sempre.
     """
     gestor_id = dados_usuario.get('gestor_id')
 
-    conn = get_db_connection()
+    campos = request.args.get('fields')
+    try:
+        visiveis = repositorio.escolher_colunas(campos, repositorio.COLUNAS_PERFIL_GESTOR)
+        # 'nome' vai no token renovado, então é sempre lido
+        colunas = repositorio.escolher_colunas(campos, repositorio.COLUNAS_PERFIL_GESTOR,
+                                               obrigatorias=('nome', ))
+    except ValueError as e:
+        return jsonify({"error": f"Parâmetro 'fields' inválido. {e}"}), 400
+
+    conn = get_db_connection(somente_leitura=True)
     if conn is None:
         return jsonify({"error": "Falha na conexão com o banco de dados"}), 500
 
     try:
         cur = conn.cursor()
         # Selecionamos apenas os campos necessários, EXCLUINDO senha_hash por segurança
-        cur.execute(
-            "SELECT nome, email, foto_perfil FROM gestores WHERE gestor_id = %s;",
-            (gestor_id, )
-        )
-        gestor_data = cur.fetchone()
+        if campos:
+            gestor_data = repositorio.buscar_campos_perfil_gestor(cur, gestor_id, colunas)
+        else:
+            gestor_data = repositorio.buscar_perfil_gestor(cur, gestor_id)
         cur.close()
 
         if gestor_data is None:
             return jsonify({"error": "Gestor não encontrado."}), 404
 
-        nome, email, foto_perfil = gestor_data
+        perfil = repositorio.linha_como_dict(colunas, gestor_data)
+        nome = perfil['nome']
 
         # 1. REFRESH/GERAÇÃO DE NOVO TOKEN
         # Criamos um novo token com base nos dados do usuário e do DB (nome atualizado)
@@ -208,6 +222,7 @@ def obter_perfil_gestor(dados_usuario):
             'nome': nome, # Usar o nome mais atualizado do DB
             'exp': expiracao,
             'iat': datetime.now(timezone.utc),
+            'jti': uuid.uuid4().hex,  # Identificador para revogação
             'role': 'gestor'
         }
 
@@ -216,12 +231,10 @@ def obter_perfil_gestor(dados_usuario):
                            algorithm='HS256')
         # FIM REFRESH
 
+        # 'foto_perfil' é o nome do arquivo, que pode ser usado para a rota /gestor/foto/<id>
         return jsonify({
             "gestor_id": gestor_id,
-            "nome": nome,
-            "email": email,
-            # Retorna o nome do arquivo, que pode ser usado para a rota /gestor/foto/<id>
-            "foto_perfil": foto_perfil,
+            **{campo: perfil[campo] for campo in visiveis},
             "token": token  # Adicionando o token atualizado
         }), 200
 
@@ -230,8 +243,7 @@ def obter_perfil_gestor(dados_usuario):
         return jsonify({"error": "Erro interno ao obter perfil."}), 500
 
     finally:
-        if conn:
-            conn.close()
+        release_db_connection(conn)
 
 
 # 8. Rota Protegida: Atualizar Meu Perfil de Gestor
@@ -252,100 +264,83 @@ def atualizar_gestor(dados_usuario):
     senha_plana = request.form.get('senha')
     foto = request.files.get('foto_perfil')
 
-    updates = []
-    valores = []
+    campos = {}
 
     if nome:
-        updates.append("nome = %s")
-        valores.append(nome)
+        campos['nome'] = nome
 
     if email:
-        updates.append("email = %s")
-        valores.append(email)
+        campos['email'] = email
 
     if senha_plana:
         # Gera o hash seguro da nova senha (Melhor Prática!)
-        senha_hash_seguro = bcrypt.generate_password_hash(senha_plana).decode('utf-8')
-        updates.append("senha_hash = %s")
-        valores.append(senha_hash_seguro)
+        with medir('bcrypt'):
+            campos['senha_hash'] = bcrypt.generate_password_hash(senha_plana).decode('utf-8')
+
+    # --- Verificação de Updates ---
+    if not campos and not foto:
+        return jsonify({
+            "error":
+            "Nenhum dado (nome, email, senha ou foto) fornecido para atualização."
+        }), 400
+
+    # --- Upload da Foto (fora de qualquer transação) ---
+    # A chave é nova a cada envio: a foto antiga continua referenciada até o
+    # UPDATE ser confirmado, e só então é apagada.
+    nova_foto = None
+    if foto:
+        nova_foto = armazenamento.nova_chave_foto(f"gestor_{gestor_id}_perfil",
+                                                  foto.filename)
+        try:
+            armazenamento.enviar(nova_foto, foto.read())
+        except Exception as e:
+            print(f"Erro ao enviar foto do gestor {gestor_id}: {e}")
+            return jsonify({"error": "Erro ao salvar a foto de perfil."}), 500
+        campos['foto_perfil'] = nova_foto
 
     conn = get_db_connection()
     if conn is None:
+        armazenamento.descartar(nova_foto)
         return jsonify({"error": "Falha na conexão com o banco de dados"}), 500
 
     try:
-        # USA 'with conn:' e 'with conn.cursor() as cur:' para garantir fechamento
+        # Transação curta: só o UPDATE, que devolve a foto anterior
         with conn:
             with conn.cursor() as cur:
-
-                # --- Lógica de Upload de Foto ---
-                if foto:
-                    # 1. Buscar foto antiga do gestor para deletar
-                    cur.execute(
-                        "SELECT foto_perfil FROM gestores WHERE gestor_id = %s;",
-                        (gestor_id,)
-                    )
-                    resultado = cur.fetchone()
-                    foto_antiga = resultado[0] if resultado and resultado[0] else None
-
-                    # 2. Deletar foto antiga do storage se existir
-                    if foto_antiga:
-                        try:
-                            client.delete(foto_antiga, ignore_not_found=True)
-                        except Exception as e:
-                            print(f"Aviso: Erro ao deletar foto antiga, mas a atualização continua: {e}")
-
-                    # 3. Fazer upload da nova foto
-                    extensao = os.path.splitext(foto.filename)[1] if foto.filename else '.jpg'
-                    nome_arquivo = f"gestor_{gestor_id}_perfil{extensao}"
-
-                    # Upload do arquivo para o storage
-                    client.upload_from_bytes(nome_arquivo, foto.read())
-
-                    # 4. Adicionar o caminho da nova foto aos updates do DB
-                    updates.append("foto_perfil = %s")
-                    valores.append(nome_arquivo)
-
-                # --- Verificação de Updates ---
-                if not updates:
-                    return jsonify({
-                        "error":
-                        "Nenhum dado (nome, email, senha ou foto) fornecido para atualização."
-                    }), 400
-
-                # --- Execução do SQL UPDATE ---
-                query = f"""
-                    UPDATE gestores 
-                    SET {', '.join(updates)}
-                    WHERE gestor_id = %s;
-                """
-                # Adiciona o ID do gestor para o filtro WHERE
-                valores.append(gestor_id)
-
-                cur.execute(query, tuple(valores))
-
-                if cur.rowcount == 0:
-                    conn.rollback()
-                    return jsonify(
-                        {"error": "Gestor não encontrado para atualização."}), 404
-
-                # O commit é crucial, feito dentro do 'with conn:'
+                resultado = repositorio.atualizar_gestor(cur, gestor_id, campos)
+                if resultado is not None:
+                    invalidacao.notificar(cur, 'gestor', gestor_id)
+                if resultado is not None and 'senha_hash' in campos:
+                    # Senha nova: tokens emitidos até agora deixam de valer
+                    revogacao.revogar_usuario(cur, 'gestor', gestor_id)
                 conn.commit()
-
-        # Resposta de Sucesso
-        return jsonify({"message":
-                        "Perfil de gestor atualizado com sucesso."}), 200
+        if resultado is not None:
+            registrar_escrita()
 
     except Exception as e:
-        # Se ocorrer qualquer erro, faz o rollback e loga o erro
+        # Se ocorrer qualquer erro, faz o rollback, descarta a foto nova e loga o erro
         conn.rollback()
+        armazenamento.descartar(nova_foto)
         print(f"Erro ao atualizar gestor: {e}")
         return jsonify(
             {"error": "Erro interno ao atualizar perfil."}), 500
 
     finally:
-        if conn:
-            conn.close()
+        release_db_connection(conn)
+
+    if resultado is None:
+        armazenamento.descartar(nova_foto)
+        return jsonify(
+            {"error": "Gestor não encontrado para atualização."}), 404
+
+    # Conexão já devolvida: a foto antiga é apagada sem segurar o banco
+    foto_antiga = resultado[0]
+    if nova_foto and foto_antiga and foto_antiga != nova_foto:
+        armazenamento.descartar(foto_antiga)
+
+    # Resposta de Sucesso
+    return jsonify({"message":
+                    "Perfil de gestor atualizado com sucesso."}), 200
 
 
 # 9. Rota Protegida: Deletar Meu Perfil de Gestor
@@ -354,9 +349,10 @@ def atualizar_gestor(dados_usuario):
 def deletar_gestor(dados_usuario):
     """
     DELETE /gestor/meu-perfil
-    Rota protegida. Permite ao gestor logado deletar sua própria conta.
+    Rota protegida. Permite ao gestor logado deletar sua própria conta, junto com todas as
+    suas lojas e fotos. A exclusão roda em segundo plano (tarefa 'excluir_gestor').
     Requer: Token JWT válido no cabeçalho Authorization.
-    Retorna: Mensagem de sucesso ou erro (404, 409, 500).
+    Retorna: 202 com 'tarefa_id' (acompanhe em GET /tarefas/<tarefa_id>) ou erro (404, 500).
     """
     gestor_id = dados_usuario.get('gestor_id')
 
@@ -365,39 +361,35 @@ def deletar_gestor(dados_usuario):
         return jsonify({"error": "Falha na conexão com o banco de dados"}), 500
 
     try:
-        cur = conn.cursor()
-
-        # Deletar o gestor
-        query = "DELETE FROM gestores WHERE gestor_id = %s;"
-        cur.execute(query, (gestor_id, ))
-
-        if cur.rowcount == 0:
-            conn.rollback()
-            return jsonify({"error":
-                               "Gestor não encontrado para deleção."}), 404
-
-        conn.commit()
-        cur.close()
+        with conn:
+            with conn.cursor() as cur:
+                if repositorio.buscar_perfil_gestor(cur, gestor_id) is None:
+                    return jsonify({"error":
+                                    "Gestor não encontrado para deleção."}), 404
 
-        return jsonify({"message":
-                               "Conta de gestor deletada com sucesso."}), 200
+                # Pedidos repetidos devolvem a mesma tarefa enquanto ela estiver ativa
+                tarefa_id = repositorio.criar_tarefa(cur, 'excluir_gestor', gestor_id)
+                conn.commit()
+        registrar_escrita()
 
     except Exception as e:
         conn.rollback()
         print(f"Erro ao deletar gestor: {e}")
-        # Nota: Se o gestor tiver lojas associadas, a deleção pode falhar devido à FK.
-        if "foreign key constraint" in str(e).lower():
-            return jsonify({
-                "error":
-                "Não é possível deletar a conta: Você possui lojas cadastradas. Por favor, remova todas as lojas primeiro."
-            }), 409
-
         return jsonify(
             {"error": f"Erro interno ao deletar gestor. Detalhe: {e}"}), 500
 
     finally:
-        if conn:
-            conn.close()
+        release_db_connection(conn)
+
+    tarefas.executor.notificar()
+
+    resposta = jsonify({
+        "message": "Exclusão da conta de gestor iniciada.",
+        "tarefa_id": tarefa_id,
+        "status": f"/tarefas/{tarefa_id}"
+    })
+    resposta.headers['Location'] = f"/tarefas/{tarefa_id}"
+    return resposta, 202
 
 
 # 10. Rota: Servir Foto de Perfil do Gestor
@@ -409,27 +401,14 @@ def obter_foto_gestor(gestor_id):
     Requer: O ID do gestor na URL.
     Retorna: O arquivo de imagem binário (Content-Type apropriado) ou erro (404, 500).
     """
-    conn = get_db_connection()
-    if conn is None:
-        return jsonify({"error": "Falha na conexão com o banco de dados"}), 500
-
     try:
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT foto_perfil FROM gestores WHERE gestor_id = %s;",
-            (gestor_id,)
-        )
-        resultado = cur.fetchone()
-        cur.close()
+        # O nome vem do cache do processo; o banco só é consultado na falta
+        foto_nome = FOTOS_GESTOR.obter(gestor_id, lambda: invalidacao.ler_no_banco(
+            lambda cur: repositorio.buscar_foto_gestor(cur, gestor_id)))
 
-        if not resultado or not resultado[0]:
+        if not foto_nome:
             return jsonify({"error": "Foto não encontrada"}), 404
 
-        foto_nome = resultado[0]
-
-        # Baixar foto do storage
-        foto_bytes = client.download_as_bytes(foto_nome)
-
         # Determinar o tipo MIME baseado na extensão
         extensao = os.path.splitext(foto_nome)[1].lower()
         mime_types = {
@@ -441,16 +420,66 @@ def obter_foto_gestor(gestor_id):
         }
         mime_type = mime_types.get(extensao, "image/jpeg")
 
-        return send_file(
-            BytesIO(foto_bytes),
-            mimetype=mime_type,
-            as_attachment=False
-        )
+        # Servir a foto a partir do storage (sendfile no backend local)
+        return armazenamento.servir(foto_nome, mimetype=mime_type)
 
     except Exception as e:
         print(f"Erro ao obter foto do gestor: {e}")
         return jsonify({"error": "Erro ao carregar foto"}), 500
 
+
+def ler_ids_lote(texto, maximo):
+    """
+    Converte '1,2,3' em [1, 2, 3] (sem repetições, na ordem informada).
+    Levanta ValueError se houver id inválido, nenhum id ou mais de 'maximo'.
+    """
+    ids = list(dict.fromkeys(
+        int(parte) for parte in (texto or '').split(',') if parte.strip()))
+    if not ids:
+        raise ValueError("Informe ao menos um id.")
+    if len(ids) > maximo:
+        raise ValueError(f"Informe no máximo {maximo} ids por requisição.")
+    return ids
+
+
+# 11. Rota Pública: Perfis Públicos de Gestores em Lote
+@gestor_bp.route('/gestores/perfis', methods=['GET'])
+def obter_perfis_gestores():
+    """
+    GET /gestores/perfis?ids=1,2,3
+    Retorna os dados públicos (nome e foto_perfil) de vários gestores numa única consulta.
+    Requer: Parâmetro 'ids' com até PERFIS_LOTE_MAX ids (padrão 100) separados por vírgula.
+    Retorna: JSON com a lista 'gestores' (ids inexistentes são omitidos) ou erro (400, 500).
+    """
+    try:
+        gestor_ids = ler_ids_lote(request.args.get('ids'),
+                                  int(os.getenv('PERFIS_LOTE_MAX', '100')))
+    except ValueError as e:
+        return jsonify({"error": f"Parâmetro 'ids' inválido. {e}"}), 400
+
+    conn = get_db_connection(somente_leitura=True)
+    if conn is None:
+        return jsonify({"error": "Falha na conexão com o banco de dados"}), 500
+
+    try:
+        cur = conn.cursor()
+        perfis_data = repositorio.buscar_perfis_publicos_gestores(cur, gestor_ids)
+        cur.close()
+
+        # Mantém a ordem dos ids pedidos
+        perfis = {row[0]: {
+            "gestor_id": row[0],
+            "nome": row[1],
+            "foto_perfil": row[2]
+        } for row in perfis_data}
+
+        return jsonify({
+            "gestores": [perfis[i] for i in gestor_ids if i in perfis]
+        }), 200
+
+    except Exception as e:
+        print(f"Erro ao obter perfis de gestores: {e}")
+        return jsonify({"error": "Erro interno ao buscar perfis."}), 500
+
     finally:
-        if conn:
-            conn.close()
+        release_db_connection(conn)
@@ -0,0 +1,143 @@
+"""
+Perfil de produção do gunicorn (carregado automaticamente a partir da raiz
+do projeto, ou com `gunicorn -c gunicorn.conf.py main:app`).
+
+A API passa quase todo o tempo esperando Postgres e Object Storage, então
+cada worker atende várias requisições ao mesmo tempo:
+
+    WEB_WORKER_CLASS=gthread  (padrão) threads de SO por worker
+    WEB_WORKER_CLASS=gevent   greenlets; exige o extra gevent
+                              (poetry install -E gevent).
+                              O psycopg2 passa a ceder a vez ao gevent
+                              enquanto espera o banco (wait callback).
+    WEB_WORKER_CLASS=sync     um request por worker (comportamento antigo)
+
+Workers e threads são calculados a partir das CPUs e da memória disponíveis
+ao contêiner e podem ser fixados com WEB_CONCURRENCY, WEB_THREADS e
+WEB_WORKER_CONNECTIONS. WEB_WORKER_MEMORY_MB é a memória estimada por worker.
+Lembre de manter DB_POOL_MAX >= WEB_THREADS, senão as threads disputam
+conexões do pool.
+
+Para comparar os modos, suba o servidor com cada WEB_WORKER_CLASS e rode:
+
+    python benchmark.py http://localhost:5000/lojas -c 32 -n 2000
+"""
+import os
+
+worker_class = os.getenv('WEB_WORKER_CLASS', 'gthread')
+
+if worker_class == 'gevent':
+    # Precisa acontecer antes de o app (e o psycopg2) ser importado no preload
+    from gevent import monkey
+
+    monkey.patch_all()
+
+
+def _cpus_disponiveis():
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    # Cota de CPU do cgroup v2 (Cloud Run / contêineres): "quota periodo" ou "max"
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as arquivo:
+            quota, periodo = arquivo.read().split()
+        if quota != 'max':
+            cpus = min(cpus, max(1, int(int(quota) / int(periodo))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def _memoria_disponivel_mb():
+    # Limite do cgroup v2, depois v1, por fim a memória total da máquina
+    for caminho in ('/sys/fs/cgroup/memory.max',
+                    '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(caminho) as arquivo:
+                valor = arquivo.read().strip()
+            if valor != 'max' and int(valor) < 1 << 50:
+                return int(valor) // (1024 * 1024)
+        except (OSError, ValueError):
+            pass
+
+    try:
+        with open('/proc/meminfo') as arquivo:
+            for linha in arquivo:
+                if linha.startswith('MemTotal:'):
+                    return int(linha.split()[1]) // 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _workers_padrao():
+    cpus = _cpus_disponiveis()
+    por_cpu = 2 * cpus + 1 if worker_class == 'sync' else cpus + 1
+
+    memoria_mb = _memoria_disponivel_mb()
+    if memoria_mb:
+        por_memoria = memoria_mb // int(os.getenv('WEB_WORKER_MEMORY_MB', '150'))
+        return max(1, min(por_cpu, por_memoria))
+    return max(1, por_cpu)
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', _workers_padrao()))
+
+if worker_class == 'gthread':
+    threads = int(os.getenv('WEB_THREADS', '8'))
+elif worker_class == 'gevent':
+    worker_connections = int(os.getenv('WEB_WORKER_CONNECTIONS', '200'))
+
+timeout = int(os.getenv('WEB_TIMEOUT', '30'))
+graceful_timeout = 20
+keepalive = 5
+
+# O app é importado uma vez no processo mestre e compartilhado (copy-on-write)
+preload_app = True
+
+accesslog = '-'
+errorlog = '-'
+
+
+def _esperar_gevent(conn, timeout=None):
+    """Wait callback que deixa o psycopg2 cooperativo sob gevent."""
+    import psycopg2
+    from gevent.socket import wait_read, wait_write
+    from psycopg2 import extensions
+
+    while True:
+        estado = conn.poll()
+        if estado == extensions.POLL_OK:
+            break
+        elif estado == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif estado == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError(f"Estado inesperado no poll: {estado!r}")
+
+
+def post_fork(server, worker):
+    """Recria, em cada worker, os recursos que não podem ser herdados do mestre."""
+    import armazenamento
+    import banco
+    import saude
+
+    if worker_class == 'gevent':
+        from psycopg2 import extensions
+
+        extensions.set_wait_callback(_esperar_gevent)
+
+    # Sockets de conexões do banco não podem ser compartilhados entre processos
+    banco.reiniciar_pool()
+
+    # O Client do Object Storage também mantém conexões HTTP próprias
+    armazenamento.reiniciar()
+
+    # Sem esperar o primeiro /readyz: a primeira verificação já sai agora
+    saude.monitor.garantir_execucao()
+
+    server.log.info(f"Worker {worker.pid} pronto ({worker_class}).")
@@ -0,0 +1,333 @@
+"""
+Importação de lojas em massa a partir de CSV.
+
+Uso:
+    python importacao.py lojas.csv --gestor 7
+    python importacao.py lojas.csv --gestor 7 --rejeitadas rejeitadas.csv
+
+POST /lojas/importar faz o mesmo para o gestor logado, com o CSV no campo
+'arquivo' de um multipart/form-data.
+
+O CSV tem cabeçalho, com as colunas em qualquer ordem: as do POST /loja
+(nome_loja, endereco_rua, endereco_cidade, endereco_estado, endereco_cep)
+e, opcionalmente, descricao, latitude e longitude. O arquivo vai para uma
+tabela temporária só de texto com COPY FROM STDIN, e a validação e a
+inserção em lojas são um único INSERT ... SELECT: nenhuma linha passa pelo
+Python e a memória do processo não depende do tamanho do arquivo.
+
+Linhas inválidas não são inseridas e voltam no relatório com o número do
+registro (1 = primeira linha depois do cabeçalho) e o motivo. Também são
+rejeitadas as repetidas, com o mesmo nome e CEP de uma loja que o gestor já
+tem ou de um registro anterior do arquivo: reimportar o mesmo arquivo não
+duplica lojas. Um CSV malformado (colunas a mais ou a menos, aspas sem
+fechar, UTF-8 inválido) cancela a importação inteira.
+"""
+import argparse
+import codecs
+import contextlib
+import csv
+import itertools
+import os
+import sys
+
+import psycopg2
+import psycopg2.extensions
+from flask import Blueprint, jsonify, request
+from psycopg2.extras import execute_values
+
+import invalidacao
+import repositorio
+from auth import token_obrigatorio
+from banco import (
+    ConexaoPreparada,
+    get_db_connection,
+    parametros_conexao,
+    registrar_escrita,
+    release_db_connection,
+)
+
+importacao_bp = Blueprint('importacao', __name__)
+
+REJEICOES_MAX = int(os.getenv('IMPORTACAO_REJEICOES_MAX', '1000'))
+
+# Chave do advisory lock que serializa as importações de um mesmo gestor
+CHAVE_LOCK = 727002
+
+# Tamanho máximo de cada coluna, como na tabela lojas
+COLUNAS_OBRIGATORIAS = {
+    'nome_loja': 255,
+    'endereco_rua': 255,
+    'endereco_cidade': 120,
+    'endereco_estado': 60,
+    'endereco_cep': 20,
+}
+COLUNAS_OPCIONAIS = ('descricao', 'latitude', 'longitude')
+
+# Registros por INSERT quando o COPY não está disponível (gevent)
+LOTE_INSERT = 1000
+
+SQL_TABELA_TEMPORARIA = """
+    CREATE TEMP TABLE lojas_importacao (
+        linha           BIGINT GENERATED ALWAYS AS IDENTITY,
+        nome_loja       TEXT,
+        descricao       TEXT,
+        endereco_rua    TEXT,
+        endereco_cidade TEXT,
+        endereco_estado TEXT,
+        endereco_cep    TEXT,
+        latitude        TEXT,
+        longitude       TEXT
+    ) ON COMMIT DROP
+"""
+
+NUMERO = r'^[-+]?([0-9]+\.?[0-9]*|\.[0-9]+)$'
+
+# Cada registro com o primeiro motivo de rejeição (NULL = válido). A ordem
+# dos WHEN importa: o cast só roda depois de a expressão regular aceitar.
+SQL_AVALIAR = f"""
+    CREATE TEMP TABLE lojas_importacao_avaliadas ON COMMIT DROP AS
+    WITH normalizadas AS (
+        SELECT linha,
+               NULLIF(btrim(nome_loja), '')       AS nome_loja,
+               NULLIF(btrim(descricao), '')       AS descricao,
+               NULLIF(btrim(endereco_rua), '')    AS endereco_rua,
+               NULLIF(btrim(endereco_cidade), '') AS endereco_cidade,
+               NULLIF(btrim(endereco_estado), '') AS endereco_estado,
+               NULLIF(btrim(endereco_cep), '')    AS endereco_cep,
+               NULLIF(btrim(latitude), '')        AS latitude,
+               NULLIF(btrim(longitude), '')       AS longitude
+        FROM lojas_importacao
+    ), campos AS (
+        SELECT n.*, CASE
+            {' '.join(
+                f"WHEN n.{coluna} IS NULL THEN '{coluna} vazio' "
+                f"WHEN length(n.{coluna}) > {tamanho} "
+                f"THEN '{coluna} com mais de {tamanho} caracteres'"
+                for coluna, tamanho in COLUNAS_OBRIGATORIAS.items())}
+            WHEN n.latitude !~ '{NUMERO}' THEN 'latitude inválida'
+            WHEN n.latitude::double precision NOT BETWEEN -90 AND 90
+                THEN 'latitude fora do intervalo -90 a 90'
+            WHEN n.longitude !~ '{NUMERO}' THEN 'longitude inválida'
+            WHEN n.longitude::double precision NOT BETWEEN -180 AND 180
+                THEN 'longitude fora do intervalo -180 a 180'
+        END AS motivo
+        FROM normalizadas n
+    )
+    SELECT c.linha, c.nome_loja, c.descricao, c.endereco_rua, c.endereco_cidade,
+           c.endereco_estado, c.endereco_cep, c.latitude, c.longitude,
+           CASE
+               WHEN c.motivo IS NOT NULL THEN c.motivo
+               WHEN row_number() OVER (
+                        PARTITION BY c.motivo IS NULL, lower(c.nome_loja), c.endereco_cep
+                        ORDER BY c.linha) > 1
+                   THEN 'repetida no arquivo (mesmo nome e CEP)'
+               WHEN EXISTS (
+                        SELECT 1 FROM lojas l
+                        WHERE l.gestor_id = %(gestor_id)s
+                          AND lower(l.nome_loja) = lower(c.nome_loja)
+                          AND l.endereco_cep = c.endereco_cep)
+                   THEN 'loja já cadastrada (mesmo nome e CEP)'
+           END AS motivo
+    FROM campos c
+"""
+
+SQL_INSERIR = """
+    INSERT INTO lojas (gestor_id, nome_loja, descricao, endereco_rua, endereco_cidade,
+                       endereco_estado, endereco_cep, latitude, longitude)
+    SELECT %(gestor_id)s, nome_loja, descricao, endereco_rua, endereco_cidade,
+           endereco_estado, endereco_cep,
+           latitude::double precision, longitude::double precision
+    FROM lojas_importacao_avaliadas
+    WHERE motivo IS NULL
+    ORDER BY linha
+"""
+
+SQL_REJEICOES = """
+    SELECT linha, motivo FROM lojas_importacao_avaliadas
+    WHERE motivo IS NOT NULL
+    ORDER BY linha
+    LIMIT %s
+"""
+
+SQL_EXPORTAR_REJEITADAS = """
+    COPY (
+        SELECT linha, motivo, nome_loja, descricao, endereco_rua, endereco_cidade,
+               endereco_estado, endereco_cep, latitude, longitude
+        FROM lojas_importacao_avaliadas
+        WHERE motivo IS NOT NULL
+        ORDER BY linha
+    ) TO STDOUT WITH (FORMAT csv, HEADER)
+"""
+
+
+def ler_cabecalho(arquivo):
+    """
+    Lê a primeira linha de 'arquivo' (binário) e retorna as colunas na ordem
+    do CSV. Levanta ValueError se faltar coluna obrigatória ou houver
+    coluna desconhecida ou repetida.
+    """
+    # utf-8-sig: planilhas costumam gravar o BOM no início do arquivo
+    primeira = arquivo.readline().decode('utf-8-sig')
+    colunas = [nome.strip().lower() for nome in next(csv.reader([primeira]), [])]
+
+    permitidas = set(COLUNAS_OBRIGATORIAS) | set(COLUNAS_OPCIONAIS)
+    desconhecidas = [coluna for coluna in colunas if coluna not in permitidas]
+    if desconhecidas:
+        raise ValueError(f"Colunas desconhecidas no cabeçalho: {', '.join(desconhecidas)}.")
+    if len(set(colunas)) != len(colunas):
+        raise ValueError("Coluna repetida no cabeçalho.")
+    faltando = [coluna for coluna in COLUNAS_OBRIGATORIAS if coluna not in colunas]
+    if faltando:
+        raise ValueError(f"Colunas obrigatórias ausentes: {', '.join(faltando)}.")
+    return colunas
+
+
+def _carregar(cur, colunas, arquivo):
+    """Copia o restante de 'arquivo' para a tabela temporária."""
+    lista = ', '.join(colunas)
+    if psycopg2.extensions.get_wait_callback() is None:
+        cur.copy_expert(
+            f"COPY lojas_importacao ({lista}) FROM STDIN WITH (FORMAT csv)", arquivo)
+        return
+
+    # Com o wait callback do gevent o psycopg2 recusa COPY: o arquivo vai em
+    # lotes de INSERT, que cedem a vez aos outros greenlets
+    leitor = csv.reader(codecs.getreader('utf-8')(arquivo))
+    while True:
+        lote = list(itertools.islice(leitor, LOTE_INSERT))
+        if not lote:
+            return
+        for registro in lote:
+            if len(registro) != len(colunas):
+                raise ValueError(
+                    f"Registro com {len(registro)} colunas; o cabeçalho tem {len(colunas)}.")
+        # Aqui campo vazio chega como '' (no COPY seria NULL); o
+        # NULLIF(btrim(...), '') de SQL_AVALIAR trata os dois como vazios
+        execute_values(cur, f"INSERT INTO lojas_importacao ({lista}) VALUES %s",
+                       lote, page_size=LOTE_INSERT)
+
+
+def importar(conn, gestor_id, arquivo, rejeitadas=None):
+    """
+    Importa o CSV 'arquivo' (binário) como lojas de gestor_id, na transação
+    de 'conn' (quem chama faz o commit). Se 'rejeitadas' for um arquivo
+    binário, recebe o CSV completo das linhas rejeitadas.
+    Retorna {'importadas', 'rejeitadas', 'rejeicoes'}, com até
+    IMPORTACAO_REJEICOES_MAX rejeições.
+    Levanta ValueError (cabeçalho) ou psycopg2.DataError (CSV malformado).
+    """
+    colunas = ler_cabecalho(arquivo)
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_xact_lock(%s, %s);", (CHAVE_LOCK, gestor_id))
+        cur.execute(SQL_TABELA_TEMPORARIA)
+        _carregar(cur, colunas, arquivo)
+
+        cur.execute(SQL_AVALIAR, {'gestor_id': gestor_id})
+        cur.execute(SQL_INSERIR, {'gestor_id': gestor_id})
+        importadas = cur.rowcount
+
+        cur.execute(
+            "SELECT count(*) FROM lojas_importacao_avaliadas WHERE motivo IS NOT NULL;")
+        total_rejeitadas = cur.fetchone()[0]
+        cur.execute(SQL_REJEICOES, (REJEICOES_MAX, ))
+        rejeicoes = [{"linha": linha, "motivo": motivo} for linha, motivo in cur.fetchall()]
+
+        if rejeitadas is not None and total_rejeitadas:
+            cur.copy_expert(SQL_EXPORTAR_REJEITADAS, rejeitadas)
+
+        if importadas:
+            invalidacao.notificar(cur, 'loja')
+
+    return {
+        "importadas": importadas,
+        "rejeitadas": total_rejeitadas,
+        "rejeicoes": rejeicoes,
+    }
+
+
+@importacao_bp.route('/lojas/importar', methods=['POST'])
+@token_obrigatorio(role_necessaria='gestor')
+def importar_lojas(dados_usuario):
+    """
+    POST /lojas/importar
+    Rota protegida. Importa um CSV de lojas para o gestor logado (formato em importacao.py).
+    Requer: multipart/form-data com o CSV no campo 'arquivo'.
+    Retorna: JSON com 'importadas', 'rejeitadas' e 'rejeicoes' ([{linha, motivo}], até
+    IMPORTACAO_REJEICOES_MAX) ou erro (400, 500).
+    """
+    # O multipart já foi gravado em arquivo temporário: a conexão só é
+    # pega depois que o upload terminou
+    arquivo = request.files.get('arquivo')
+    if arquivo is None:
+        return jsonify({"error": "Envie o CSV no campo 'arquivo'."}), 400
+
+    gestor_id = dados_usuario.get('gestor_id')
+
+    conn = get_db_connection()
+    if conn is None:
+        return jsonify({"error": "Falha na conexão com o banco de dados"}), 500
+
+    try:
+        with conn:
+            resultado = importar(conn, gestor_id, arquivo.stream)
+            conn.commit()
+        if resultado["importadas"]:
+            registrar_escrita()
+        return jsonify(resultado), 200
+
+    except ValueError as e:
+        conn.rollback()
+        return jsonify({"error": f"CSV inválido. {e}"}), 400
+
+    except psycopg2.DataError as e:
+        conn.rollback()
+        detalhe = (e.pgerror or str(e)).strip()
+        return jsonify({"error": f"CSV inválido. {detalhe}"}), 400
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Erro ao importar lojas do gestor {gestor_id}: {e}")
+        return jsonify({"error": "Erro interno ao importar lojas."}), 500
+
+    finally:
+        release_db_connection(conn)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('arquivo', help='CSV com cabeçalho')
+    parser.add_argument('--gestor', type=int, required=True,
+                        help='gestor_id dono das lojas importadas')
+    parser.add_argument('--rejeitadas',
+                        help='grava aqui o CSV das linhas rejeitadas, com o motivo')
+    args = parser.parse_args()
+
+    # ConexaoPreparada: repositorio.executar() guarda nela os statements preparados
+    conn = psycopg2.connect(connection_factory=ConexaoPreparada, **parametros_conexao())
+    try:
+        with conn.cursor() as cur:
+            if repositorio.buscar_perfil_gestor(cur, args.gestor) is None:
+                print(f"Gestor {args.gestor} não encontrado.")
+                sys.exit(1)
+
+        with contextlib.ExitStack() as pilha:
+            saida = pilha.enter_context(open(args.rejeitadas, 'wb')) if args.rejeitadas else None
+            arquivo = pilha.enter_context(open(args.arquivo, 'rb'))
+            resultado = importar(conn, args.gestor, arquivo, saida)
+            conn.commit()
+    except (ValueError, psycopg2.DataError) as e:
+        conn.rollback()
+        print(f"CSV inválido: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+    print(f"importadas: {resultado['importadas']}")
+    print(f"rejeitadas: {resultado['rejeitadas']}")
+    for rejeicao in resultado['rejeicoes']:
+        print(f"  registro {rejeicao['linha']}: {rejeicao['motivo']}")
+
+
+if __name__ == '__main__':
+    main()
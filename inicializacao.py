@@ -0,0 +1,98 @@
+"""
+Relatório de inicialização (cold start).
+
+Este módulo deve ser o primeiro import de main.py. Ao ser importado ele passa
+a cronometrar cada módulo importado pela primeira vez (tempo acumulado, já
+incluindo os imports aninhados). registrar(app) encerra a cronometragem e
+guarda o tempo até a primeira requisição atendida pelo processo.
+
+O relatório é impresso no log na primeira requisição e fica disponível em
+GET /startup-report.
+
+O que custa I/O ou memória fica para o primeiro uso, no processo que vai
+usar: os pools de conexão (banco._pools), o backend do Object Storage
+(armazenamento.obter_backend), o snapshot do catálogo e as threads de fundo
+(garantir_execucao de revogacao, invalidacao, catalogo, tarefas e saude).
+Os singletons criados no import (caches, Bcrypt, executor) não fazem I/O.
+Os módulos dos Blueprints continuam importados no início: as rotas precisam
+estar registradas antes da primeira requisição, e com preload_app do
+gunicorn esse import acontece uma vez no mestre e é herdado pelos workers.
+Adiá-lo só moveria o custo para a primeira requisição. Se um módulo passar
+a pesar no relatório, adie o import dele para o primeiro uso.
+"""
+import builtins
+import os
+import sys
+import threading
+import time
+
+INICIO = time.perf_counter()
+
+_import_original = builtins.__import__
+_tempos_import = {}
+_marcos = {}
+_lock = threading.Lock()
+
+
+def _import_cronometrado(name, globals=None, locals=None, fromlist=(), level=0):
+    if level != 0 or name in sys.modules:
+        return _import_original(name, globals, locals, fromlist, level)
+
+    inicio = time.perf_counter()
+    try:
+        return _import_original(name, globals, locals, fromlist, level)
+    finally:
+        _tempos_import.setdefault(name, time.perf_counter() - inicio)
+
+
+builtins.__import__ = _import_cronometrado
+
+
+def _ms(segundos):
+    return round(segundos * 1000, 1)
+
+
+def marcar(nome):
+    """Registra um marco (ms desde o início do processo), apenas na primeira vez."""
+    _marcos.setdefault(nome, _ms(time.perf_counter() - INICIO))
+
+
+def relatorio(limite=25):
+    mais_lentos = sorted(_tempos_import.items(), key=lambda item: item[1],
+                         reverse=True)[:limite]
+    return {
+        "pid": os.getpid(),
+        "marcos_ms": dict(_marcos),
+        "imports_ms": {nome: _ms(duracao) for nome, duracao in mais_lentos},
+    }
+
+
+def _primeira_requisicao():
+    if 'primeira_requisicao' in _marcos:
+        return
+    with _lock:
+        if 'primeira_requisicao' in _marcos:
+            return
+        marcar('primeira_requisicao')
+    print(f"Relatório de inicialização: {relatorio(limite=10)}")
+
+
+def startup_report():
+    """
+    GET /startup-report
+    Tempos de import por módulo e marcos do cold start deste processo.
+    """
+    # Flask é importado aqui (e não no topo) para que o próprio import do
+    # Flask em main.py também seja cronometrado.
+    from flask import jsonify
+
+    return jsonify(relatorio()), 200
+
+
+def registrar(app):
+    """Encerra a cronometragem de imports e mede o tempo até a primeira requisição."""
+    builtins.__import__ = _import_original
+    marcar('app_pronto')
+    app.before_request(_primeira_requisicao)
+    app.add_url_rule('/startup-report', 'startup_report', startup_report,
+                     methods=['GET'])
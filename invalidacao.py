@@ -0,0 +1,198 @@
+"""
+Caches locais do processo, invalidados entre workers por LISTEN/NOTIFY.
+
+As rotas de escrita chamam notificar(cur, entidade, id) dentro da própria
+transação; o PostgreSQL só entrega o NOTIFY no commit (e nunca num
+rollback). Cada processo mantém uma conexão dedicada com LISTEN no canal
+INVALIDACAO_CANAL (padrão 'invalidacao') numa thread leve, que aplica os
+eventos aos caches registrados para aquela entidade.
+
+Se a conexão de escuta cair, eventos podem ter se perdido: todos os caches
+são esvaziados e a thread reconecta. O TTL de cada cache (CACHE_TTL_S,
+padrão 60) limita quanto tempo um dado pode ficar velho se a escuta
+estiver fora. CACHE_HABILITADO=0 desliga os caches.
+
+O NOTIFY não é replicado: a escuta é sempre no primário.
+"""
+import json
+import os
+import select
+import threading
+import time
+from collections import OrderedDict
+
+import psycopg2
+import psycopg2.extensions
+
+from banco import get_db_connection, parametros_conexao, release_db_connection
+from segundo_plano import ThreadPorProcesso
+
+CANAL = os.getenv('INVALIDACAO_CANAL', 'invalidacao')
+HABILITADO = os.getenv('CACHE_HABILITADO', '1') == '1'
+TTL_PADRAO = float(os.getenv('CACHE_TTL_S', '60'))
+MAXIMO_PADRAO = int(os.getenv('CACHE_MAX_ITENS', '10000'))
+
+_caches = []
+
+
+class CacheLocal:
+    """
+    Cache LRU com TTL de um processo. Com granular=True os eventos com id
+    invalidam só aquela chave; com granular=False (ex.: listagens) qualquer
+    evento da entidade esvazia o cache.
+    """
+
+    def __init__(self, nome, entidade, granular=True, ttl=None, maximo=None):
+        self.nome = nome
+        self.entidade = entidade
+        self.granular = granular
+        self.ttl = TTL_PADRAO if ttl is None else ttl
+        self.maximo = MAXIMO_PADRAO if maximo is None else maximo
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+        self._geracao = 0
+        registrar(self)
+
+    def obter(self, chave, carregar):
+        """Retorna o valor em cache ou o de carregar(), guardando-o."""
+        if not HABILITADO:
+            return carregar()
+        ouvinte.garantir_execucao()
+
+        agora = time.monotonic()
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is not None and item[0] > agora:
+                self._itens.move_to_end(chave)
+                return item[1]
+            geracao = self._geracao
+
+        valor = carregar()
+
+        with self._lock:
+            # Uma invalidação durante o carregamento torna o valor suspeito
+            if geracao == self._geracao:
+                self._itens[chave] = (agora + self.ttl, valor)
+                self._itens.move_to_end(chave)
+                while len(self._itens) > self.maximo:
+                    self._itens.popitem(last=False)
+        return valor
+
+    def invalidar(self, chave):
+        with self._lock:
+            self._itens.pop(chave, None)
+            self._geracao += 1
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+            self._geracao += 1
+
+    def aplicar(self, entidade, entidade_id):
+        if entidade != self.entidade:
+            return
+        if self.granular and entidade_id is not None:
+            self.invalidar(entidade_id)
+        else:
+            self.limpar()
+
+
+def registrar(cache):
+    """Inscreve nos eventos um objeto com aplicar(entidade, id) e limpar()."""
+    _caches.append(cache)
+
+
+def _aplicar(entidade, entidade_id):
+    for cache in _caches:
+        cache.aplicar(entidade, entidade_id)
+
+
+def notificar(cur, entidade, entidade_id=None):
+    """
+    Publica a invalidação na transação de 'cur' (entregue no commit).
+    entidade_id None invalida todos os itens da entidade.
+    """
+    carga = json.dumps({"entidade": entidade, "id": entidade_id})
+    cur.execute("SELECT pg_notify(%s, %s);", (CANAL, carga))
+    # Este processo já descarta o valor antigo; o evento do commit cobre
+    # quem recarregar entre agora e o commit
+    _aplicar(entidade, entidade_id)
+
+
+def ler_no_banco(funcao):
+    """
+    Executa funcao(cur) no primário; usado nos carregadores dos caches.
+
+    Não usa réplica: depois de uma invalidação, uma réplica atrasada
+    devolveria o valor anterior à escrita (ex.: a chave de uma foto já
+    apagada do armazenamento) e ele ficaria no cache por CACHE_TTL_S.
+    """
+    conn = get_db_connection()
+    if conn is None:
+        raise Exception("Falha na conexão com o banco de dados")
+    try:
+        with conn.cursor() as cur:
+            resultado = funcao(cur)
+        conn.rollback()
+        return resultado
+    finally:
+        release_db_connection(conn)
+
+
+class Ouvinte:
+    """Thread com LISTEN no canal de invalidação, uma por processo."""
+
+    ESPERA_RECONEXAO_MAX = 30
+
+    def __init__(self):
+        self._thread = ThreadPorProcesso('ouvinte-invalidacao', self._executar)
+
+    def garantir_execucao(self):
+        self._thread.garantir()
+
+    def _executar(self):
+        espera = 1
+        while True:
+            inicio = time.monotonic()
+            try:
+                self._escutar()
+            except Exception as e:
+                print(f"Aviso: escuta de invalidação interrompida: {e}")
+            # Eventos podem ter sido perdidos enquanto a conexão estava fora
+            for cache in _caches:
+                cache.limpar()
+
+            if time.monotonic() - inicio > self.ESPERA_RECONEXAO_MAX:
+                espera = 1
+            time.sleep(espera)
+            espera = min(espera * 2, self.ESPERA_RECONEXAO_MAX)
+
+    def _escutar(self):
+        conn = psycopg2.connect(**parametros_conexao())
+        try:
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cur:
+                cur.execute(f'LISTEN "{CANAL}";')
+            # Tudo que foi cacheado antes do LISTEN pode ter perdido eventos
+            for cache in _caches:
+                cache.limpar()
+
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    self._processar(conn.notifies.pop(0).payload)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _processar(carga):
+        try:
+            evento = json.loads(carga)
+            _aplicar(evento["entidade"], evento.get("id"))
+        except Exception as e:
+            print(f"Aviso: evento de invalidação inválido {carga!r}: {e}")
+
+
+ouvinte = Ouvinte()
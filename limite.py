@@ -0,0 +1,207 @@
+"""
+Limite de taxa (token bucket) para as rotas de login e cadastro.
+
+Cada requisição consome um token do balde do IP do cliente e outro do balde
+do email informado. O balde começa cheio (BURST tokens) e recebe REFILL
+tokens por segundo. Sem token disponível a rota responde 429 antes de
+abrir conexão com o banco ou calcular bcrypt.
+
+Configuração (variáveis de ambiente):
+    RATE_LIMIT_BACKEND       'memoria' (padrão, por processo) ou 'postgres'
+                             (compartilhado entre workers e instâncias)
+    RATE_LIMIT_IP_BURST      capacidade do balde por IP (padrão 10)
+    RATE_LIMIT_IP_REFILL     tokens/segundo por IP (padrão 0.2)
+    RATE_LIMIT_EMAIL_BURST   capacidade do balde por email (padrão 5)
+    RATE_LIMIT_EMAIL_REFILL  tokens/segundo por email (padrão 0.05)
+
+O IP vem de banco.ip_do_cliente(): atrás do proxy do Replit/Cloud Run é o
+endereço que ele acrescenta ao X-Forwarded-For (PROXIES_CONFIAVEIS=1, já
+definido no [env] do .replit); o resto do cabeçalho é do cliente e não é
+considerado. Sem essa variável, todos os clientes atrás do proxy dividiriam
+o balde do IP do próprio proxy.
+"""
+import math
+import os
+import random
+import threading
+import time
+from functools import wraps
+
+from flask import jsonify, make_response, request
+
+from banco import get_db_connection, ip_do_cliente, release_db_connection
+
+
+class TokenBucket:
+    """Balde de tokens local (não é thread-safe; quem usa protege com lock)."""
+
+    def __init__(self, capacidade, reposicao, agora=None):
+        self.capacidade = capacidade
+        self.reposicao = reposicao
+        self.tokens = float(capacidade)
+        self.atualizado_em = time.monotonic() if agora is None else agora
+
+    def consumir(self, agora, custo=1):
+        """Retorna (permitido, segundos até haver tokens suficientes)."""
+        decorrido = max(0.0, agora - self.atualizado_em)
+        self.tokens = min(self.capacidade, self.tokens + decorrido * self.reposicao)
+        self.atualizado_em = agora
+
+        if self.tokens >= custo:
+            self.tokens -= custo
+            return True, 0.0
+        return False, _espera(self.tokens, custo, self.reposicao)
+
+    def cheio(self, agora):
+        decorrido = agora - self.atualizado_em
+        return self.tokens + decorrido * self.reposicao >= self.capacidade
+
+
+def _espera(tokens, custo, reposicao):
+    if reposicao <= 0:
+        return math.inf
+    return (custo - tokens) / reposicao
+
+
+class BackendMemoria:
+    """Baldes no próprio processo: o limite vale por worker."""
+
+    # Intervalo (s) entre duas varreduras dos baldes cheios
+    LIMPEZA_INTERVALO_S = 60.0
+
+    def __init__(self):
+        self._baldes = {}
+        self._lock = threading.Lock()
+        self._limpo_em = time.monotonic()
+
+    def consumir(self, chave, capacidade, reposicao):
+        agora = time.monotonic()
+        with self._lock:
+            if agora - self._limpo_em >= self.LIMPEZA_INTERVALO_S:
+                self._limpar(agora)
+            balde = self._baldes.get(chave)
+            if balde is None:
+                balde = self._baldes[chave] = TokenBucket(capacidade, reposicao, agora)
+            return balde.consumir(agora)
+
+    def _limpar(self, agora):
+        # Baldes cheios se comportam igual a baldes inexistentes
+        self._limpo_em = agora
+        for chave in [c for c, b in self._baldes.items() if b.cheio(agora)]:
+            del self._baldes[chave]
+
+
+class BackendPostgres:
+    """
+    Baldes na tabela UNLOGGED limites_taxa (migração 0003), compartilhados por
+    todos os workers. Reposição e consumo acontecem num único UPSERT atômico.
+    """
+
+    _TOKENS_REPOSTOS = """
+        LEAST(%(capacidade)s, l.tokens
+              + EXTRACT(EPOCH FROM clock_timestamp() - l.atualizado_em) * %(reposicao)s)
+    """
+    CONSUMIR = f"""
+        INSERT INTO limites_taxa AS l (chave, tokens, permitido, atualizado_em)
+        VALUES (%(chave)s, %(capacidade)s - 1, TRUE, clock_timestamp())
+        ON CONFLICT (chave) DO UPDATE SET
+            tokens = CASE WHEN {_TOKENS_REPOSTOS} >= 1
+                          THEN {_TOKENS_REPOSTOS} - 1
+                          ELSE {_TOKENS_REPOSTOS} END,
+            permitido = {_TOKENS_REPOSTOS} >= 1,
+            atualizado_em = clock_timestamp()
+        RETURNING permitido, tokens;
+    """
+    LIMPAR = "DELETE FROM limites_taxa WHERE atualizado_em < clock_timestamp() - interval '1 hour';"
+
+    # Probabilidade de cada chamada também limpar baldes antigos
+    CHANCE_LIMPEZA = 0.001
+
+    def consumir(self, chave, capacidade, reposicao):
+        conn = get_db_connection()
+        if conn is None:
+            # Sem banco a rota também falharia; não bloqueia por causa do limite
+            return True, 0.0
+
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(self.CONSUMIR, {
+                        'chave': chave,
+                        'capacidade': capacidade,
+                        'reposicao': reposicao,
+                    })
+                    permitido, tokens = cur.fetchone()
+                    if random.random() < self.CHANCE_LIMPEZA:
+                        cur.execute(self.LIMPAR)
+            if permitido:
+                return True, 0.0
+            return False, _espera(tokens, 1, reposicao)
+        except Exception as e:
+            print(f"Aviso: limite de taxa indisponível, requisição liberada: {e}")
+            return True, 0.0
+        finally:
+            release_db_connection(conn)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def obter_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                nome = os.getenv('RATE_LIMIT_BACKEND', 'memoria')
+                _backend = BackendPostgres() if nome == 'postgres' else BackendMemoria()
+    return _backend
+
+
+def _regras():
+    return (
+        ('ip', float(os.getenv('RATE_LIMIT_IP_BURST', '10')),
+         float(os.getenv('RATE_LIMIT_IP_REFILL', '0.2'))),
+        ('email', float(os.getenv('RATE_LIMIT_EMAIL_BURST', '5')),
+         float(os.getenv('RATE_LIMIT_EMAIL_REFILL', '0.05'))),
+    )
+
+
+def limitar_taxa(nome_rota):
+    """
+    Decorador que aplica os baldes por IP e por email à rota.
+
+    Deve ficar logo abaixo do @route, para rodar antes de qualquer acesso ao
+    banco ou ao bcrypt.
+    """
+
+    def decorator(f):
+
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            data = request.get_json(silent=True) or {}
+            email = data.get('email') if isinstance(data, dict) else None
+
+            identificadores = {'ip': ip_do_cliente()}
+            if isinstance(email, str) and email:
+                identificadores['email'] = email.strip().lower()
+
+            backend = obter_backend()
+            for tipo, capacidade, reposicao in _regras():
+                if tipo not in identificadores:
+                    continue
+                chave = f"{nome_rota}:{tipo}:{identificadores[tipo]}"
+                permitido, espera = backend.consumir(chave, capacidade, reposicao)
+                if not permitido:
+                    resposta = make_response(jsonify({
+                        "error": "Muitas tentativas. Tente novamente mais tarde."
+                    }), 429)
+                    if math.isfinite(espera):
+                        resposta.headers['Retry-After'] = str(max(1, math.ceil(espera)))
+                    return resposta
+
+            return f(*args, **kwargs)
+
+        return decorated
+
+    return decorator
@@ -1,19 +1,26 @@
+import base64
+import json
 import os
-from io import BytesIO
 
 import psycopg2
-from flask import Blueprint, jsonify, request, send_file
-from replit.object_storage import Client  # Importar para gestão de arquivos
+from flask import Blueprint, Response, jsonify, request
 
+import armazenamento
+import catalogo
+import exportacao
+import invalidacao
+import repositorio
 from auth import token_obrigatorio
-from banco import get_db_connection
-
-# Instância do Object Storage Client
-client = Client() # Instância do client para uploads/downloads
+from banco import get_db_connection, registrar_escrita, release_db_connection
 
 # Definição do Blueprint
 loja_bp = Blueprint('loja', __name__)
 
+# Caches do processo, invalidados pelas escritas via NOTIFY: o nome da foto
+# por loja e a listagem completa (qualquer escrita em lojas a descarta)
+FOTOS_LOJA = invalidacao.CacheLocal('fotos_loja', 'loja')
+LISTAGEM_LOJAS = invalidacao.CacheLocal('listagem_lojas', 'loja', granular=False)
+
 
 # Rota 7: Criar uma nova Loja (Mantida)
 @loja_bp.route('/loja', methods=['POST'])
@@ -43,16 +50,10 @@ def criar_loja(dados_usuario): # Recebe o payload do token
     try:
         cur = conn.cursor()
         # Note que a coluna foto_perfil será NULL por padrão.
-        query = """
-            INSERT INTO lojas (gestor_id, nome_loja, endereco_rua, endereco_cidade, endereco_estado, endereco_cep)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            RETURNING loja_id, gestor_id, nome_loja, descricao, endereco_rua, endereco_cidade, endereco_estado, endereco_cep, latitude, longitude, data_criacao, foto_perfil;
-        """
-        cur.execute(query, (gestor_id_logado, nome_loja, data['endereco_rua'],
-                             data['endereco_cidade'], data['endereco_estado'],
-                             data['endereco_cep']))
-
-        resultado_completo = cur.fetchone()
+        resultado_completo = repositorio.inserir_loja(
+            cur, gestor_id_logado, nome_loja, data['endereco_rua'],
+            data['endereco_cidade'], data['endereco_estado'],
+            data['endereco_cep'])
 
         if resultado_completo is None:
             raise Exception(
@@ -74,7 +75,9 @@ def criar_loja(dados_usuario): # Recebe o payload do token
             "foto_perfil": resultado_completo[11] # Novo campo
         }
 
+        invalidacao.notificar(cur, 'loja', loja_criada['loja_id'])
         conn.commit()
+        registrar_escrita()
         cur.close()
 
         return jsonify({
@@ -95,8 +98,7 @@ def criar_loja(dados_usuario): # Recebe o payload do token
                         f"Erro interno ao criar loja. Detalhe: {e}"}), 500
 
     finally:
-        if conn:
-            conn.close()
+        release_db_connection(conn)
 
 
 # NOVO: Rota Protegida: Atualizar Loja (Incluindo Foto)
@@ -116,8 +118,7 @@ def atualizar_loja(dados_usuario, loja_id):
     data = request.form if request.form else request.get_json() or {}
     foto = request.files.get('foto_perfil')
 
-    updates = []
-    valores = []
+    campos = {}
 
     # Processar campos de texto
     campos_permitidos = [
@@ -128,87 +129,127 @@ def atualizar_loja(dados_usuario, loja_id):
     for campo in campos_permitidos:
         valor = data.get(campo)
         if valor is not None:
-            updates.append(f"{campo} = %s")
-            valores.append(valor)
+            campos[campo] = valor
+
+    # --- Verificação de Updates ---
+    if not campos and not foto:
+        return jsonify({
+            "error":
+            "Nenhum dado (texto ou foto) fornecido para atualização."
+        }), 400
+
+    # --- Upload da Foto (fora de qualquer transação, semelhante ao gestor.py) ---
+    # Chave nova a cada envio; se o UPDATE não acontecer, ela é descartada.
+    nova_foto = None
+    if foto:
+        nova_foto = armazenamento.nova_chave_foto(f"loja_{loja_id}_perfil", foto.filename)
+        try:
+            foto.seek(0) # Garantir que o ponteiro está no início, caso tenha sido lido antes
+            armazenamento.enviar(nova_foto, foto.read())
+        except Exception as e:
+            print(f"Erro ao enviar foto da loja {loja_id}: {e}")
+            return jsonify({"error": "Erro ao salvar a foto da loja."}), 500
+        campos['foto_perfil'] = nova_foto
 
     conn = get_db_connection()
     if conn is None:
+        armazenamento.descartar(nova_foto)
         return jsonify({"error": "Falha na conexão com o banco de dados"}), 500
 
+    erro = None
     try:
+        # Transação curta: o UPDATE já filtra pelo dono e devolve a foto anterior
         with conn:
             with conn.cursor() as cur:
-                # 1. VERIFICAR PROPRIEDADE DA LOJA
-                cur.execute(
-                    "SELECT gestor_id, foto_perfil FROM lojas WHERE loja_id = %s;",
-                    (loja_id,)
-                )
-                resultado_propriedade = cur.fetchone()
-
-                if not resultado_propriedade:
-                    return jsonify({"error": "Loja não encontrada."}), 404
-
-                gestor_id_dono, foto_antiga = resultado_propriedade
-
-                # Check 403 Forbidden: O gestor logado é o dono?
-                if gestor_id_dono != gestor_id_logado:
-                    return jsonify({"error": "Acesso negado. Você não é o gestor desta loja."}), 403
-
-
-                # --- Lógica de Upload de Foto (semelhante ao gestor.py) ---
-                if foto:
-                    # 2. Deletar foto antiga do storage se existir
-                    if foto_antiga:
-                        try:
-                            client.delete(foto_antiga, ignore_not_found=True)
-                        except Exception as e:
-                            print(f"Aviso: Erro ao deletar foto antiga da loja {loja_id}: {e}")
-
-                    # 3. Fazer upload da nova foto
-                    extensao = os.path.splitext(foto.filename)[1] if foto.filename else '.jpg'
-                    nome_arquivo = f"loja_{loja_id}_perfil{extensao}"
-
-                    # Upload do arquivo para o storage
-                    foto.seek(0) # Garantir que o ponteiro está no início, caso tenha sido lido antes
-                    client.upload_from_bytes(nome_arquivo, foto.read())
-
-                    # 4. Adicionar o caminho da nova foto aos updates do DB
-                    updates.append("foto_perfil = %s")
-                    valores.append(nome_arquivo)
-
-                # --- Verificação de Updates ---
-                if not updates:
-                    return jsonify({
-                        "error":
-                        "Nenhum dado (texto ou foto) fornecido para atualização."
-                    }), 400
-
-                # --- Execução do SQL UPDATE ---
-                query = f"""
-                    UPDATE lojas
-                    SET {', '.join(updates)}
-                    WHERE loja_id = %s AND gestor_id = %s;
-                """
-                # Adiciona o ID da loja e o ID do gestor para o filtro WHERE
-                valores.extend([loja_id, gestor_id_logado])
-
-                cur.execute(query, tuple(valores))
+                resultado = repositorio.atualizar_loja(cur, loja_id, gestor_id_logado, campos)
 
-                conn.commit()
+                if resultado is not None:
+                    invalidacao.notificar(cur, 'loja', loja_id)
+                else:
+                    # Nada atualizado: a loja não existe ou é de outro gestor?
+                    if repositorio.buscar_dono_e_foto_loja(cur, loja_id) is None:
+                        erro = ({"error": "Loja não encontrada."}, 404)
+                    else:
+                        erro = ({"error": "Acesso negado. Você não é o gestor desta loja."}, 403)
 
-        # Resposta de Sucesso
-        return jsonify({"message":
-                        f"Loja {loja_id} atualizada com sucesso."}), 200
+                conn.commit()
+        if resultado is not None:
+            registrar_escrita()
 
     except Exception as e:
         conn.rollback()
+        armazenamento.descartar(nova_foto)
         print(f"Erro ao atualizar loja {loja_id}: {e}")
         return jsonify(
             {"error": "Erro interno ao atualizar loja."}), 500
 
     finally:
-        if conn:
-            conn.close()
+        release_db_connection(conn)
+
+    if erro:
+        armazenamento.descartar(nova_foto)
+        return jsonify(erro[0]), erro[1]
+
+    # Conexão já devolvida: a foto antiga é apagada sem segurar o banco nem a linha
+    foto_antiga = resultado[0]
+    if nova_foto and foto_antiga and foto_antiga != nova_foto:
+        armazenamento.descartar(foto_antiga)
+
+    # Resposta de Sucesso
+    return jsonify({"message":
+                    f"Loja {loja_id} atualizada com sucesso."}), 200
+
+# NOVO: Rota Protegida: Deletar Loja
+@loja_bp.route('/loja/<int:loja_id>', methods=['DELETE'])
+@token_obrigatorio(role_necessaria='gestor')
+def deletar_loja(dados_usuario, loja_id):
+    """
+    DELETE /loja/<loja_id>
+    Rota protegida. Permite ao gestor logado deletar uma de suas lojas (e a foto da loja).
+    Requer: Token JWT válido.
+    Retorna: Mensagem de sucesso ou erro (403, 404, 500).
+    """
+    gestor_id_logado = dados_usuario.get('gestor_id')
+
+    conn = get_db_connection()
+    if conn is None:
+        return jsonify({"error": "Falha na conexão com o banco de dados"}), 500
+
+    erro = None
+    try:
+        # Transação curta: o DELETE já filtra pelo dono e devolve a foto
+        with conn:
+            with conn.cursor() as cur:
+                resultado = repositorio.deletar_loja(cur, loja_id, gestor_id_logado)
+
+                if resultado is not None:
+                    invalidacao.notificar(cur, 'loja', loja_id)
+                else:
+                    if repositorio.buscar_dono_e_foto_loja(cur, loja_id) is None:
+                        erro = ({"error": "Loja não encontrada."}, 404)
+                    else:
+                        erro = ({"error": "Acesso negado. Você não é o gestor desta loja."}, 403)
+
+                conn.commit()
+        if resultado is not None:
+            registrar_escrita()
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Erro ao deletar loja {loja_id}: {e}")
+        return jsonify({"error": "Erro interno ao deletar loja."}), 500
+
+    finally:
+        release_db_connection(conn)
+
+    if erro:
+        return jsonify(erro[0]), erro[1]
+
+    # Conexão já devolvida: a foto é apagada sem segurar o banco
+    armazenamento.descartar(resultado[0])
+
+    return jsonify({"message": f"Loja {loja_id} deletada com sucesso."}), 200
+
 
 # NOVO: Rota Pública: Servir Foto de Perfil da Loja
 @loja_bp.route("/loja/foto/<int:loja_id>", methods=["GET"])
@@ -219,28 +260,15 @@ def obter_foto_loja(loja_id):
     Requer: O ID da loja na URL.
     Retorna: O arquivo de imagem binário (Content-Type apropriado) ou erro (404, 500).
     """
-    conn = get_db_connection()
-    if conn is None:
-        return jsonify({"error": "Falha na conexão com o banco de dados"}), 500
-
     try:
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT foto_perfil FROM lojas WHERE loja_id = %s;",
-            (loja_id,)
-        )
-        resultado = cur.fetchone()
-        cur.close()
+        # O nome vem do cache do processo; o banco só é consultado na falta
+        foto_nome = FOTOS_LOJA.obter(loja_id, lambda: invalidacao.ler_no_banco(
+            lambda cur: repositorio.buscar_foto_loja(cur, loja_id)))
 
-        if not resultado or not resultado[0]:
+        if not foto_nome:
             # Retorna 404 se não houver registro ou a coluna foto_perfil for NULL
             return jsonify({"error": "Foto da loja não encontrada"}), 404
 
-        foto_nome = resultado[0]
-
-        # Baixar foto do storage
-        foto_bytes = client.download_as_bytes(foto_nome)
-
         # Determinar o tipo MIME baseado na extensão
         extensao = os.path.splitext(foto_nome)[1].lower()
         mime_types = {
@@ -252,110 +280,176 @@ def obter_foto_loja(loja_id):
         }
         mime_type = mime_types.get(extensao, "image/jpeg")
 
-        return send_file(
-            BytesIO(foto_bytes),
-            mimetype=mime_type,
-            as_attachment=False
-        )
+        # Servir a foto a partir do storage (sendfile no backend local)
+        return armazenamento.servir(foto_nome, mimetype=mime_type)
 
     except Exception as e:
         print(f"Erro ao obter foto da loja: {e}")
         return jsonify({"error": "Erro ao carregar foto"}), 500
 
-    finally:
-        if conn:
-            conn.close()
+
+def _ler_limite(valor):
+    maximo = int(os.getenv('LOJAS_LIMITE_MAX', '500'))
+    limite = int(valor) if valor is not None else maximo
+    if not 1 <= limite <= maximo:
+        raise ValueError(f"'limite' deve estar entre 1 e {maximo}.")
+    return limite
+
+
+def _codificar_cursor(nome_loja, loja_id):
+    """Cursor opaco de paginação: a última (nome_loja, loja_id) da página."""
+    texto = json.dumps([nome_loja, loja_id], ensure_ascii=False)
+    return base64.urlsafe_b64encode(texto.encode('utf-8')).decode('ascii')
+
+
+def _decodificar_cursor(cursor):
+    try:
+        nome_loja, loja_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return str(nome_loja), int(loja_id)
+    except Exception as e:
+        raise ValueError("'apos' não é um cursor válido.") from e
+
+
+def _resposta_listagem(lojas, ultima, paginado, limite):
+    """JSON da listagem; 'ultima' é o (nome_loja, loja_id) da última linha lida."""
+    if not paginado:
+        return jsonify({"lojas": lojas}), 200
+
+    proxima_pagina = None
+    if len(lojas) == limite:
+        proxima_pagina = _codificar_cursor(*ultima)
+    return jsonify({"lojas": lojas, "proxima_pagina": proxima_pagina}), 200
+
+
+def _somente_campos(linhas, campos):
+    """Remove das linhas as colunas lidas só para uso interno (ex.: cursor)."""
+    if not linhas or len(campos) == len(linhas[0]):
+        return linhas
+    return [{campo: linha[campo] for campo in campos} for linha in linhas]
 
 
 # 8. Rota Pública: Listar Todas as Lojas (ATUALIZADA para retornar todos os campos)
 @loja_bp.route('/lojas', methods=['GET'])
 def listar_todas_lojas():
-    """Retorna uma lista de todas as lojas disponíveis no banco de dados, com todos os campos (incluindo foto_perfil)."""
-    conn = get_db_connection()
+    """
+    GET /lojas
+    Retorna as lojas disponíveis no banco de dados, com todos os campos (incluindo foto_perfil).
+    Filtros opcionais (aplicados no SQL): 'cidade', 'estado' e 'cep' (prefixo do CEP).
+    Paginação opcional: 'limite' (até LOJAS_LIMITE_MAX, padrão 500) e 'apos' (valor de
+    'proxima_pagina' da resposta anterior).
+    Campos opcionais: 'fields' (ex.: "loja_id,nome_loja,foto_perfil") reduz as colunas
+    lidas do banco e as chaves de cada loja na resposta.
+    Sem filtros, é servida pelo snapshot compartilhado do catálogo (catalogo.py) enquanto
+    ele estiver em dia; com filtros, ou com o snapshot desatualizado, pelo banco.
+    Retorna: JSON com 'lojas' e, quando paginado, 'proxima_pagina' (null na última página).
+    """
+    filtros = {
+        'cidade': request.args.get('cidade', '').strip() or None,
+        'estado': request.args.get('estado', '').strip() or None,
+        'cep_prefixo': request.args.get('cep', '').strip() or None,
+    }
+    limite = request.args.get('limite')
+    apos = request.args.get('apos')
+    paginado = limite is not None or apos is not None
+
+    if paginado:
+        try:
+            filtros['limite'] = _ler_limite(limite)
+            filtros['apos'] = _decodificar_cursor(apos) if apos else None
+        except ValueError as e:
+            return jsonify({"error": f"Paginação inválida. {e}"}), 400
+
+    campos = request.args.get('fields')
+    try:
+        # A paginação precisa de (nome_loja, loja_id) mesmo que não tenham sido pedidos
+        visiveis = repositorio.escolher_colunas(campos, repositorio.COLUNAS_LISTAGEM_LOJAS)
+        colunas = repositorio.escolher_colunas(
+            campos, repositorio.COLUNAS_LISTAGEM_LOJAS,
+            obrigatorias=('loja_id', 'nome_loja') if paginado else ())
+    except ValueError as e:
+        return jsonify({"error": f"Parâmetro 'fields' inválido. {e}"}), 400
+
+    # Snapshot compartilhado (catalogo.py): sem banco, e só a página vira dict.
+    # Com filtros por cidade/estado/CEP a consulta indexada no banco é melhor.
+    com_filtros = any(filtros.get(chave) for chave in ('cidade', 'estado', 'cep_prefixo'))
+    snapshot = None if com_filtros else catalogo.catalogo.atual()
+    if snapshot is not None:
+        try:
+            resultado = snapshot.listar(colunas=visiveis, apos=filtros.get('apos'),
+                                        limite=filtros.get('limite'))
+        except Exception as e:
+            print(f"Aviso: falha ao listar lojas pelo catálogo: {e}")
+            resultado = None
+        if resultado is not None:
+            lojas, ultima = resultado
+            return _resposta_listagem(lojas, ultima, paginado, filtros.get('limite'))
+
+    if not (any(filtros.values()) or campos):
+        # Listagem completa (sem filtros nem paginação): igual para todos, vem do cache
+        try:
+            lojas = LISTAGEM_LOJAS.obter('todas', lambda: invalidacao.ler_no_banco(
+                lambda cur: [repositorio.linha_como_dict(colunas, row)
+                             for row in repositorio.listar_lojas(cur)]))
+            return jsonify({"lojas": lojas}), 200
+        except Exception as e:
+            print(f"Erro ao listar todas as lojas: {e}")
+            return jsonify({"error": "Erro interno ao buscar lojas."}), 500
+
+    conn = get_db_connection(somente_leitura=True)
     if conn is None:
         return jsonify({"error": "Falha na conexão com o banco de dados"}), 500
 
     try:
         cur = conn.cursor()
-        # MUDANÇA: Seleciona TODOS os campos (incluindo foto_perfil)
-        query = """
-            SELECT loja_id, nome_loja, descricao, endereco_rua, endereco_cidade,
-                   endereco_estado, endereco_cep, latitude, longitude, data_criacao, foto_perfil
-            FROM lojas
-            ORDER BY nome_loja;
-        """
-        cur.execute(query)
-        lojas_data = cur.fetchall()
+        lojas_data = repositorio.listar_lojas_filtradas(cur, colunas=colunas, **filtros)
         cur.close()
 
-        # MUDANÇA: Mapeamento de todos os campos
-        lojas = [{
-            "loja_id": row[0],
-            "nome_loja": row[1],
-            "descricao": row[2],
-            "endereco_rua": row[3],
-            "endereco_cidade": row[4],
-            "endereco_estado": row[5],
-            "endereco_cep": row[6],
-            "latitude": row[7],
-            "longitude": row[8],
-            "data_criacao": row[9].isoformat() if row[9] else None,
-            "foto_perfil": row[10] # Novo campo
-        } for row in lojas_data]
-
-        return jsonify({"lojas": lojas}), 200
+        linhas = [repositorio.linha_como_dict(colunas, row) for row in lojas_data]
+        ultima = None
+        if paginado and linhas:
+            ultima = (linhas[-1]['nome_loja'], linhas[-1]['loja_id'])
+        return _resposta_listagem(_somente_campos(linhas, visiveis), ultima,
+                                  paginado, filtros.get('limite'))
 
     except Exception as e:
         print(f"Erro ao listar todas as lojas: {e}")
         return jsonify({"error": "Erro interno ao buscar lojas."}), 500
 
     finally:
-        if conn:
-            conn.close()
+        release_db_connection(conn)
 
 
 # 9. Rota Protegida: Listar Lojas do Gestor Logado (ATUALIZADA para todos os campos)
 @loja_bp.route('/gestor/minhas-lojas', methods=['GET'])
 @token_obrigatorio(role_necessaria='gestor') # 🛡️ Acesso somente para gestores
 def listar_lojas_do_gestor(dados_usuario):
-    """Retorna uma lista de lojas cadastradas pelo gestor autenticado, com todos os detalhes (incluindo foto_perfil)."""
+    """
+    Retorna uma lista de lojas cadastradas pelo gestor autenticado, com todos os detalhes (incluindo foto_perfil).
+    'fields' (opcional) restringe as colunas lidas e retornadas, como em GET /lojas.
+    """
     gestor_id_logado = dados_usuario.get('gestor_id')
 
-    conn = get_db_connection()
+    campos = request.args.get('fields')
+    try:
+        colunas = repositorio.escolher_colunas(campos, repositorio.COLUNAS_LOJAS_DO_GESTOR)
+    except ValueError as e:
+        return jsonify({"error": f"Parâmetro 'fields' inválido. {e}"}), 400
+
+    conn = get_db_connection(somente_leitura=True)
     if conn is None:
         return jsonify({"error": "Falha na conexão com o banco de dados"}), 500
 
     try:
         cur = conn.cursor()
 
-        # MUDANÇA: Seleciona TODOS os campos da tabela 'lojas'
-        query = """
-            SELECT loja_id, gestor_id, nome_loja, descricao, endereco_rua,
-                   endereco_cidade, endereco_estado, endereco_cep, latitude,
-                   longitude, data_criacao, foto_perfil
-            FROM lojas
-            WHERE gestor_id = %s
-            ORDER BY nome_loja;
-        """
-        cur.execute(query, (gestor_id_logado, ))
-        lojas_data = cur.fetchall()
+        if campos:
+            lojas_data = repositorio.listar_campos_lojas_do_gestor(cur, gestor_id_logado, colunas)
+        else:
+            # MUDANÇA: Seleciona TODOS os campos da tabela 'lojas'
+            lojas_data = repositorio.listar_lojas_do_gestor(cur, gestor_id_logado)
         cur.close()
 
-        # MUDANÇA: Ajustar o mapeamento para incluir TODOS os campos
-        lojas = [{
-            "loja_id": row[0],
-            "gestor_id": row[1],
-            "nome_loja": row[2],
-            "descricao": row[3],      # NOVO CAMPO
-            "endereco_rua": row[4],
-            "endereco_cidade": row[5],
-            "endereco_estado": row[6],
-            "endereco_cep": row[7],
-            "latitude": row[8],        # NOVO CAMPO
-            "longitude": row[9],       # NOVO CAMPO
-            "data_criacao": row[10].isoformat() if row[10] else None,
-            "foto_perfil": row[11] # Novo campo
-        } for row in lojas_data]
+        lojas = [repositorio.linha_como_dict(colunas, row) for row in lojas_data]
 
         return jsonify({"minhas_lojas": lojas}), 200
 
@@ -364,5 +458,48 @@ def listar_lojas_do_gestor(dados_usuario):
         return jsonify({"error": "Erro interno ao buscar suas lojas."}), 500
 
     finally:
-        if conn:
-            conn.close()
+        release_db_connection(conn)
+
+
+# 10. Rota Protegida: Exportar as Lojas do Gestor Logado em CSV
+@loja_bp.route('/gestor/minhas-lojas/export', methods=['GET'])
+@token_obrigatorio(role_necessaria='gestor')
+def exportar_lojas_do_gestor(dados_usuario):
+    """
+    GET /gestor/minhas-lojas/export?format=csv
+    Rota protegida. As mesmas lojas e colunas de GET /gestor/minhas-lojas (inclusive
+    'fields'), em CSV com cabeçalho, enviadas do banco ao cliente em streaming.
+    Retorna: text/csv (anexo) ou erro (400, 500).
+    """
+    gestor_id_logado = dados_usuario.get('gestor_id')
+
+    formato = request.args.get('format', 'csv')
+    if formato != 'csv':
+        return jsonify({"error": "Formato de exportação não suportado. Use 'csv'."}), 400
+
+    campos = request.args.get('fields')
+    try:
+        colunas = repositorio.escolher_colunas(campos, repositorio.COLUNAS_LOJAS_DO_GESTOR)
+    except ValueError as e:
+        return jsonify({"error": f"Parâmetro 'fields' inválido. {e}"}), 400
+
+    conn = get_db_connection(somente_leitura=True)
+    if conn is None:
+        return jsonify({"error": "Falha na conexão com o banco de dados"}), 500
+
+    try:
+        with conn.cursor() as cur:
+            consulta = repositorio.montar_exportacao_lojas_do_gestor(
+                cur, gestor_id_logado, colunas)
+    except Exception as e:
+        release_db_connection(conn)
+        print(f"Erro ao preparar exportação das lojas do gestor: {e}")
+        return jsonify({"error": "Erro interno ao exportar suas lojas."}), 500
+
+    # A conexão fica com a transmissão, que a devolve ao pool no fim do download
+    transmissao = exportacao.TransmissaoCsv(conn, consulta)
+    resposta = Response(transmissao, mimetype='text/csv')
+    resposta.call_on_close(transmissao.close)
+    resposta.headers['Content-Disposition'] = (
+        f'attachment; filename="lojas_gestor_{gestor_id_logado}.csv"')
+    return resposta
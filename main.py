@@ -1,8 +1,15 @@
+# O cronômetro de cold start precisa ser o primeiro import do processo.
+import inicializacao  # isort: skip
+
 import os
 
 from flask import Flask, jsonify
 from flask_cors import CORS
 
+import admissao
+import compressao
+import perfilador
+import tempos
 from auth import auth_bp
 
 # Importamos a classe Bcrypt para tipagem, mas a instância vem de gestor.py
@@ -13,7 +20,11 @@ from gestor import (  # Importa o Blueprint do Gestor e a instância do Bcrypt
     bcrypt,
     gestor_bp,
 )
+from importacao import importacao_bp
 from loja import loja_bp
+from memoria import memoria_bp
+from saude import saude_bp
+from tarefas import tarefas_bp
 
 app = Flask(__name__)
 CORS(app, origins='*', supports_credentials=True) 
@@ -24,13 +35,33 @@ bcrypt.init_app(app)
 # A SESSION_SECRET DEVE SER LIDA DO AMBIENTE E SER LONGA E COMPLEXA!
 app.config['SESSION_SECRET'] = os.getenv('SESSION_SECRET')
 
+# CONTROLE DE ADMISSÃO: responde 503 rápido quando o worker está saturado.
+# Registrado antes dos Blueprints para rodar antes de qualquer rota.
+admissao.registrar(app)
+
+# PERFIL SOB DEMANDA: cProfile de uma requisição (X-Perfil assinado ou amostragem)
+perfilador.registrar(app)
+
+# SERVER-TIMING: tempos por fase (banco, sql, bcrypt, jwt, storage) no cabeçalho
+tempos.registrar(app)
+
+# COMPRESSÃO: gzip/brotli negociado pelo Accept-Encoding (depois de tempos
+# para que o tempo de compressão apareça no Server-Timing)
+compressao.registrar(app)
+
+# RELATÓRIO DE INICIALIZAÇÃO: encerra a medição dos imports e expõe /startup-report
+inicializacao.registrar(app)
 
 # REGISTRANDO BLUEPRINTS
 app.register_blueprint(banco_bp)
+app.register_blueprint(saude_bp) # Probes /healthz e /readyz
 app.register_blueprint(gestor_bp) # Rotas de /gestores, /login/gestor e /lojas
 app.register_blueprint(loja_bp)
 app.register_blueprint(cliente_bp)
 app.register_blueprint(auth_bp)
+app.register_blueprint(tarefas_bp) # Situação das tarefas em segundo plano
+app.register_blueprint(importacao_bp) # Importação de lojas em massa (CSV)
+app.register_blueprint(memoria_bp) # Diagnóstico de memória (tracemalloc), só com ADMIN_TOKEN
 # --- ROTAS GERAIS E DE CLIENTE ---
 
 
@@ -0,0 +1,309 @@
+"""
+Diagnóstico de memória com tracemalloc, para rotas administrativas.
+
+Rotas (cabeçalho X-Admin-Token, ver auth.admin_obrigatorio):
+    POST   /admin/memoria/iniciar     liga o tracemalloc ({"quadros": 1..50, padrão 10})
+    POST   /admin/memoria/parar       desliga e descarta snapshots e picos
+    GET    /admin/memoria             situação, RSS do processo e maiores
+                                      locais de alocação (?agrupar=lineno|filename|traceback,
+                                      ?limite=20)
+    POST   /admin/memoria/snapshots   guarda um snapshot e retorna o id
+    GET    /admin/memoria/diff        diferença entre snapshots (?de=<id>, ?para=<id>;
+                                      sem 'para', compara com agora)
+    GET    /admin/memoria/endpoints   pico de alocação por endpoint
+
+O pico por endpoint usa o pico global do tracemalloc, zerado no início de
+uma requisição só quando nenhuma outra está em andamento no processo; as
+que se sobrepõem a outras entram na contagem, mas não no pico. Para medir
+uma rota específica, prefira pouca concorrência.
+
+Tudo vale por processo: com vários workers, cada um tem seu tracemalloc, e
+as respostas trazem o 'pid' de quem respondeu. Com o tracemalloc ligado as
+alocações ficam mais lentas e ocupam mais memória; desligue ao terminar.
+MEMORIA_SNAPSHOTS_MAX (padrão 3) limita os snapshots guardados.
+"""
+import itertools
+import os
+import threading
+import tracemalloc
+from collections import OrderedDict
+
+from flask import Blueprint, g, jsonify, request
+
+from auth import admin_obrigatorio
+
+memoria_bp = Blueprint('memoria', __name__)
+
+SNAPSHOTS_MAX = int(os.getenv('MEMORIA_SNAPSHOTS_MAX', '3'))
+AGRUPAMENTOS = ('lineno', 'filename', 'traceback')
+
+# Alocações do próprio diagnóstico e do import de módulos não interessam
+_FILTROS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+_lock = threading.Lock()
+_snapshots = OrderedDict()  # id -> snapshot
+_ids = itertools.count(1)
+_em_andamento = 0
+_inicios = 0  # requisições iniciadas desde que o tracemalloc foi ligado
+_por_endpoint = {}
+
+
+def _rss_bytes():
+    try:
+        with open('/proc/self/status') as arquivo:
+            for linha in arquivo:
+                if linha.startswith('VmRSS:'):
+                    return int(linha.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _situacao():
+    situacao = {
+        "pid": os.getpid(),
+        "rastreando": tracemalloc.is_tracing(),
+        "rss_bytes": _rss_bytes(),
+    }
+    if tracemalloc.is_tracing():
+        atual, pico = tracemalloc.get_traced_memory()
+        situacao.update({
+            "quadros": tracemalloc.get_traceback_limit(),
+            "rastreado_bytes": atual,
+            "pico_bytes": pico,
+            "custo_tracemalloc_bytes": tracemalloc.get_tracemalloc_memory(),
+            "snapshots": list(_snapshots),
+        })
+    return situacao
+
+
+def _local(traceback, agrupar):
+    if agrupar == 'traceback':
+        return {"pilha": [f"{quadro.filename}:{quadro.lineno}" for quadro in traceback]}
+    quadro = traceback[0]
+    local = {"arquivo": quadro.filename}
+    if agrupar == 'lineno':
+        local["linha"] = quadro.lineno
+    return local
+
+
+def _estatisticas(snapshot, agrupar, limite):
+    return [
+        dict(_local(estatistica.traceback, agrupar),
+             tamanho_bytes=estatistica.size, quantidade=estatistica.count)
+        for estatistica in snapshot.statistics(agrupar)[:limite]
+    ]
+
+
+def _diferencas(novo, antigo, agrupar, limite):
+    return [
+        dict(_local(diferenca.traceback, agrupar),
+             tamanho_bytes=diferenca.size, diferenca_bytes=diferenca.size_diff,
+             quantidade=diferenca.count, diferenca_quantidade=diferenca.count_diff)
+        for diferenca in novo.compare_to(antigo, agrupar)[:limite]
+    ]
+
+
+def _ler_parametros():
+    agrupar = request.args.get('agrupar', 'lineno')
+    if agrupar not in AGRUPAMENTOS:
+        raise ValueError(f"'agrupar' deve ser um de: {', '.join(AGRUPAMENTOS)}.")
+    limite = int(request.args.get('limite', '20'))
+    if not 1 <= limite <= 500:
+        raise ValueError("'limite' deve estar entre 1 e 500.")
+    return agrupar, limite
+
+
+def _tirar_snapshot():
+    return tracemalloc.take_snapshot().filter_traces(_FILTROS)
+
+
+# --- Pico de alocação por endpoint ---
+
+@memoria_bp.before_app_request
+def _antes_da_requisicao():
+    global _em_andamento, _inicios
+    if not tracemalloc.is_tracing():
+        return
+    with _lock:
+        isolada = _em_andamento == 0
+        _em_andamento += 1
+        _inicios += 1
+        if isolada:
+            tracemalloc.reset_peak()
+        g.memoria_inicio = (tracemalloc.get_traced_memory()[0], _inicios, isolada)
+
+
+@memoria_bp.teardown_app_request
+def _ao_desmontar(_erro):
+    global _em_andamento
+    inicio = g.pop('memoria_inicio', None)
+    if inicio is None:
+        return
+    atual_inicio, numero, isolada = inicio
+    with _lock:
+        _em_andamento -= 1
+        if not tracemalloc.is_tracing():
+            return
+        _atual, pico = tracemalloc.get_traced_memory()
+        # Ninguém começou depois desta: o pico desde o reset é só dela
+        exata = isolada and _inicios == numero
+
+        dados = _por_endpoint.setdefault(request.endpoint or 'sem_endpoint', {
+            "requisicoes": 0, "medidas": 0, "pico_max_bytes": 0, "pico_total_bytes": 0,
+        })
+        dados["requisicoes"] += 1
+        if exata:
+            pico_requisicao = max(0, pico - atual_inicio)
+            dados["medidas"] += 1
+            dados["pico_max_bytes"] = max(dados["pico_max_bytes"], pico_requisicao)
+            dados["pico_total_bytes"] += pico_requisicao
+
+
+# --- Rotas ---
+
+@memoria_bp.route('/admin/memoria/iniciar', methods=['POST'])
+@admin_obrigatorio
+def iniciar():
+    """
+    POST /admin/memoria/iniciar
+    Liga o tracemalloc neste processo, guardando até 'quadros' (padrão 10) de pilha.
+    Retorna: a situação (200) ou 409 se já estiver ligado.
+    """
+    global _inicios
+    data = request.get_json(silent=True) or {}
+    try:
+        quadros = int(data.get('quadros', 10))
+    except (TypeError, ValueError):
+        quadros = 0
+    if not 1 <= quadros <= 50:
+        return jsonify({"error": "'quadros' deve estar entre 1 e 50."}), 400
+
+    with _lock:
+        if tracemalloc.is_tracing():
+            return jsonify({"error": "O tracemalloc já está ligado.", **_situacao()}), 409
+        _snapshots.clear()
+        _por_endpoint.clear()
+        _inicios = 0
+        tracemalloc.start(quadros)
+    return jsonify(_situacao()), 200
+
+
+@memoria_bp.route('/admin/memoria/parar', methods=['POST'])
+@admin_obrigatorio
+def parar():
+    """POST /admin/memoria/parar — desliga o tracemalloc e libera snapshots e medidas."""
+    with _lock:
+        tracemalloc.stop()
+        _snapshots.clear()
+        _por_endpoint.clear()
+    return jsonify(_situacao()), 200
+
+
+@memoria_bp.route('/admin/memoria', methods=['GET'])
+@admin_obrigatorio
+def situacao():
+    """
+    GET /admin/memoria
+    Situação do tracemalloc e, se ligado, os maiores locais de alocação agora.
+    """
+    try:
+        agrupar, limite = _ler_parametros()
+    except ValueError as e:
+        return jsonify({"error": f"Parâmetro inválido. {e}"}), 400
+
+    resposta = _situacao()
+    if tracemalloc.is_tracing():
+        resposta["maiores"] = _estatisticas(_tirar_snapshot(), agrupar, limite)
+    return jsonify(resposta), 200
+
+
+@memoria_bp.route('/admin/memoria/snapshots', methods=['POST'])
+@admin_obrigatorio
+def criar_snapshot():
+    """
+    POST /admin/memoria/snapshots
+    Guarda um snapshot (os mais antigos saem depois de MEMORIA_SNAPSHOTS_MAX).
+    Retorna: 201 com o 'id' e os maiores locais de alocação, ou 409 se o tracemalloc estiver desligado.
+    """
+    try:
+        agrupar, limite = _ler_parametros()
+    except ValueError as e:
+        return jsonify({"error": f"Parâmetro inválido. {e}"}), 400
+    if not tracemalloc.is_tracing():
+        return jsonify({"error": "Ligue o tracemalloc antes (POST /admin/memoria/iniciar)."}), 409
+
+    snapshot = _tirar_snapshot()
+    with _lock:
+        snapshot_id = next(_ids)
+        _snapshots[snapshot_id] = snapshot
+        while len(_snapshots) > SNAPSHOTS_MAX:
+            _snapshots.popitem(last=False)
+
+    return jsonify({
+        "id": snapshot_id,
+        "pid": os.getpid(),
+        "maiores": _estatisticas(snapshot, agrupar, limite),
+    }), 201
+
+
+@memoria_bp.route('/admin/memoria/diff', methods=['GET'])
+@admin_obrigatorio
+def diferenca():
+    """
+    GET /admin/memoria/diff?de=<id>&para=<id>
+    Locais de alocação que mais cresceram entre os snapshots 'de' e 'para' (ou agora).
+    """
+    try:
+        agrupar, limite = _ler_parametros()
+        de = int(request.args['de'])
+        para = int(request.args['para']) if request.args.get('para') else None
+    except (KeyError, ValueError) as e:
+        return jsonify({"error": f"Parâmetro inválido. {e}"}), 400
+
+    with _lock:
+        antigo = _snapshots.get(de)
+        novo = _snapshots.get(para) if para is not None else None
+    if antigo is None or (para is not None and novo is None):
+        return jsonify({"error": "Snapshot não encontrado neste processo.",
+                        "pid": os.getpid(), "snapshots": list(_snapshots)}), 404
+    if novo is None:
+        if not tracemalloc.is_tracing():
+            return jsonify({"error": "O tracemalloc está desligado."}), 409
+        novo = _tirar_snapshot()
+
+    return jsonify({
+        "pid": os.getpid(),
+        "de": de,
+        "para": para,
+        "diferencas": _diferencas(novo, antigo, agrupar, limite),
+    }), 200
+
+
+@memoria_bp.route('/admin/memoria/endpoints', methods=['GET'])
+@admin_obrigatorio
+def picos_por_endpoint():
+    """
+    GET /admin/memoria/endpoints
+    Pico de memória alocada por requisição, por endpoint, desde que o tracemalloc foi ligado.
+    """
+    with _lock:
+        endpoints = {
+            endpoint: {
+                "requisicoes": dados["requisicoes"],
+                "medidas": dados["medidas"],
+                "pico_max_bytes": dados["pico_max_bytes"],
+                "pico_medio_bytes": (dados["pico_total_bytes"] // dados["medidas"]
+                                     if dados["medidas"] else None),
+            }
+            for endpoint, dados in _por_endpoint.items()
+        }
+    ordenados = dict(sorted(endpoints.items(),
+                            key=lambda item: item[1]["pico_max_bytes"], reverse=True))
+    return jsonify({"pid": os.getpid(), "rastreando": tracemalloc.is_tracing(),
+                    "endpoints": ordenados}), 200
@@ -0,0 +1,39 @@
+-- Esquema base de gestores, clientes e lojas.
+-- Usa IF NOT EXISTS para adotar bancos que foram criados manualmente.
+
+CREATE TABLE IF NOT EXISTS gestores (
+    gestor_id   SERIAL PRIMARY KEY,
+    nome        VARCHAR(255) NOT NULL,
+    email       VARCHAR(255) NOT NULL,
+    senha_hash  VARCHAR(255) NOT NULL,
+    foto_perfil VARCHAR(255)
+);
+
+CREATE TABLE IF NOT EXISTS clientes (
+    cliente_id    SERIAL PRIMARY KEY,
+    nome          VARCHAR(255) NOT NULL,
+    email         VARCHAR(255) NOT NULL,
+    senha_hash    VARCHAR(255) NOT NULL,
+    data_cadastro TIMESTAMPTZ NOT NULL DEFAULT now(),
+    foto_perfil   VARCHAR(255)
+);
+
+CREATE TABLE IF NOT EXISTS lojas (
+    loja_id         SERIAL PRIMARY KEY,
+    gestor_id       INTEGER NOT NULL REFERENCES gestores (gestor_id),
+    nome_loja       VARCHAR(255) NOT NULL,
+    descricao       TEXT,
+    endereco_rua    VARCHAR(255) NOT NULL,
+    endereco_cidade VARCHAR(120) NOT NULL,
+    endereco_estado VARCHAR(60) NOT NULL,
+    endereco_cep    VARCHAR(20) NOT NULL,
+    latitude        DOUBLE PRECISION,
+    longitude       DOUBLE PRECISION,
+    data_criacao    TIMESTAMPTZ NOT NULL DEFAULT now(),
+    foto_perfil     VARCHAR(255)
+);
+
+-- Bancos antigos foram criados antes das fotos de perfil.
+ALTER TABLE gestores ADD COLUMN IF NOT EXISTS foto_perfil VARCHAR(255);
+ALTER TABLE clientes ADD COLUMN IF NOT EXISTS foto_perfil VARCHAR(255);
+ALTER TABLE lojas ADD COLUMN IF NOT EXISTS foto_perfil VARCHAR(255);
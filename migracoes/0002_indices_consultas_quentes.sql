@@ -0,0 +1,13 @@
+-- Índices e restrições de unicidade das consultas quentes de repositorio.py.
+
+-- Login por email (gestor_por_email / cliente_por_email) e o 409 de
+-- "Email já cadastrado" dependem destes índices únicos.
+CREATE UNIQUE INDEX IF NOT EXISTS gestores_email_key ON gestores (email);
+CREATE UNIQUE INDEX IF NOT EXISTS clientes_email_key ON clientes (email);
+
+-- GET /lojas: ORDER BY nome_loja.
+CREATE INDEX IF NOT EXISTS lojas_nome_loja_idx ON lojas (nome_loja);
+
+-- GET /gestor/minhas-lojas: WHERE gestor_id = $1 ORDER BY nome_loja.
+-- Também atende a FK lojas.gestor_id na deleção de gestores.
+CREATE INDEX IF NOT EXISTS lojas_gestor_id_nome_loja_idx ON lojas (gestor_id, nome_loja);
@@ -0,0 +1,11 @@
+-- Baldes do limite de taxa compartilhado (limite.BackendPostgres).
+-- UNLOGGED: estado descartável, sem custo de WAL; some após um crash.
+
+CREATE UNLOGGED TABLE IF NOT EXISTS limites_taxa (
+    chave         TEXT PRIMARY KEY,
+    tokens        DOUBLE PRECISION NOT NULL,
+    permitido     BOOLEAN NOT NULL,
+    atualizado_em TIMESTAMPTZ NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS limites_taxa_atualizado_em_idx ON limites_taxa (atualizado_em);
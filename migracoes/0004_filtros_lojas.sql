@@ -0,0 +1,17 @@
+-- Filtros de GET /lojas (cidade, estado, prefixo de CEP) com paginação por
+-- (nome_loja, loja_id).
+
+-- Listagem sem filtro: ORDER BY nome_loja, loja_id (substitui o índice só por nome)
+CREATE INDEX IF NOT EXISTS lojas_nome_loja_loja_id_idx ON lojas (nome_loja, loja_id);
+DROP INDEX IF EXISTS lojas_nome_loja_idx;
+
+-- estado + cidade, já na ordem da listagem (só estado: 0008_lojas_por_estado.sql)
+CREATE INDEX IF NOT EXISTS lojas_estado_cidade_nome_idx
+    ON lojas (lower(endereco_estado), lower(endereco_cidade), nome_loja, loja_id);
+
+-- só cidade
+CREATE INDEX IF NOT EXISTS lojas_cidade_nome_idx
+    ON lojas (lower(endereco_cidade), nome_loja, loja_id);
+
+-- endereco_cep LIKE 'prefixo%' (independe da collation do banco)
+CREATE INDEX IF NOT EXISTS lojas_cep_prefixo_idx ON lojas (endereco_cep text_pattern_ops);
@@ -0,0 +1,8 @@
+-- Coleta de fotos órfãs (gc_fotos.py): leitura de todas as referências em
+-- ordem de bytes, igual à do Object Storage, e reconferência por lote.
+CREATE INDEX IF NOT EXISTS gestores_foto_perfil_idx
+    ON gestores ((foto_perfil COLLATE "C")) WHERE foto_perfil IS NOT NULL;
+CREATE INDEX IF NOT EXISTS clientes_foto_perfil_idx
+    ON clientes ((foto_perfil COLLATE "C")) WHERE foto_perfil IS NOT NULL;
+CREATE INDEX IF NOT EXISTS lojas_foto_perfil_idx
+    ON lojas ((foto_perfil COLLATE "C")) WHERE foto_perfil IS NOT NULL;
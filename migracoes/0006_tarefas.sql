@@ -0,0 +1,24 @@
+-- Tarefas em segundo plano (tarefas.py), como a exclusão de conta de gestor
+-- com todas as lojas e fotos.
+
+CREATE TABLE IF NOT EXISTS tarefas (
+    tarefa_id     SERIAL PRIMARY KEY,
+    tipo          VARCHAR(60) NOT NULL,
+    -- Sem FK: a tarefa sobrevive à exclusão do gestor
+    gestor_id     INTEGER NOT NULL,
+    situacao      VARCHAR(20) NOT NULL DEFAULT 'pendente',
+    progresso     JSONB NOT NULL DEFAULT '{}',
+    erro          TEXT,
+    tentativas    INTEGER NOT NULL DEFAULT 0,
+    criada_em     TIMESTAMPTZ NOT NULL DEFAULT now(),
+    atualizada_em TIMESTAMPTZ NOT NULL DEFAULT now(),
+    concluida_em  TIMESTAMPTZ
+);
+
+-- No máximo uma tarefa ativa por tipo e gestor (ON CONFLICT em tarefa_criar)
+CREATE UNIQUE INDEX IF NOT EXISTS tarefas_ativa_unica_idx
+    ON tarefas (tipo, gestor_id) WHERE situacao IN ('pendente', 'executando');
+
+-- Fila: próximas tarefas a reservar
+CREATE INDEX IF NOT EXISTS tarefas_fila_idx
+    ON tarefas (tarefa_id) WHERE situacao IN ('pendente', 'executando');
@@ -0,0 +1,15 @@
+-- Revogação de tokens JWT (revogacao.py). 'chave' é 'jti:<jti>' para um
+-- token ou '<papel>:<id>' para todos os tokens do usuário emitidos até
+-- revogado_em. Linhas com expira_em no passado não revogam mais nada.
+
+CREATE TABLE IF NOT EXISTS revogacoes (
+    chave       VARCHAR(100) PRIMARY KEY,
+    revogado_em TIMESTAMPTZ NOT NULL DEFAULT now(),
+    expira_em   TIMESTAMPTZ NOT NULL
+);
+
+-- Sync incremental dos filtros de Bloom
+CREATE INDEX IF NOT EXISTS revogacoes_revogado_em_idx ON revogacoes (revogado_em);
+
+-- Limpeza das expiradas
+CREATE INDEX IF NOT EXISTS revogacoes_expira_em_idx ON revogacoes (expira_em);
@@ -0,0 +1,5 @@
+-- GET /lojas?estado=: o índice (estado, cidade, nome_loja, loja_id) só
+-- entrega a ordem da listagem quando a cidade também é filtrada. Só com o
+-- estado, todas as lojas dele eram lidas e ordenadas antes do LIMIT.
+CREATE INDEX IF NOT EXISTS lojas_estado_nome_idx
+    ON lojas (lower(endereco_estado), nome_loja, loja_id);
@@ -0,0 +1,201 @@
+"""
+Migrações versionadas do esquema (gestores, clientes e lojas).
+
+Uso:
+    python migrar.py upgrade   # aplica as migrações pendentes de migracoes/
+    python migrar.py status    # lista migrações aplicadas e pendentes
+    python migrar.py check     # EXPLAIN de cada consulta quente; falha se houver Seq Scan
+                               # ou listagem que não sai do índice já ordenada
+
+Cada arquivo migracoes/NNNN_descricao.sql é aplicado uma única vez, em sua
+própria transação, e registrado na tabela schema_migracoes.
+"""
+import os
+import re
+import sys
+
+import psycopg2
+
+import repositorio
+from banco import parametros_conexao
+
+PASTA_MIGRACOES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               'migracoes')
+
+# Chave do advisory lock que impede dois processos de migrar ao mesmo tempo
+CHAVE_LOCK = 727001
+
+
+def conectar():
+    return psycopg2.connect(**parametros_conexao())
+
+
+def listar_migracoes():
+    """Retorna [(versao, nome_arquivo)] em ordem de versão."""
+    migracoes = []
+    for nome_arquivo in sorted(os.listdir(PASTA_MIGRACOES)):
+        encontrado = re.match(r'^(\d+)_.+\.sql$', nome_arquivo)
+        if encontrado:
+            migracoes.append((int(encontrado.group(1)), nome_arquivo))
+    return migracoes
+
+
+def _garantir_tabela_controle(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migracoes (
+            versao      INTEGER PRIMARY KEY,
+            nome        TEXT NOT NULL,
+            aplicada_em TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    """)
+
+
+def versoes_aplicadas(cur):
+    _garantir_tabela_controle(cur)
+    cur.execute("SELECT versao FROM schema_migracoes;")
+    return {linha[0] for linha in cur.fetchall()}
+
+
+def upgrade(conn):
+    """Aplica as migrações pendentes e retorna a lista de arquivos aplicados."""
+    aplicadas_agora = []
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_lock(%s);", (CHAVE_LOCK, ))
+        try:
+            aplicadas = versoes_aplicadas(cur)
+            conn.commit()
+
+            for versao, nome_arquivo in listar_migracoes():
+                if versao in aplicadas:
+                    continue
+
+                with open(os.path.join(PASTA_MIGRACOES, nome_arquivo),
+                          encoding='utf-8') as arquivo:
+                    sql = arquivo.read()
+
+                try:
+                    cur.execute(sql)
+                    cur.execute(
+                        "INSERT INTO schema_migracoes (versao, nome) VALUES (%s, %s);",
+                        (versao, nome_arquivo))
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    print(f"Falha ao aplicar a migração {nome_arquivo}.")
+                    raise
+
+                print(f"Migração aplicada: {nome_arquivo}")
+                aplicadas_agora.append(nome_arquivo)
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s);", (CHAVE_LOCK, ))
+            conn.commit()
+
+    return aplicadas_agora
+
+
+def status(conn):
+    with conn.cursor() as cur:
+        aplicadas = versoes_aplicadas(cur)
+    conn.commit()
+
+    for versao, nome_arquivo in listar_migracoes():
+        marca = 'aplicada' if versao in aplicadas else 'PENDENTE'
+        print(f"{marca:>9}  {nome_arquivo}")
+
+
+def _nos_do_plano(no):
+    yield no
+    for filho in no.get('Plans', []):
+        yield from _nos_do_plano(filho)
+
+
+def _verificar_plano(cur, nome, explain, problemas, ordenada=False):
+    """
+    Executa o EXPLAIN informado e anota em 'problemas' os Seq Scans do plano.
+    Com ordenada=True anota também Sorts e filtros aplicados depois do índice
+    (Filter): a consulta deveria ler só as linhas pedidas, já na ordem.
+    """
+    cur.execute(explain)
+    plano = cur.fetchone()[0][0]['Plan']
+
+    achados = []
+    for no in _nos_do_plano(plano):
+        if no['Node Type'] == 'Seq Scan':
+            achados.append(f"Seq Scan em {no.get('Relation Name')}")
+        elif ordenada and no['Node Type'] == 'Sort':
+            achados.append('Sort')
+        elif ordenada and 'Filter' in no and 'Relation Name' in no:
+            achados.append(f"Filter em {no['Relation Name']}")
+    for achado in achados:
+        problemas.append((nome, achado))
+
+    print(f"{nome:<24} {', '.join(achados) or 'ok'}")
+
+
+def check(conn):
+    """
+    Roda EXPLAIN (plano genérico) em cada statement de repositorio.STATEMENTS
+    e nas variações de repositorio.EXEMPLOS_LISTAGEM_LOJAS.
+    Retorna a lista de (consulta, problema) dos planos ruins.
+
+    enable_seqscan é desligado para que tabelas pequenas (desenvolvimento)
+    não mascarem a falta de índice: se o planner ainda assim escolher um
+    Seq Scan, nenhum índice atende à consulta. Pelo mesmo motivo as
+    listagens (exceto as de repositorio.LISTAGENS_COM_SORT) rodam com
+    enable_sort desligado: um Sort ou um Filter no plano quer dizer que
+    nenhum índice entrega as linhas filtradas na ordem da paginação.
+    """
+    problemas = []
+    with conn.cursor() as cur:
+        cur.execute("SET enable_seqscan = off;")
+        cur.execute("SET plan_cache_mode = force_generic_plan;")
+
+        for nome, sql in repositorio.STATEMENTS.items():
+            cur.execute(f"PREPARE {nome} AS {sql}")
+            qtd_params = len(set(re.findall(r'\$(\d+)', sql)))
+            argumentos = f" ({', '.join(['NULL'] * qtd_params)})" if qtd_params else ''
+            _verificar_plano(cur, nome,
+                             f"EXPLAIN (FORMAT JSON) EXECUTE {nome}{argumentos}",
+                             problemas)
+
+        # Listagens filtradas não são preparadas: EXPLAIN com valores de exemplo
+        for nome, filtros in repositorio.EXEMPLOS_LISTAGEM_LOJAS.items():
+            ordenada = nome not in repositorio.LISTAGENS_COM_SORT
+            cur.execute(f"SET enable_sort = {'off' if ordenada else 'on'};")
+            query, params = repositorio.montar_listagem_lojas(**filtros)
+            _verificar_plano(cur, nome,
+                             b"EXPLAIN (FORMAT JSON) " + cur.mogrify(query, params),
+                             problemas, ordenada=ordenada)
+
+    # Nada do check deve persistir na sessão
+    conn.rollback()
+    return problemas
+
+
+def main(argv):
+    comando = argv[1] if len(argv) > 1 else 'upgrade'
+    if comando not in ('upgrade', 'status', 'check'):
+        print(__doc__)
+        return 2
+
+    conn = conectar()
+    try:
+        if comando == 'upgrade':
+            aplicadas = upgrade(conn)
+            if not aplicadas:
+                print("Nenhuma migração pendente.")
+        elif comando == 'status':
+            status(conn)
+        else:
+            problemas = check(conn)
+            if problemas:
+                print(f"{len(problemas)} problema(s) nos planos das consultas quentes.")
+                return 1
+            print("Todas as consultas quentes usam índice.")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
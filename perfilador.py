@@ -0,0 +1,217 @@
+"""
+Perfil de CPU de uma requisição, sob demanda, em produção.
+
+Uma requisição é perfilada quando:
+    - traz 'X-Perfil: <expira>.<assinatura>', onde 'expira' é um epoch no
+      máximo PERFIL_VALIDADE_MAX_S (padrão 3600) à frente e 'assinatura' é
+      o HMAC-SHA256 (hex) de "<expira>:<MÉTODO> <caminho>" com
+      PERFIL_SEGREDO. O valor vale só para aquele método e caminho; gere com
+          python perfilador.py assinar GET /lojas
+    - ou é sorteada com probabilidade PERFIL_AMOSTRAGEM (padrão 0).
+Sem PERFIL_SEGREDO e com amostragem 0 nada é perfilado.
+
+Cada perfil vira dois arquivos em PERFIL_DIR (padrão dados/perfis), com o
+endpoint e a duração no nome (<quando>_<endpoint>_<ms>ms_<pid>_<id>):
+    .prof       estatísticas do cProfile (pstats, snakeviz)
+    .collapsed  pilhas da thread da requisição amostradas a cada
+                PERFIL_INTERVALO_MS (padrão 5), no formato de pilhas
+                colapsadas (flamegraph.pl, speedscope)
+Passando de PERFIL_MAX_MB (padrão 100), os arquivos mais antigos são
+apagados. A resposta perfilada informa o nome em X-Perfil-Arquivo.
+
+O cProfile aceita um perfil ativo por vez no processo: as requisições que
+chegam enquanto outra está sendo perfilada seguem sem perfil. Com workers
+gevent o cProfile também vê os outros greenlets da thread, e as pilhas
+amostradas não são gravadas.
+"""
+import argparse
+import contextlib
+import cProfile
+import hashlib
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from flask import g, request
+
+SEGREDO = os.getenv('PERFIL_SEGREDO')
+AMOSTRAGEM = float(os.getenv('PERFIL_AMOSTRAGEM', '0'))
+PASTA = os.getenv('PERFIL_DIR', 'dados/perfis')
+MAX_BYTES = int(float(os.getenv('PERFIL_MAX_MB', '100')) * 1024 * 1024)
+INTERVALO_S = float(os.getenv('PERFIL_INTERVALO_MS', '5')) / 1000
+VALIDADE_MAX_S = int(os.getenv('PERFIL_VALIDADE_MAX_S', '3600'))
+
+_lock = threading.Lock()
+
+
+def assinatura(segredo, expira, metodo, caminho):
+    mensagem = f"{expira}:{metodo.upper()} {caminho}".encode('utf-8')
+    return hmac.new(segredo.encode('utf-8'), mensagem, hashlib.sha256).hexdigest()
+
+
+def _cabecalho_valido():
+    enviado = request.headers.get('X-Perfil')
+    if not (SEGREDO and enviado):
+        return False
+
+    expira, _, assinado = enviado.partition('.')
+    try:
+        expira = int(expira)
+    except ValueError:
+        return False
+    agora = time.time()
+    if not agora <= expira <= agora + VALIDADE_MAX_S:
+        return False
+    esperado = assinatura(SEGREDO, expira, request.method, request.path)
+    # Em bytes: compare_digest recusa (TypeError) str com caracteres não ASCII
+    return hmac.compare_digest(esperado.encode('ascii'), assinado.encode('utf-8'))
+
+
+def _deve_perfilar():
+    if AMOSTRAGEM > 0 and random.random() < AMOSTRAGEM:
+        return True
+    return _cabecalho_valido()
+
+
+class _Amostrador(threading.Thread):
+    """Conta as pilhas de uma thread, lidas a intervalos fixos."""
+
+    def __init__(self, thread_id, intervalo):
+        super().__init__(name='perfilador-amostras', daemon=True)
+        self.thread_id = thread_id
+        self.intervalo = intervalo
+        self.pilhas = Counter()
+        self._parar = threading.Event()
+
+    def run(self):
+        while not self._parar.wait(self.intervalo):
+            frame = sys._current_frames().get(self.thread_id)
+            pilha = []
+            while frame is not None:
+                codigo = frame.f_code
+                pilha.append(f"{codigo.co_name} "
+                             f"({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})")
+                frame = frame.f_back
+            if pilha:
+                self.pilhas[';'.join(reversed(pilha))] += 1
+
+    def parar(self):
+        self._parar.set()
+        self.join()
+
+
+def _antes_da_requisicao():
+    if not (SEGREDO or AMOSTRAGEM > 0) or not _deve_perfilar():
+        return
+    if not _lock.acquire(blocking=False):
+        return  # Outra requisição deste processo já está sendo perfilada
+
+    perfil = cProfile.Profile()
+    try:
+        perfil.enable()
+    except ValueError:
+        # Outro profiler já ativo no interpretador
+        _lock.release()
+        return
+    amostrador = _Amostrador(threading.get_ident(), INTERVALO_S)
+    amostrador.start()
+    g.perfil_cpu = (perfil, amostrador, time.perf_counter())
+
+
+def _encerrar():
+    """Para o perfil da requisição; retorna (perfil, pilhas, duração) ou None."""
+    estado = g.pop('perfil_cpu', None)
+    if estado is None:
+        return None
+    perfil, amostrador, inicio = estado
+    try:
+        perfil.disable()
+        duracao = time.perf_counter() - inicio
+        amostrador.parar()
+    finally:
+        _lock.release()
+    return perfil, amostrador.pilhas, duracao
+
+
+def _salvar(perfil, pilhas, duracao):
+    os.makedirs(PASTA, exist_ok=True)
+    endpoint = re.sub(r'[^A-Za-z0-9_.-]', '_', request.endpoint or 'sem_endpoint')
+    base = os.path.join(PASTA, f"{time.strftime('%Y%m%dT%H%M%S')}_{endpoint}_"
+                               f"{duracao * 1000:.0f}ms_{os.getpid()}_{uuid.uuid4().hex[:6]}")
+
+    perfil.dump_stats(base + '.prof')
+    if pilhas:
+        with open(base + '.collapsed', 'w', encoding='utf-8') as arquivo:
+            for pilha, quantidade in pilhas.most_common():
+                arquivo.write(f"{pilha} {quantidade}\n")
+
+    _limitar_pasta()
+    return os.path.basename(base)
+
+
+def _limitar_pasta():
+    """Apaga os perfis mais antigos até a pasta caber em PERFIL_MAX_MB."""
+    arquivos = []
+    with os.scandir(PASTA) as entradas:
+        for entrada in entradas:
+            if entrada.is_file() and entrada.name.endswith(('.prof', '.collapsed')):
+                estado = entrada.stat()
+                arquivos.append((estado.st_mtime, estado.st_size, entrada.path))
+
+    total = sum(tamanho for _quando, tamanho, _caminho in arquivos)
+    for _quando, tamanho, caminho in sorted(arquivos):
+        if total <= MAX_BYTES:
+            break
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(caminho)
+        total -= tamanho
+
+
+def _depois_da_requisicao(resposta):
+    encerrado = _encerrar()
+    if encerrado is None:
+        return resposta
+    try:
+        resposta.headers['X-Perfil-Arquivo'] = _salvar(*encerrado)
+    except Exception as e:
+        print(f"Aviso: falha ao gravar o perfil de {request.endpoint}: {e}")
+    return resposta
+
+
+def _ao_desmontar(_erro):
+    # Erro não tratado: o after_request não rodou, mas o perfil precisa parar
+    _encerrar()
+
+
+def registrar(app):
+    """Registrado logo depois da admissão: requisições recusadas com 503 não são perfiladas."""
+    app.before_request(_antes_da_requisicao)
+    app.after_request(_depois_da_requisicao)
+    app.teardown_request(_ao_desmontar)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    subcomandos = parser.add_subparsers(dest='comando', required=True)
+    assinar = subcomandos.add_parser('assinar', help='gera o valor do cabeçalho X-Perfil')
+    assinar.add_argument('metodo')
+    assinar.add_argument('caminho', help='caminho sem a query string, ex.: /lojas')
+    assinar.add_argument('--validade', type=int, default=600,
+                         help='segundos até a assinatura expirar')
+    args = parser.parse_args()
+
+    if not SEGREDO:
+        print("Defina PERFIL_SEGREDO com o mesmo valor do servidor.")
+        sys.exit(1)
+    expira = int(time.time()) + args.validade
+    print(f"X-Perfil: {expira}.{assinatura(SEGREDO, expira, args.metodo, args.caminho)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,533 @@
+"""
+Camada de acesso a dados das rotas de gestores, clientes e lojas.
+
+As consultas mais frequentes ficam registradas em STATEMENTS e são
+preparadas (PREPARE) uma única vez por conexão do pool. Depois disso são
+executadas pelo nome (EXECUTE), e o PostgreSQL não refaz parse/plan a cada
+requisição. Os UPDATEs com lista de colunas variável são montados aqui a
+partir de listas fixas de colunas permitidas.
+
+Todas as funções recebem um cursor aberto pela rota, que continua
+responsável pela transação (commit/rollback) e pela conexão.
+"""
+
+# Nome do statement -> SQL com parâmetros posicionais ($1, $2, ...)
+STATEMENTS = {
+    # --- Gestores ---
+    'gestor_inserir': """
+        INSERT INTO gestores (nome, email, senha_hash)
+        VALUES ($1, $2, $3)
+        RETURNING gestor_id
+    """,
+    'gestor_por_email':
+    "SELECT gestor_id, nome, senha_hash FROM gestores WHERE email = $1",
+    'gestor_perfil':
+    "SELECT nome, email, foto_perfil FROM gestores WHERE gestor_id = $1",
+    'gestor_foto': "SELECT foto_perfil FROM gestores WHERE gestor_id = $1",
+    'gestor_deletar':
+    "DELETE FROM gestores WHERE gestor_id = $1 RETURNING foto_perfil",
+    'gestores_perfis_publicos':
+    "SELECT gestor_id, nome, foto_perfil FROM gestores WHERE gestor_id = ANY($1::integer[])",
+
+    # --- Clientes ---
+    'cliente_inserir': """
+        INSERT INTO clientes (nome, email, senha_hash)
+        VALUES ($1, $2, $3)
+        RETURNING cliente_id
+    """,
+    'cliente_por_email':
+    "SELECT cliente_id, nome, senha_hash FROM clientes WHERE email = $1",
+    'cliente_perfil': """
+        SELECT nome, email, data_cadastro, foto_perfil
+        FROM clientes WHERE cliente_id = $1
+    """,
+    'cliente_foto': "SELECT foto_perfil FROM clientes WHERE cliente_id = $1",
+    'cliente_deletar': "DELETE FROM clientes WHERE cliente_id = $1",
+    'clientes_perfis_publicos':
+    "SELECT cliente_id, nome, foto_perfil FROM clientes WHERE cliente_id = ANY($1::integer[])",
+
+    # --- Lojas ---
+    'loja_inserir': """
+        INSERT INTO lojas (gestor_id, nome_loja, endereco_rua, endereco_cidade, endereco_estado, endereco_cep)
+        VALUES ($1, $2, $3, $4, $5, $6)
+        RETURNING loja_id, gestor_id, nome_loja, descricao, endereco_rua, endereco_cidade, endereco_estado, endereco_cep, latitude, longitude, data_criacao, foto_perfil
+    """,
+    'loja_dono_foto':
+    "SELECT gestor_id, foto_perfil FROM lojas WHERE loja_id = $1",
+    'loja_foto': "SELECT foto_perfil FROM lojas WHERE loja_id = $1",
+    'lojas_todas': """
+        SELECT loja_id, nome_loja, descricao, endereco_rua, endereco_cidade,
+               endereco_estado, endereco_cep, latitude, longitude, data_criacao, foto_perfil
+        FROM lojas
+        ORDER BY nome_loja
+    """,
+    'loja_deletar':
+    "DELETE FROM lojas WHERE loja_id = $1 AND gestor_id = $2 RETURNING foto_perfil",
+    'lojas_deletar_lote_do_gestor': """
+        DELETE FROM lojas
+        WHERE loja_id IN (SELECT loja_id FROM lojas WHERE gestor_id = $1 LIMIT $2)
+        RETURNING foto_perfil
+    """,
+    'lojas_do_gestor': """
+        SELECT loja_id, gestor_id, nome_loja, descricao, endereco_rua,
+               endereco_cidade, endereco_estado, endereco_cep, latitude,
+               longitude, data_criacao, foto_perfil
+        FROM lojas
+        WHERE gestor_id = $1
+        ORDER BY nome_loja
+    """,
+
+    # --- Tarefas em segundo plano (tarefas.py) ---
+    'tarefa_criar': """
+        INSERT INTO tarefas (tipo, gestor_id) VALUES ($1, $2)
+        ON CONFLICT (tipo, gestor_id) WHERE situacao IN ('pendente', 'executando')
+        DO NOTHING
+        RETURNING tarefa_id
+    """,
+    'tarefa_ativa': """
+        SELECT tarefa_id FROM tarefas
+        WHERE tipo = $1 AND gestor_id = $2 AND situacao IN ('pendente', 'executando')
+    """,
+    'tarefa_por_id': """
+        SELECT tarefa_id, tipo, gestor_id, situacao, progresso, erro,
+               criada_em, atualizada_em, concluida_em
+        FROM tarefas WHERE tarefa_id = $1
+    """,
+    'tarefa_reservar': """
+        UPDATE tarefas SET situacao = 'executando', tentativas = tentativas + 1,
+                           atualizada_em = now()
+        WHERE tarefa_id = (
+            SELECT tarefa_id FROM tarefas
+            WHERE situacao = 'pendente'
+               OR (situacao = 'executando'
+                   AND atualizada_em < now() - make_interval(secs => $1))
+            ORDER BY tarefa_id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING tarefa_id, tipo, gestor_id, progresso
+    """,
+    'tarefa_progresso': """
+        UPDATE tarefas SET progresso = $2, atualizada_em = now()
+        WHERE tarefa_id = $1
+    """,
+    'tarefa_finalizar': """
+        UPDATE tarefas SET situacao = $2, erro = $3, atualizada_em = now(),
+                           concluida_em = now()
+        WHERE tarefa_id = $1
+    """,
+
+    # --- Revogação de tokens (revogacao.py) ---
+    'revogacao_registrar': """
+        INSERT INTO revogacoes (chave, revogado_em, expira_em)
+        VALUES ($1, now(), now() + make_interval(secs => $2))
+        ON CONFLICT (chave) DO UPDATE
+        SET revogado_em = EXCLUDED.revogado_em,
+            expira_em = GREATEST(revogacoes.expira_em, EXCLUDED.expira_em)
+    """,
+    'revogacoes_consultar': """
+        SELECT chave, extract(epoch FROM revogado_em)
+        FROM revogacoes
+        WHERE chave = ANY($1::varchar[]) AND expira_em > now()
+    """,
+    'revogacoes_desde': """
+        SELECT extract(epoch FROM revogado_em), chave
+        FROM revogacoes
+        WHERE revogado_em > to_timestamp($1) AND expira_em > now()
+    """,
+    'revogacoes_limpar': "DELETE FROM revogacoes WHERE expira_em <= now()",
+}
+
+# Colunas retornadas pelas listagens públicas de lojas (mesma ordem de 'lojas_todas')
+COLUNAS_LISTAGEM_LOJAS = ('loja_id', 'nome_loja', 'descricao', 'endereco_rua',
+                          'endereco_cidade', 'endereco_estado', 'endereco_cep',
+                          'latitude', 'longitude', 'data_criacao', 'foto_perfil')
+
+# Colunas de 'lojas_do_gestor' e dos perfis, na mesma ordem dos statements
+COLUNAS_LOJAS_DO_GESTOR = ('loja_id', 'gestor_id', 'nome_loja', 'descricao',
+                           'endereco_rua', 'endereco_cidade', 'endereco_estado',
+                           'endereco_cep', 'latitude', 'longitude',
+                           'data_criacao', 'foto_perfil')
+COLUNAS_PERFIL_GESTOR = ('nome', 'email', 'foto_perfil')
+COLUNAS_PERFIL_CLIENTE = ('nome', 'email', 'data_cadastro', 'foto_perfil')
+
+# Variações da listagem filtrada que 'migrar.py check' também confere
+EXEMPLOS_LISTAGEM_LOJAS = {
+    'lojas_por_estado': {'estado': 'SP', 'limite': 50},
+    'lojas_por_cidade': {'cidade': 'Campinas', 'limite': 50},
+    'lojas_por_estado_cidade': {'estado': 'SP', 'cidade': 'Campinas', 'limite': 50},
+    'lojas_por_cep': {'cep_prefixo': '01310', 'limite': 50},
+    'lojas_paginadas': {'apos': ('M', 0), 'limite': 50},
+}
+
+# As demais listagens de exemplo precisam sair do índice já na ordem
+# (nome_loja, loja_id); a do CEP usa o índice do prefixo e ordena o resultado.
+LISTAGENS_COM_SORT = {'lojas_por_cep'}
+
+# Colunas que os UPDATEs dinâmicos aceitam (nunca vêm do cliente sem filtro)
+COLUNAS_GESTOR = ('nome', 'email', 'senha_hash', 'foto_perfil')
+COLUNAS_CLIENTE = ('nome', 'email', 'senha_hash', 'foto_perfil')
+COLUNAS_LOJA = ('nome_loja', 'descricao', 'endereco_rua', 'endereco_cidade',
+                'endereco_estado', 'endereco_cep', 'latitude', 'longitude',
+                'foto_perfil')
+
+
+def executar(cur, nome, params=()):
+    """Executa o statement 'nome', preparando-o antes se for a primeira vez nesta conexão."""
+    preparados = cur.connection.preparados
+    if nome not in preparados:
+        cur.execute(f"PREPARE {nome} AS {STATEMENTS[nome]}")
+        preparados.add(nome)
+
+    if params:
+        marcadores = ', '.join(['%s'] * len(params))
+        cur.execute(f"EXECUTE {nome} ({marcadores})", tuple(params))
+    else:
+        cur.execute(f"EXECUTE {nome}")
+
+
+def _valor_unico(cur):
+    resultado = cur.fetchone()
+    return resultado[0] if resultado else None
+
+
+def escolher_colunas(texto, permitidas, obrigatorias=()):
+    """
+    Interpreta o parâmetro 'fields' ("nome_loja,foto_perfil") contra a lista
+    de colunas permitidas. Retorna as colunas pedidas mais as obrigatórias,
+    na ordem de 'permitidas'; sem 'fields', todas. ValueError se algum campo
+    não for permitido ou se nenhum for informado (ex.: "fields=,").
+    """
+    if not texto or not texto.strip():
+        return tuple(permitidas)
+
+    pedidas = {campo.strip() for campo in texto.split(',') if campo.strip()}
+    if not pedidas:
+        raise ValueError("Nenhum campo informado.")
+    invalidas = pedidas - set(permitidas)
+    if invalidas:
+        raise ValueError(f"Campos desconhecidos: {', '.join(sorted(invalidas))}.")
+
+    pedidas.update(obrigatorias)
+    return tuple(coluna for coluna in permitidas if coluna in pedidas)
+
+
+def linha_como_dict(colunas, linha):
+    """Mapeia uma linha do cursor para dict, com datas em ISO 8601."""
+    return {
+        coluna: valor.isoformat() if hasattr(valor, 'isoformat') else valor
+        for coluna, valor in zip(colunas, linha, strict=True)
+    }
+
+
+def _selecionar(cur, tabela, colunas, where, params, ordem=None):
+    """SELECT de colunas já validadas por escolher_colunas()."""
+    query = f"SELECT {', '.join(colunas)} FROM {tabela} WHERE {where}"
+    if ordem:
+        query += f" ORDER BY {ordem}"
+    cur.execute(query, params)
+
+
+def _montar_update_retornando_foto(tabela, chave, colunas_permitidas, campos,
+                                   condicao=''):
+    """
+    Monta o UPDATE apenas com colunas permitidas, com RETURNING do
+    foto_perfil ANTERIOR à atualização (a linha é travada na subconsulta).
+    Parâmetros: valores de 'campos', a chave e os da 'condicao' extra
+    (sobre o alias 't').
+    """
+    invalidas = set(campos) - set(colunas_permitidas)
+    if invalidas:
+        raise ValueError(f"Colunas não permitidas em {tabela}: {sorted(invalidas)}")
+
+    sets = ', '.join(f"{coluna} = %s" for coluna in campos)
+    return (f"UPDATE {tabela} AS t SET {sets} "
+            f"FROM (SELECT {chave}, foto_perfil FROM {tabela} "
+            f"WHERE {chave} = %s FOR UPDATE) AS anterior "
+            f"WHERE t.{chave} = anterior.{chave}{condicao} "
+            f"RETURNING anterior.foto_perfil;")
+
+
+# --- Gestores ---
+
+def inserir_gestor(cur, nome, email, senha_hash):
+    executar(cur, 'gestor_inserir', (nome, email, senha_hash))
+    return _valor_unico(cur)
+
+
+def buscar_gestor_por_email(cur, email):
+    """Retorna (gestor_id, nome, senha_hash) ou None."""
+    executar(cur, 'gestor_por_email', (email, ))
+    return cur.fetchone()
+
+
+def buscar_perfil_gestor(cur, gestor_id):
+    """Retorna (nome, email, foto_perfil) ou None."""
+    executar(cur, 'gestor_perfil', (gestor_id, ))
+    return cur.fetchone()
+
+
+def buscar_campos_perfil_gestor(cur, gestor_id, colunas):
+    """Como buscar_perfil_gestor, mas só com 'colunas' (de COLUNAS_PERFIL_GESTOR)."""
+    _selecionar(cur, 'gestores', colunas, "gestor_id = %s", (gestor_id, ))
+    return cur.fetchone()
+
+
+def buscar_foto_gestor(cur, gestor_id):
+    executar(cur, 'gestor_foto', (gestor_id, ))
+    return _valor_unico(cur)
+
+
+def atualizar_gestor(cur, gestor_id, campos):
+    """
+    Atualiza as colunas de 'campos' (dict). Retorna (foto_perfil anterior,)
+    ou None se o gestor não existir.
+    """
+    query = _montar_update_retornando_foto('gestores', 'gestor_id',
+                                           COLUNAS_GESTOR, campos)
+    cur.execute(query, (*campos.values(), gestor_id))
+    return cur.fetchone()
+
+
+def deletar_gestor(cur, gestor_id):
+    """Remove o gestor; retorna (foto_perfil,) ou None se ele não existir."""
+    executar(cur, 'gestor_deletar', (gestor_id, ))
+    return cur.fetchone()
+
+
+def buscar_perfis_publicos_gestores(cur, gestor_ids):
+    """Retorna [(gestor_id, nome, foto_perfil)] dos ids encontrados, numa única consulta."""
+    executar(cur, 'gestores_perfis_publicos', (list(gestor_ids), ))
+    return cur.fetchall()
+
+
+# --- Clientes ---
+
+def inserir_cliente(cur, nome, email, senha_hash):
+    executar(cur, 'cliente_inserir', (nome, email, senha_hash))
+    return _valor_unico(cur)
+
+
+def buscar_cliente_por_email(cur, email):
+    """Retorna (cliente_id, nome, senha_hash) ou None."""
+    executar(cur, 'cliente_por_email', (email, ))
+    return cur.fetchone()
+
+
+def buscar_perfil_cliente(cur, cliente_id):
+    """Retorna (nome, email, data_cadastro, foto_perfil) ou None."""
+    executar(cur, 'cliente_perfil', (cliente_id, ))
+    return cur.fetchone()
+
+
+def buscar_campos_perfil_cliente(cur, cliente_id, colunas):
+    """Como buscar_perfil_cliente, mas só com 'colunas' (de COLUNAS_PERFIL_CLIENTE)."""
+    _selecionar(cur, 'clientes', colunas, "cliente_id = %s", (cliente_id, ))
+    return cur.fetchone()
+
+
+def buscar_foto_cliente(cur, cliente_id):
+    executar(cur, 'cliente_foto', (cliente_id, ))
+    return _valor_unico(cur)
+
+
+def atualizar_cliente(cur, cliente_id, campos):
+    """
+    Atualiza as colunas de 'campos' (dict). Retorna (foto_perfil anterior,)
+    ou None se o cliente não existir.
+    """
+    query = _montar_update_retornando_foto('clientes', 'cliente_id',
+                                           COLUNAS_CLIENTE, campos)
+    cur.execute(query, (*campos.values(), cliente_id))
+    return cur.fetchone()
+
+
+def deletar_cliente(cur, cliente_id):
+    executar(cur, 'cliente_deletar', (cliente_id, ))
+    return cur.rowcount
+
+
+def buscar_perfis_publicos_clientes(cur, cliente_ids):
+    """Retorna [(cliente_id, nome, foto_perfil)] dos ids encontrados, numa única consulta."""
+    executar(cur, 'clientes_perfis_publicos', (list(cliente_ids), ))
+    return cur.fetchall()
+
+
+# --- Lojas ---
+
+def inserir_loja(cur, gestor_id, nome_loja, endereco_rua, endereco_cidade,
+                 endereco_estado, endereco_cep):
+    """Insere a loja e retorna a linha completa (mesma ordem de colunas do RETURNING)."""
+    executar(cur, 'loja_inserir', (gestor_id, nome_loja, endereco_rua,
+                                   endereco_cidade, endereco_estado, endereco_cep))
+    return cur.fetchone()
+
+
+def buscar_dono_e_foto_loja(cur, loja_id):
+    """Retorna (gestor_id, foto_perfil) ou None."""
+    executar(cur, 'loja_dono_foto', (loja_id, ))
+    return cur.fetchone()
+
+
+def buscar_foto_loja(cur, loja_id):
+    executar(cur, 'loja_foto', (loja_id, ))
+    return _valor_unico(cur)
+
+
+def atualizar_loja(cur, loja_id, gestor_id, campos):
+    """
+    Atualiza a loja se ela pertencer ao gestor. Retorna (foto_perfil anterior,)
+    ou None se a loja não existir ou for de outro gestor.
+    """
+    query = _montar_update_retornando_foto('lojas', 'loja_id', COLUNAS_LOJA,
+                                           campos, " AND t.gestor_id = %s")
+    cur.execute(query, (*campos.values(), loja_id, gestor_id))
+    return cur.fetchone()
+
+
+def deletar_loja(cur, loja_id, gestor_id):
+    """Remove a loja se ela pertencer ao gestor; retorna (foto_perfil,) ou None."""
+    executar(cur, 'loja_deletar', (loja_id, gestor_id))
+    return cur.fetchone()
+
+
+def deletar_lote_lojas_do_gestor(cur, gestor_id, tamanho):
+    """Remove até 'tamanho' lojas do gestor; retorna as fotos das lojas removidas."""
+    executar(cur, 'lojas_deletar_lote_do_gestor', (gestor_id, tamanho))
+    return [linha[0] for linha in cur.fetchall()]
+
+
+def listar_lojas(cur):
+    executar(cur, 'lojas_todas')
+    return cur.fetchall()
+
+
+def _escapar_like(texto):
+    return texto.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def montar_listagem_lojas(cidade=None, estado=None, cep_prefixo=None,
+                          apos=None, limite=None,
+                          colunas=COLUNAS_LISTAGEM_LOJAS):
+    """
+    Monta o SELECT da listagem pública com filtros e paginação por
+    (nome_loja, loja_id), só com 'colunas' (de COLUNAS_LISTAGEM_LOJAS).
+    Retorna (query, params).
+
+    Não é preparado de propósito: com o prefixo do CEP como literal o
+    planner consegue usar o índice text_pattern_ops, o que um plano
+    genérico com LIKE $1 não faz.
+    """
+    condicoes = []
+    params = []
+
+    if estado:
+        condicoes.append("lower(endereco_estado) = lower(%s)")
+        params.append(estado)
+    if cidade:
+        condicoes.append("lower(endereco_cidade) = lower(%s)")
+        params.append(cidade)
+    if cep_prefixo:
+        condicoes.append("endereco_cep LIKE %s")
+        params.append(_escapar_like(cep_prefixo) + '%')
+    if apos:
+        condicoes.append("(nome_loja, loja_id) > (%s, %s)")
+        params.extend(apos)
+
+    query = f"SELECT {', '.join(colunas)} FROM lojas"
+    if condicoes:
+        query += f" WHERE {' AND '.join(condicoes)}"
+    query += " ORDER BY nome_loja, loja_id"
+    if limite:
+        query += " LIMIT %s"
+        params.append(limite)
+    return query, params
+
+
+def listar_lojas_filtradas(cur, **filtros):
+    """Listagem pública com os filtros de montar_listagem_lojas()."""
+    query, params = montar_listagem_lojas(**filtros)
+    cur.execute(query, params)
+    return cur.fetchall()
+
+
+def listar_lojas_do_gestor(cur, gestor_id):
+    executar(cur, 'lojas_do_gestor', (gestor_id, ))
+    return cur.fetchall()
+
+
+def listar_campos_lojas_do_gestor(cur, gestor_id, colunas):
+    """Como listar_lojas_do_gestor, mas só com 'colunas' (de COLUNAS_LOJAS_DO_GESTOR)."""
+    _selecionar(cur, 'lojas', colunas, "gestor_id = %s", (gestor_id, ),
+                ordem='nome_loja')
+    return cur.fetchall()
+
+
+def montar_exportacao_lojas_do_gestor(cur, gestor_id, colunas=COLUNAS_LOJAS_DO_GESTOR):
+    """
+    SELECT das lojas do gestor para COPY (...) TO STDOUT, na ordem de
+    listar_lojas_do_gestor e só com 'colunas'. Os valores saem como texto
+    do PostgreSQL, iguais com COPY ou com cursor. COPY não aceita parâmetros
+    nem EXECUTE: o gestor_id entra já escapado pelo mogrify.
+    """
+    selecao = ', '.join(f"{coluna}::text AS {coluna}" for coluna in colunas)
+    return cur.mogrify(
+        f"SELECT {selecao} FROM lojas WHERE gestor_id = %s ORDER BY nome_loja",
+        (gestor_id, )).decode('utf-8')
+
+
+# --- Tarefas ---
+
+def criar_tarefa(cur, tipo, gestor_id):
+    """Cria a tarefa, ou retorna a que já está ativa para o mesmo tipo e gestor."""
+    executar(cur, 'tarefa_criar', (tipo, gestor_id))
+    tarefa_id = _valor_unico(cur)
+    if tarefa_id is None:
+        executar(cur, 'tarefa_ativa', (tipo, gestor_id))
+        tarefa_id = _valor_unico(cur)
+    return tarefa_id
+
+
+def buscar_tarefa(cur, tarefa_id):
+    executar(cur, 'tarefa_por_id', (tarefa_id, ))
+    return cur.fetchone()
+
+
+def reservar_tarefa(cur, abandonada_apos_s):
+    """
+    Marca como 'executando' a próxima tarefa pendente (ou abandonada há mais
+    de 'abandonada_apos_s' segundos) e a retorna; None se não houver.
+    """
+    executar(cur, 'tarefa_reservar', (abandonada_apos_s, ))
+    return cur.fetchone()
+
+
+def registrar_progresso_tarefa(cur, tarefa_id, progresso_json):
+    executar(cur, 'tarefa_progresso', (tarefa_id, progresso_json))
+
+
+def finalizar_tarefa(cur, tarefa_id, situacao, erro=None):
+    executar(cur, 'tarefa_finalizar', (tarefa_id, situacao, erro))
+
+
+# --- Revogações ---
+
+def registrar_revogacao(cur, chave, validade_s):
+    executar(cur, 'revogacao_registrar', (chave, validade_s))
+
+
+def consultar_revogacoes(cur, chaves):
+    """Retorna [(chave, revogado_em em epoch)] das chaves revogadas e ainda válidas."""
+    executar(cur, 'revogacoes_consultar', (list(chaves), ))
+    return cur.fetchall()
+
+
+def revogacoes_desde(cur, epoch):
+    """Retorna [(revogado_em em epoch, chave)] das revogações posteriores a 'epoch'."""
+    executar(cur, 'revogacoes_desde', (epoch, ))
+    return cur.fetchall()
+
+
+def limpar_revogacoes_expiradas(cur):
+    executar(cur, 'revogacoes_limpar')
+    return cur.rowcount
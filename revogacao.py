@@ -0,0 +1,206 @@
+"""
+Revogação de tokens JWT antes da expiração.
+
+A tabela 'revogacoes' é a fonte da verdade, com dois tipos de chave:
+    jti:<jti>             um token específico (POST /token/revogar)
+    gestor:<id>           todos os tokens do usuário emitidos até revogado_em
+    cliente:<id>          (troca de senha, exclusão de conta)
+
+Cada processo mantém um filtro de Bloom com as chaves ativas. Um token só
+é conferido no banco quando alguma das suas chaves aparece no filtro; no
+caso comum (nenhuma revogação para aquele usuário) o custo é calcular
+alguns hashes. Uma thread por processo traz as revogações novas a cada
+REVOGACAO_SYNC_S segundos (padrão 10) e reconstrói o filtro, descartando
+as expiradas, a cada REVOGACAO_REBUILD_S (padrão 3600). O processo que
+revoga atualiza o próprio filtro na hora; os demais, no próximo sync.
+
+Se o banco estiver fora na carga inicial, os tokens são aceitos (fail
+open), como no limite de taxa.
+"""
+import hashlib
+import math
+import os
+import time
+
+import repositorio
+from banco import get_db_connection, release_db_connection
+from segundo_plano import ThreadPorProcesso
+
+SYNC_S = float(os.getenv('REVOGACAO_SYNC_S', '10'))
+REBUILD_S = float(os.getenv('REVOGACAO_REBUILD_S', '3600'))
+CAPACIDADE = int(os.getenv('REVOGACAO_BLOOM_CAPACIDADE', '100000'))
+FALSO_POSITIVO = float(os.getenv('REVOGACAO_BLOOM_FP', '0.01'))
+
+# Sobreposição entre um sync incremental e o anterior
+JANELA_S = 300
+
+# Validade dos tokens emitidos pelas rotas de login/cadastro/perfil
+VALIDADE_TOKEN_S = 24 * 3600
+
+
+class FiltroBloom:
+    """Filtro de Bloom com hashing duplo sobre um blake2b de 128 bits."""
+
+    def __init__(self, capacidade, taxa_falso_positivo):
+        bits = -capacidade * math.log(taxa_falso_positivo) / (math.log(2) ** 2)
+        self.tamanho = max(8, int(math.ceil(bits)))
+        self.hashes = max(1, round(self.tamanho / capacidade * math.log(2)))
+        self.bits = bytearray((self.tamanho + 7) // 8)
+
+    def _posicoes(self, chave):
+        digest = hashlib.blake2b(chave.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.tamanho for i in range(self.hashes))
+
+    def adicionar(self, chave):
+        for posicao in self._posicoes(chave):
+            self.bits[posicao >> 3] |= 1 << (posicao & 7)
+
+    def __contains__(self, chave):
+        return all(self.bits[posicao >> 3] & (1 << (posicao & 7))
+                   for posicao in self._posicoes(chave))
+
+
+def chave_usuario(papel, usuario_id):
+    return f"{papel}:{usuario_id}"
+
+
+def chaves_do_token(dados_usuario):
+    papel = dados_usuario.get('role')
+    chaves = [chave_usuario(papel, dados_usuario.get(f"{papel}_id"))]
+    if dados_usuario.get('jti'):
+        chaves.append(f"jti:{dados_usuario['jti']}")
+    return chaves
+
+
+class Revogacoes:
+    """Filtro de Bloom do processo, sincronizado com a tabela 'revogacoes'."""
+
+    def __init__(self):
+        self._filtro = FiltroBloom(CAPACIDADE, FALSO_POSITIVO)
+        self._visto_ate = 0.0
+        self._reconstruido_em = 0.0
+        self._carregado = False
+        self._thread = ThreadPorProcesso('sync-revogacoes', self._executar,
+                                         preparar=self._carga_inicial)
+        # Resultados do banco desde o último sync: chave -> revogado_em (epoch)
+        self._confirmadas = {}
+
+    def garantir_execucao(self):
+        self._thread.garantir()
+
+    def _carga_inicial(self):
+        # Síncrona: sem ela a primeira requisição aceitaria tokens já revogados
+        self._carregado = False
+        self._reconstruido_em = time.monotonic()
+        self._sincronizar(reconstruir=False)
+
+    def _executar(self):
+        while True:
+            time.sleep(SYNC_S)
+            self._sincronizar(
+                reconstruir=time.monotonic() - self._reconstruido_em >= REBUILD_S)
+
+    def _sincronizar(self, reconstruir):
+        # A reconstrução também apaga as expiradas, e isso precisa do primário
+        conn = get_db_connection(somente_leitura=not reconstruir)
+        if conn is None:
+            return
+        try:
+            with conn.cursor() as cur:
+                if reconstruir:
+                    repositorio.limpar_revogacoes_expiradas(cur)
+                    conn.commit()
+                    filtro, desde = FiltroBloom(CAPACIDADE, FALSO_POSITIVO), 0.0
+                else:
+                    filtro, desde = self._filtro, self._visto_ate
+
+                # A janela cobre transações que confirmaram depois de uma
+                # revogação mais nova já lida (revogado_em é o início da transação)
+                novas = repositorio.revogacoes_desde(cur, max(0.0, desde - JANELA_S))
+            conn.rollback()
+
+            for revogado_em, chave in novas:
+                filtro.adicionar(chave)
+                desde = max(desde, float(revogado_em))
+
+            if reconstruir:
+                self._reconstruido_em = time.monotonic()
+            self._filtro, self._visto_ate = filtro, desde
+            self._confirmadas = {}
+            self._carregado = True
+        except Exception as e:
+            print(f"Aviso: falha ao sincronizar revogações: {e}")
+        finally:
+            release_db_connection(conn)
+
+    def adicionar_local(self, chave):
+        """Marca a chave no filtro deste processo (antes mesmo do commit)."""
+        self._filtro.adicionar(chave)
+        self._confirmadas.pop(chave, None)
+
+    def esta_revogado(self, dados_usuario):
+        self.garantir_execucao()
+        if not self._carregado:
+            return False
+
+        suspeitas = [chave for chave in chaves_do_token(dados_usuario)
+                     if chave in self._filtro]
+        if not suspeitas:
+            return False
+
+        revogacoes = self._consultar(suspeitas)
+        emitido_em = dados_usuario.get('iat', 0)
+        for chave, revogado_em in revogacoes.items():
+            if revogado_em is None:
+                continue
+            if chave.startswith('jti:'):
+                return True
+            # 'iat' tem resolução de segundos: tokens emitidos no mesmo
+            # segundo da revogação continuam válidos
+            if emitido_em < int(revogado_em):
+                return True
+        return False
+
+    def _consultar(self, chaves):
+        confirmadas = self._confirmadas
+        faltando = [chave for chave in chaves if chave not in confirmadas]
+        if faltando:
+            conn = get_db_connection(somente_leitura=True)
+            if conn is None:
+                return {}
+            try:
+                with conn.cursor() as cur:
+                    encontradas = dict(repositorio.consultar_revogacoes(cur, faltando))
+                conn.rollback()
+            except Exception as e:
+                print(f"Aviso: falha ao consultar revogações: {e}")
+                return {}
+            finally:
+                release_db_connection(conn)
+            for chave in faltando:
+                confirmadas[chave] = encontradas.get(chave)
+        return {chave: confirmadas.get(chave) for chave in chaves}
+
+
+revogacoes = Revogacoes()
+
+
+def esta_revogado(dados_usuario):
+    return revogacoes.esta_revogado(dados_usuario)
+
+
+def revogar_usuario(cur, papel, usuario_id):
+    """Revoga (na transação de 'cur') todos os tokens já emitidos para o usuário."""
+    chave = chave_usuario(papel, usuario_id)
+    repositorio.registrar_revogacao(cur, chave, VALIDADE_TOKEN_S)
+    revogacoes.adicionar_local(chave)
+
+
+def revogar_token(cur, dados_usuario):
+    """Revoga (na transação de 'cur') o token com o 'jti' de dados_usuario."""
+    chave = f"jti:{dados_usuario['jti']}"
+    restante = max(0, dados_usuario.get('exp', 0) - time.time())
+    repositorio.registrar_revogacao(cur, chave, restante)
+    revogacoes.adicionar_local(chave)
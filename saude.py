@@ -0,0 +1,125 @@
+"""
+Probes de saúde baratos para o orquestrador (Cloud Run / load balancer).
+
+GET /healthz  o processo está vivo; não faz nenhum I/O.
+GET /readyz   situação do banco e do Object Storage lida de um cache que uma
+              thread de fundo atualiza a cada READINESS_INTERVAL segundos
+              (padrão 10). Responde 503 enquanto o banco estiver
+              inacessível.
+
+O banco é verificado por uma conexão própria do monitor, fora do pool, com
+limite de READINESS_DB_TIMEOUT segundos (padrão 2): com o pool esgotado
+pelas requisições a instância está ocupada, não sem banco, e continua na
+rotação.
+
+A thread começa no post_fork do gunicorn (gunicorn.conf.py), antes do
+primeiro probe; fora do gunicorn, na primeira chamada de /readyz. Se a
+primeira verificação ainda não terminou, /readyz espera por ela até
+READINESS_PRIMEIRA_ESPERA segundos (padrão 2) antes de responder.
+
+As duas rotas incluem as estatísticas do pool de conexões.
+"""
+import os
+import threading
+import time
+
+import psycopg2
+from flask import Blueprint, jsonify
+
+import armazenamento
+from banco import estatisticas_pool, parametros_conexao
+from segundo_plano import ThreadPorProcesso
+
+saude_bp = Blueprint('saude', __name__)
+
+
+class MonitorDependencias:
+    """Verifica banco e storage periodicamente e guarda o último resultado."""
+
+    def __init__(self, intervalo):
+        self.intervalo = intervalo
+        self.situacao = {
+            "banco": {"ok": None, "verificado_em": None},
+            "storage": {"ok": None, "verificado_em": None},
+        }
+        self._verificado = threading.Event()
+        self._conn = None
+        self._thread = ThreadPorProcesso('monitor-dependencias', self._executar,
+                                         preparar=self._preparar_processo)
+
+    def garantir_execucao(self):
+        self._thread.garantir()
+
+    def _preparar_processo(self):
+        self._verificado = threading.Event()
+        # A conexão herdada do processo pai não é fechada: ela ainda é dele
+        self._conn = None
+
+    def _executar(self):
+        while True:
+            self.situacao = {
+                "banco": self._verificar(self._verificar_banco),
+                "storage": self._verificar(self._verificar_storage),
+            }
+            self._verificado.set()
+            time.sleep(self.intervalo)
+
+    def aguardar_primeira_verificacao(self, limite):
+        self._verificado.wait(limite)
+
+    @staticmethod
+    def _verificar(funcao):
+        inicio = time.perf_counter()
+        try:
+            funcao()
+            resultado = {"ok": True}
+        except Exception as e:
+            resultado = {"ok": False, "erro": str(e)}
+        resultado["latencia_ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+        resultado["verificado_em"] = time.time()
+        return resultado
+
+    def _verificar_banco(self):
+        if self._conn is None or self._conn.closed:
+            self._conn = psycopg2.connect(
+                **parametros_conexao(),
+                connect_timeout=max(1, round(DB_TIMEOUT_S)),
+                options=f"-c statement_timeout={int(DB_TIMEOUT_S * 1000)}")
+        try:
+            with self._conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            self._conn.rollback()
+        except Exception:
+            self._conn.close()
+            raise
+
+    @staticmethod
+    def _verificar_storage():
+        armazenamento.existe('.readyz')
+
+
+PRIMEIRA_ESPERA = float(os.getenv('READINESS_PRIMEIRA_ESPERA', '2'))
+DB_TIMEOUT_S = float(os.getenv('READINESS_DB_TIMEOUT', '2'))
+
+monitor = MonitorDependencias(float(os.getenv('READINESS_INTERVAL', '10')))
+
+
+@saude_bp.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness: responde sem tocar em banco ou storage."""
+    return jsonify({"status": "vivo", "pool": estatisticas_pool()}), 200
+
+
+@saude_bp.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness: usa a última verificação feita em segundo plano."""
+    monitor.garantir_execucao()
+    monitor.aguardar_primeira_verificacao(PRIMEIRA_ESPERA)
+    situacao = monitor.situacao
+
+    pronto = situacao["banco"]["ok"] is True
+    return jsonify({
+        "status": "pronto" if pronto else "indisponivel",
+        "dependencias": situacao,
+        "pool": estatisticas_pool()
+    }), 200 if pronto else 503
@@ -0,0 +1,37 @@
+"""
+Threads de fundo por processo.
+
+Threads não sobrevivem ao fork do gunicorn: cada worker precisa iniciar as
+suas. ThreadPorProcesso guarda o pid em que a thread foi iniciada e, na
+primeira chamada de garantir() num pid novo, inicia outra.
+"""
+import os
+import threading
+
+
+class ThreadPorProcesso:
+    """
+    Thread daemon 'alvo' iniciada uma vez por processo.
+
+    'preparar', se informado, roda antes de a thread iniciar, no processo
+    novo e sob o lock: chamadas concorrentes de garantir() esperam por ele.
+    Se 'preparar' falhar, a próxima chamada tenta de novo.
+    """
+
+    def __init__(self, nome, alvo, preparar=None):
+        self.nome = nome
+        self._alvo = alvo
+        self._preparar = preparar
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def garantir(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                if self._preparar is not None:
+                    self._preparar()
+                threading.Thread(target=self._alvo, name=self.nome,
+                                 daemon=True).start()
+                self._pid = os.getpid()
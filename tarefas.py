@@ -0,0 +1,200 @@
+"""
+Tarefas em segundo plano, persistidas na tabela 'tarefas'.
+
+A rota cria a tarefa (criar_tarefa) e responde 202 com o id sem esperar o
+trabalho. Uma thread por processo reserva as tarefas pendentes com
+FOR UPDATE SKIP LOCKED, então vários workers e instâncias dividem a fila sem
+executar a mesma tarefa duas vezes. Uma tarefa 'executando' que não registra
+progresso há TAREFAS_ABANDONO_S segundos (padrão 300; o worker morreu) é
+retomada por outro processo: cada tipo precisa poder ser reexecutado.
+
+Tipos:
+    excluir_gestor  remove as lojas do gestor em lotes de TAREFAS_LOTE_LOJAS
+                    (padrão 200), apaga as fotos dessas lojas em paralelo
+                    (TAREFAS_CONCORRENCIA_FOTOS, padrão 8) e por fim o gestor.
+
+GET /tarefas/<id> mostra a situação da tarefa ao gestor que a criou.
+TAREFAS_WORKER=0 desliga a execução neste processo (só enfileira).
+"""
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Blueprint, jsonify
+
+import armazenamento
+import invalidacao
+import repositorio
+import revogacao
+from auth import token_obrigatorio
+from banco import get_db_connection, release_db_connection
+from segundo_plano import ThreadPorProcesso
+
+tarefas_bp = Blueprint('tarefas', __name__)
+
+INTERVALO = float(os.getenv('TAREFAS_INTERVALO', '5'))
+ABANDONO_S = float(os.getenv('TAREFAS_ABANDONO_S', '300'))
+LOTE_LOJAS = int(os.getenv('TAREFAS_LOTE_LOJAS', '200'))
+CONCORRENCIA_FOTOS = int(os.getenv('TAREFAS_CONCORRENCIA_FOTOS', '8'))
+
+
+def _em_transacao(funcao):
+    """Executa funcao(cur) numa transação curta e devolve a conexão ao pool."""
+    conn = get_db_connection()
+    if conn is None:
+        raise Exception("Falha na conexão com o banco de dados")
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                resultado = funcao(cur)
+                conn.commit()
+        return resultado
+    finally:
+        release_db_connection(conn)
+
+
+def _excluir_gestor(tarefa_id, gestor_id, progresso):
+    progresso.setdefault('lojas_removidas', 0)
+    progresso.setdefault('fotos_removidas', 0)
+
+    def apagar_lote(cur):
+        fotos = repositorio.deletar_lote_lojas_do_gestor(cur, gestor_id, LOTE_LOJAS)
+        if fotos:
+            invalidacao.notificar(cur, 'loja')
+        progresso['lojas_removidas'] += len(fotos)
+        repositorio.registrar_progresso_tarefa(cur, tarefa_id, json.dumps(progresso))
+        return fotos
+
+    def apagar_gestor(cur):
+        # Lojas criadas durante a tarefa saem na mesma transação que o gestor
+        fotos = []
+        while True:
+            lote = repositorio.deletar_lote_lojas_do_gestor(cur, gestor_id, LOTE_LOJAS)
+            fotos.extend(lote)
+            if len(lote) < LOTE_LOJAS:
+                break
+        progresso['lojas_removidas'] += len(fotos)
+
+        gestor = repositorio.deletar_gestor(cur, gestor_id)
+        if gestor is not None:
+            fotos.append(gestor[0])
+        # A conta deixa de existir: nenhum token dela deve continuar valendo
+        revogacao.revogar_usuario(cur, 'gestor', gestor_id)
+        invalidacao.notificar(cur, 'loja')
+        invalidacao.notificar(cur, 'gestor', gestor_id)
+        repositorio.registrar_progresso_tarefa(cur, tarefa_id, json.dumps(progresso))
+        return fotos
+
+    # As fotos são apagadas depois do commit de cada lote; uma falha vira órfã
+    # e fica para o gc_fotos.py
+    with ThreadPoolExecutor(max_workers=CONCORRENCIA_FOTOS,
+                            thread_name_prefix='tarefa-fotos') as executor:
+        while True:
+            fotos = _em_transacao(apagar_lote)
+            apagadas = [foto for foto in fotos if foto]
+            list(executor.map(armazenamento.descartar, apagadas))
+            progresso['fotos_removidas'] += len(apagadas)
+            if len(fotos) < LOTE_LOJAS:
+                break
+
+        fotos = [foto for foto in _em_transacao(apagar_gestor) if foto]
+        list(executor.map(armazenamento.descartar, fotos))
+        progresso['fotos_removidas'] += len(fotos)
+
+    _em_transacao(lambda cur: repositorio.registrar_progresso_tarefa(
+        cur, tarefa_id, json.dumps(progresso)))
+
+
+TIPOS = {
+    'excluir_gestor': _excluir_gestor,
+}
+
+
+class ExecutorTarefas:
+    """Thread que reserva e executa as tarefas pendentes, uma por vez."""
+
+    def __init__(self, intervalo):
+        self.intervalo = intervalo
+        self._thread = ThreadPorProcesso('executor-tarefas', self._executar)
+        self._acordar = threading.Event()
+
+    def garantir_execucao(self):
+        if os.getenv('TAREFAS_WORKER', '1') == '1':
+            self._thread.garantir()
+
+    def notificar(self):
+        """Chamado depois do commit de uma tarefa nova para não esperar o intervalo."""
+        self.garantir_execucao()
+        self._acordar.set()
+
+    def _executar(self):
+        while True:
+            try:
+                tarefa = _em_transacao(
+                    lambda cur: repositorio.reservar_tarefa(cur, ABANDONO_S))
+            except Exception as e:
+                print(f"Erro ao reservar tarefa: {e}")
+                tarefa = None
+
+            if tarefa is None:
+                self._acordar.wait(self.intervalo)
+                self._acordar.clear()
+                continue
+
+            self._processar(*tarefa)
+
+    @staticmethod
+    def _processar(tarefa_id, tipo, gestor_id, progresso):
+        try:
+            TIPOS[tipo](tarefa_id, gestor_id, dict(progresso or {}))
+            situacao, erro = 'concluida', None
+        except Exception as e:
+            print(f"Erro na tarefa {tarefa_id} ({tipo}): {e}")
+            situacao, erro = 'falhou', str(e)
+
+        try:
+            _em_transacao(lambda cur: repositorio.finalizar_tarefa(
+                cur, tarefa_id, situacao, erro))
+        except Exception as e:
+            # Sem o registro final, a tarefa é retomada depois do abandono
+            print(f"Erro ao finalizar tarefa {tarefa_id}: {e}")
+
+
+executor = ExecutorTarefas(INTERVALO)
+
+# Retoma tarefas pendentes ou abandonadas assim que o processo atende a primeira requisição
+tarefas_bp.before_app_request(executor.garantir_execucao)
+
+
+@tarefas_bp.route('/tarefas/<int:tarefa_id>', methods=['GET'])
+@token_obrigatorio('gestor', permitir_revogado=True) # A exclusão da conta revoga o token
+def obter_tarefa(dados_usuario, tarefa_id):
+    """
+    GET /tarefas/<tarefa_id>
+    Rota protegida. Retorna a situação de uma tarefa criada pelo gestor logado.
+    Retorna: JSON com 'situacao' ('pendente', 'executando', 'concluida' ou 'falhou') e 'progresso', ou 404.
+    """
+    conn = get_db_connection()
+    if conn is None:
+        return jsonify({"error": "Falha na conexão com o banco de dados"}), 500
+
+    try:
+        with conn.cursor() as cur:
+            tarefa = repositorio.buscar_tarefa(cur, tarefa_id)
+        conn.rollback()
+
+        # Tarefa de outro gestor responde como inexistente
+        if tarefa is None or tarefa[2] != dados_usuario.get('gestor_id'):
+            return jsonify({"error": "Tarefa não encontrada."}), 404
+
+        colunas = ('tarefa_id', 'tipo', 'gestor_id', 'situacao', 'progresso',
+                   'erro', 'criada_em', 'atualizada_em', 'concluida_em')
+        return jsonify(repositorio.linha_como_dict(colunas, tarefa)), 200
+
+    except Exception as e:
+        print(f"Erro ao buscar tarefa {tarefa_id}: {e}")
+        return jsonify({"error": "Erro interno ao buscar tarefa."}), 500
+
+    finally:
+        release_db_connection(conn)
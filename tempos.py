@@ -0,0 +1,84 @@
+"""
+Cabeçalho Server-Timing com o tempo gasto em cada fase da requisição.
+
+Fases medidas: db-conexao (espera e empréstimo do pool), sql, bcrypt, jwt e
+storage, além de 'app' (tempo total dentro do Flask). Uma fase executada
+várias vezes aparece somada, com a quantidade na descrição.
+
+A medição é ligada com SERVER_TIMING_ENABLED=1 (todas as requisições) ou,
+por requisição, com o cabeçalho 'X-Server-Timing: <SERVER_TIMING_TOKEN>'.
+Fora disso medir() não faz nada além de um lookup em flask.g.
+"""
+import hmac
+import os
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+
+
+def habilitado_para_requisicao():
+    if os.getenv('SERVER_TIMING_ENABLED') == '1':
+        return True
+
+    token = os.getenv('SERVER_TIMING_TOKEN')
+    enviado = request.headers.get('X-Server-Timing')
+    # Em bytes: compare_digest recusa (TypeError) str com caracteres não ASCII
+    return bool(token and enviado) and hmac.compare_digest(token.encode('utf-8'),
+                                                           enviado.encode('utf-8'))
+
+
+def registrar_fase(fase, segundos):
+    """Soma 'segundos' à fase, se a requisição atual estiver sendo medida."""
+    if not has_request_context():
+        return
+    fases = g.get('fases_server_timing')
+    if fases is None:
+        return
+    total, quantidade = fases.get(fase, (0.0, 0))
+    fases[fase] = (total + segundos, quantidade + 1)
+
+
+@contextmanager
+def medir(fase):
+    """Cronometra o bloco como uma fase do Server-Timing."""
+    if not has_request_context() or g.get('fases_server_timing') is None:
+        yield
+        return
+
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        registrar_fase(fase, time.perf_counter() - inicio)
+
+
+def _antes_da_requisicao():
+    if habilitado_para_requisicao():
+        g.fases_server_timing = {}
+        g.inicio_server_timing = time.perf_counter()
+
+
+def _depois_da_requisicao(resposta):
+    fases = g.get('fases_server_timing')
+    if fases is None:
+        return resposta
+
+    metricas = []
+    for fase, (total, quantidade) in fases.items():
+        metrica = f"{fase};dur={total * 1000:.2f}"
+        if quantidade > 1:
+            metrica += f';desc="{quantidade}x"'
+        metricas.append(metrica)
+    total_app = time.perf_counter() - g.inicio_server_timing
+    metricas.append(f"app;dur={total_app * 1000:.2f}")
+
+    resposta.headers['Server-Timing'] = ', '.join(metricas)
+    # Permite que front-ends em outras origens leiam os tempos (Performance API)
+    resposta.headers['Timing-Allow-Origin'] = '*'
+    return resposta
+
+
+def registrar(app):
+    app.before_request(_antes_da_requisicao)
+    app.after_request(_depois_da_requisicao)